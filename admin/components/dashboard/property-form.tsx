@@ -82,6 +82,7 @@ export default function PropertyForm({ onValuationComplete }: PropertyFormProps)
           ...file,
           s3Url: result.images[idx]?.url || "",
           s3Key: result.images[idx]?.key || "",
+          s3Image: result.images[idx] || {}, // url/key + renditions (thumbnail_url, preview_url, ...)
         })),
       )
 
@@ -140,6 +141,7 @@ export default function PropertyForm({ onValuationComplete }: PropertyFormProps)
       const token = localStorage.getItem("access_token")
 
       const images = uploadedFiles.map((f) => ({
+        ...f.s3Image,
         filename: f.name,
         url: f.s3Url || "",
         key: f.s3Key || "",
@@ -1,6 +1,7 @@
 # model_artifacts/train_model.py
 import pandas as pd
 import numpy as np
+from pandas.api.types import union_categoricals
 from sklearn.model_selection import train_test_split
 import lightgbm as lgb
 from sklearn.pipeline import Pipeline
@@ -15,6 +16,13 @@ import json
 from datetime import datetime
 import logging
 import os
+import time
+import hashlib
+import tracemalloc
+import argparse
+import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # --- Thiết lập logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,8 +32,12 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_FILE_PATH = os.path.join(BASE_DIR, './chotot_bds_video_data.csv') # Dữ liệu ở thư mục gốc
 PREPROCESSOR_PATH = os.path.join(BASE_DIR, 'preprocessor.pkl')
 MODEL_PATH = os.path.join(BASE_DIR, 'lightgbm_model.txt')
+FAST_MODEL_PATH = os.path.join(BASE_DIR, 'lightgbm_model_fast.txt') # Model "fast tier" (distilled)
 METADATA_PATH = os.path.join(BASE_DIR, 'metadata.json')
 STATUS_PATH = os.path.join(BASE_DIR, 'training_status.json') # File ghi lại trạng thái
+SHARDS_DIR = os.path.join(BASE_DIR, 'shards') # Model theo từng region
+SHARD_MANIFEST_PATH = os.path.join(SHARDS_DIR, 'manifest.json')
+EXPLANATIONS_PATH = os.path.join(BASE_DIR, 'explanations.json') # Giải thích toàn cục (tính sẵn)
 
 def log_status(status, message, metrics=None):
     """Ghi lại trạng thái cuối cùng của quá trình training."""
@@ -39,38 +51,246 @@ def log_status(status, message, metrics=None):
         json.dump(status_data, f, ensure_ascii=False, indent=4)
     logging.info(f"Trạng thái training đã được ghi: {status}")
 
-def train_and_save_model():
-    """Hàm chính để thực hiện toàn bộ quy trình training."""
+# --- Định nghĩa đặc trưng và tham số model ---
+NUMERICAL_FEATURES = ['size', 'living_size', 'width', 'length', 'rooms', 'toilets', 'floors', 'longitude', 'latitude']
+CATEGORICAL_FEATURES = ['category', 'region', 'area']
+LGBM_PARAMS = {'objective': 'regression_l1', 'metric': 'mae', 'n_estimators': 2000, 'learning_rate': 0.01,
+               'feature_fraction': 0.8, 'bagging_fraction': 0.8, 'bagging_freq': 1, 'lambda_l1': 0.1,
+               'lambda_l2': 0.1, 'num_leaves': 31, 'verbose': -1, 'n_jobs': -1, 'seed': 42}
+
+# --- Cấu hình ingest dữ liệu ---
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "50000")) # Số dòng mỗi khối khi đọc CSV
+# Khoá nhận diện tin đăng trùng: mã tin đăng (toạ độ/diện tích/giá không đủ phân biệt các tin khác nhau)
+DEDUP_KEY_FIELD = 'ad_id'
+INGEST_DEDUP = os.getenv("INGEST_DEDUP", "0") == "1" # Mặc định tắt; đặt INGEST_DEDUP=1 để loại tin trùng ad_id
+
+# Tham số cho model "fast tier": ít cây và cây nông hơn để giảm chi phí predict/SHAP
+FAST_TIER_PARAMS = {'objective': 'regression_l2', 'n_estimators': 300, 'learning_rate': 0.05,
+                    'num_leaves': 15, 'max_depth': 6, 'min_child_samples': 20,
+                    'verbose': -1, 'n_jobs': -1, 'seed': 42}
+
+# Số process cho các bước chạy song song (shard theo region, tính giá trị đóng góp)
+WORKER_PROCESSES = int(os.getenv("TRAINING_WORKERS", str(os.cpu_count() or 1)))
+
+# Tham số cho model shard theo region: nhỏ hơn model toàn cục, mỗi worker dùng 1 luồng
+SHARD_PARAMS = {**LGBM_PARAMS, 'n_estimators': 1000, 'num_leaves': 15, 'n_jobs': 1}
+# Region có ít dòng hơn ngưỡng này sẽ dùng model toàn cục (global fallback)
+SHARD_MIN_ROWS = int(os.getenv("SHARD_MIN_ROWS", "300"))
+
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024 # Đọc file dữ liệu theo từng khối 1 MB khi hash
+
+def compute_input_fingerprint():
+    """
+    Fingerprint đầu vào training: SHA-256 của file CSV (đọc streaming theo khối, không load toàn bộ
+    vào bộ nhớ) kết hợp với danh sách đặc trưng và tham số LightGBM.
+    """
+    data_hash = hashlib.sha256()
+    with open(DATA_FILE_PATH, 'rb') as f:
+        for chunk in iter(lambda: f.read(FINGERPRINT_CHUNK_SIZE), b''):
+            data_hash.update(chunk)
+
+    config = {
+        "numerical_features": NUMERICAL_FEATURES,
+        "categorical_features": CATEGORICAL_FEATURES,
+        "lgbm_params": LGBM_PARAMS,
+        "fast_tier_params": FAST_TIER_PARAMS,
+        "shard_params": SHARD_PARAMS,
+        "shard_min_rows": SHARD_MIN_ROWS,
+        "dedup_key_field": DEDUP_KEY_FIELD if INGEST_DEDUP else None,
+    }
+    config_hash = hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+    combined = hashlib.sha256(f"{data_hash.hexdigest()}:{config_hash}".encode('utf-8')).hexdigest()
+    return {"data_sha256": data_hash.hexdigest(), "config_sha256": config_hash, "fingerprint": combined}
+
+def is_up_to_date(fingerprint, sharded=False):
+    """
+    True nếu mọi artifact mà lần chạy này sẽ tạo ra đều đã có và được huấn luyện từ đúng đầu vào này
+    (fingerprint khớp với metadata; với `sharded=True` còn phải khớp với shard manifest).
+    """
+    required = [METADATA_PATH, PREPROCESSOR_PATH, MODEL_PATH, FAST_MODEL_PATH, EXPLANATIONS_PATH]
+    if not all(os.path.exists(path) for path in required):
+        return False
+    try:
+        with open(METADATA_PATH, 'r', encoding='utf-8') as f:
+            previous = json.load(f).get("input_fingerprint", {})
+    except (OSError, json.JSONDecodeError):
+        return False
+    if previous.get("fingerprint") != fingerprint["fingerprint"]:
+        return False
+    return shards_up_to_date(fingerprint) if sharded else True
+
+def shards_up_to_date(fingerprint):
+    """True nếu shard manifest được tạo từ đúng đầu vào này và mọi file shard trong manifest đều còn."""
+    if not os.path.exists(SHARD_MANIFEST_PATH):
+        return False
+    try:
+        manifest = load_shard_manifest()
+    except (OSError, json.JSONDecodeError):
+        return False
+    if manifest.get("input_fingerprint") != fingerprint["fingerprint"]:
+        return False
+    return all(os.path.exists(os.path.join(SHARDS_DIR, info["model_file"])) for info in manifest["shards"].values())
+
+def measure_latency(booster, X, n_single=50):
+    """Đo độ trễ predict (ms) của một booster: từng dòng đơn lẻ và cả batch."""
+    single_rows = X.iloc[:n_single]
+    timings = []
+    for i in range(len(single_rows)):
+        start = time.perf_counter()
+        booster.predict(single_rows.iloc[[i]])
+        timings.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    booster.predict(X)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        "num_trees": booster.num_trees(),
+        "single_row_p50_ms": float(np.percentile(timings, 50)) if timings else None,
+        "single_row_p95_ms": float(np.percentile(timings, 95)) if timings else None,
+        "batch_ms_per_1k_rows": batch_ms / max(len(X), 1) * 1000,
+    }
+
+def train_fast_tier(full_model, X_train, X_test, y_test, categorical_features):
+    """
+    Distill model đầy đủ thành model "fast tier": huấn luyện trên giá trị dự đoán
+    của model đầy đủ (không phải giá thật) với ít cây và cây nông hơn.
+    Trả về (fast_model, tier_report) với so sánh độ chính xác và độ trễ của 2 tier.
+    """
+    teacher_pred = full_model.predict(X_train)
+    fast_model = lgb.LGBMRegressor(**FAST_TIER_PARAMS)
+    fast_model.fit(X_train, teacher_pred, categorical_feature=categorical_features)
+
+    full_pred = full_model.predict(X_test)
+    fast_pred = fast_model.predict(X_test)
+    tier_report = {}
+    for tier, model, pred in (("full", full_model, full_pred), ("fast", fast_model, fast_pred)):
+        tier_report[tier] = {
+            "mean_absolute_error": mean_absolute_error(y_test, pred),
+            "r2_score": r2_score(y_test, pred),
+            "latency": measure_latency(model.booster_, X_test),
+        }
+    # Độ lệch của fast tier so với model đầy đủ (chất lượng distillation)
+    tier_report["fast"]["mae_vs_full_model"] = mean_absolute_error(full_pred, fast_pred)
+    return fast_model, tier_report
+
+def _dedup_key_hashes(chunk):
+    """Hash 64-bit của mã tin đăng (DEDUP_KEY_FIELD) cho từng dòng."""
+    return pd.util.hash_pandas_object(chunk[DEDUP_KEY_FIELD].astype(str), index=False).values
+
+def load_training_data():
+    """
+    Đọc file CSV theo từng khối và trả về (X, y) gọn nhẹ:
+    - chỉ đọc các cột cần dùng, cột số ép về float32, cột categorical đọc thẳng thành 'category';
+    - nếu bật INGEST_DEDUP, loại tin trùng ad_id bằng tập hash duy trì xuyên suốt các khối.
+    Mọi khối đã lọc vẫn được giữ trong RAM cho tới bước ghép cột, nên bộ nhớ đỉnh khoảng gấp đôi
+    kích thước dữ liệu cuối cùng (nhưng không còn bản float64/object của toàn bộ CSV).
+    """
+    if not os.path.exists(DATA_FILE_PATH):
+        raise FileNotFoundError(f"Không tìm thấy file dữ liệu tại '{DATA_FILE_PATH}'")
+
+    seen_keys = set()
+    chunks = []
+    total_rows = 0
+    duplicates = 0
+    usecols = NUMERICAL_FEATURES + CATEGORICAL_FEATURES + ['price']
+    if INGEST_DEDUP:
+        usecols.append(DEDUP_KEY_FIELD)
+    reader = pd.read_csv(
+        DATA_FILE_PATH,
+        usecols=usecols,
+        dtype={**{col: 'float32' for col in NUMERICAL_FEATURES}, **{col: 'category' for col in CATEGORICAL_FEATURES}},
+        chunksize=INGEST_CHUNK_ROWS,
+    )
+    for chunk in reader:
+        total_rows += len(chunk)
+        chunk['price'] = pd.to_numeric(chunk['price'], errors='coerce')
+        chunk = chunk.dropna(subset=['price'])
+
+        if INGEST_DEDUP:
+            key_hashes = _dedup_key_hashes(chunk)
+            keep = ~pd.Series(key_hashes).duplicated().values & np.array([h not in seen_keys for h in key_hashes], dtype=bool)
+            seen_keys.update(key_hashes[keep].tolist())
+            duplicates += int((~keep).sum())
+            chunk = chunk[keep].drop(columns=DEDUP_KEY_FIELD)
+        chunks.append(chunk)
+
+    if not chunks:
+        raise ValueError("File dữ liệu không có dòng nào có giá hợp lệ.")
+    # Ghép từng cột; categories của các khối được gộp lại (mỗi chuỗi chỉ lưu một lần)
+    df = pd.DataFrame({
+        col: union_categoricals([c[col] for c in chunks], ignore_order=True) if col in CATEGORICAL_FEATURES
+        else np.concatenate([c[col].values for c in chunks])
+        for col in chunks[0].columns
+    })
+    del chunks
+    logging.info(f"✅ Tải thành công dữ liệu. {total_rows} dòng, loại {duplicates} tin trùng, còn {len(df)} dòng "
+                 f"({df.memory_usage(deep=True).sum() / 1024 ** 2:.1f} MB).")
+
+    y = df.pop('price')
+    return df[NUMERICAL_FEATURES + CATEGORICAL_FEATURES], y
+
+def profile_ingest():
+    """So sánh bộ nhớ đỉnh (tracemalloc) giữa cách đọc cũ (toàn bộ CSV, float64/object) và ingest theo khối."""
+    def legacy_ingest():
+        df = pd.read_csv(DATA_FILE_PATH)
+        df['price'] = pd.to_numeric(df['price'], errors='coerce')
+        df.dropna(subset=['price'], inplace=True)
+        X = df[NUMERICAL_FEATURES + CATEGORICAL_FEATURES].copy()
+        for col in CATEGORICAL_FEATURES:
+            X[col] = X[col].astype('category')
+        return X, df['price']
+
+    report = {}
+    for name, loader in (("legacy", legacy_ingest), ("chunked", load_training_data)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        X, _ = loader()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report[name] = {"rows": len(X), "peak_mb": peak / 1024 ** 2,
+                        "result_mb": X.memory_usage(deep=True).sum() / 1024 ** 2, "seconds": elapsed}
+        logging.info(f"[{name}] {len(X)} dòng | bộ nhớ đỉnh {report[name]['peak_mb']:.1f} MB | "
+                     f"kết quả {report[name]['result_mb']:.1f} MB | {elapsed:.2f} s")
+        del X
+    return report
+
+def train_and_save_model(force=False, sharded=False):
+    """
+    Hàm chính để thực hiện toàn bộ quy trình training.
+    Bỏ qua (status SKIPPED) nếu dữ liệu, đặc trưng và tham số không đổi so với lần trước và mọi artifact
+    (gồm cả shard khi `sharded=True`) đã có, trừ khi `force=True`.
+    """
     try:
         # ==============================================================================
-        # BƯỚC 1: TẢI DỮ LIỆU
+        # BƯỚC 0: KIỂM TRA FINGERPRINT ĐẦU VÀO
         # ==============================================================================
-        logging.info("--- BƯỚC 1: TẢI DỮ LIỆU TỪ FILE CSV ---")
+        logging.info("--- BƯỚC 0: KIỂM TRA FINGERPRINT ĐẦU VÀO ---")
         if not os.path.exists(DATA_FILE_PATH):
             raise FileNotFoundError(f"Không tìm thấy file dữ liệu tại '{DATA_FILE_PATH}'")
-        
-        df = pd.read_csv(DATA_FILE_PATH)
-        logging.info(f"✅ Tải thành công dữ liệu. Tổng cộng có {len(df)} dòng.")
+        fingerprint = compute_input_fingerprint()
+        logging.info(f"Fingerprint đầu vào: {fingerprint['fingerprint']}")
+        if not force and is_up_to_date(fingerprint, sharded=sharded):
+            logging.info("⏭️ Đầu vào không thay đổi so với model hiện tại, bỏ qua training.")
+            log_status("SKIPPED", "Dữ liệu, đặc trưng và tham số không đổi; giữ nguyên model hiện tại.",
+                       {"input_fingerprint": fingerprint["fingerprint"]})
+            return False
+
+        # ==============================================================================
+        # BƯỚC 1: TẢI DỮ LIỆU
+        # ==============================================================================
+        logging.info("--- BƯỚC 1: TẢI DỮ LIỆU TỪ FILE CSV ---")
+        X, y = load_training_data()
 
         # ==============================================================================
         # BƯỚC 2: TIỀN XỬ LÝ VÀ XÂY DỰNG PIPELINE
         # ==============================================================================
         logging.info("\n--- BƯỚC 2: TIỀN XỬ LÝ VÀ XÂY DỰNG PIPELINE ---")
-        if df['price'].dtype == 'object':
-            df['price'] = pd.to_numeric(df['price'], errors='coerce')
-        df.dropna(subset=['price'], inplace=True)
-
-        y = df['price']
-        numerical_features = ['size', 'living_size', 'width', 'length', 'rooms', 'toilets', 'floors', 'longitude', 'latitude']
-        categorical_features = ['category', 'region', 'area']
-        X = df[numerical_features + categorical_features].copy()
+        numerical_features = NUMERICAL_FEATURES
+        categorical_features = CATEGORICAL_FEATURES
 
         # >>> THAY ĐỔI LỚN BẮT ĐẦU TỪ ĐÂY <<<
-        # Chuyển đổi các cột categorical sang kiểu 'category' của pandas
-        # Đây là bước quan trọng để LightGBM nhận biết và xử lý chúng một cách tối ưu.
-        for col in categorical_features:
-            X[col] = X[col].astype('category')
-        logging.info("✅ Đã chuyển đổi các cột categorical sang dtype 'category' của Pandas.")
 
         # Pipeline cho biến số chỉ cần điền giá trị thiếu
         numerical_transformer = Pipeline(steps=[('imputer', SimpleImputer(strategy='median'))])
@@ -106,12 +326,8 @@ def train_and_save_model():
         X_test_processed = preprocessor.transform(X_test)
 
 
-        params = {'objective': 'regression_l1', 'metric': 'mae', 'n_estimators': 2000, 'learning_rate': 0.01,
-                  'feature_fraction': 0.8, 'bagging_fraction': 0.8, 'bagging_freq': 1, 'lambda_l1': 0.1,
-                  'lambda_l2': 0.1, 'num_leaves': 31, 'verbose': -1, 'n_jobs': -1, 'seed': 42}
-        
         logging.info("Bắt đầu huấn luyện LightGBM...")
-        lgbm_model = lgb.LGBMRegressor(**params)
+        lgbm_model = lgb.LGBMRegressor(**LGBM_PARAMS)
 
         # >>> THAY ĐỔI QUAN TRỌNG KHI HUẤN LUYỆN <<<
         # Chúng ta cần chỉ cho LightGBM biết những cột nào là categorical
@@ -147,13 +363,35 @@ def train_and_save_model():
         lgbm_model.booster_.save_model(MODEL_PATH)
         logging.info(f"✅ Model đã được lưu tại: {MODEL_PATH}")
 
-        metadata = {"model_version": "1.2.0", "training_data_shape": str(X_train.shape), "performance_metrics": metrics}
+        # ==============================================================================
+        # BƯỚC 6: DISTILL MODEL "FAST TIER"
+        # ==============================================================================
+        logging.info("\n--- BƯỚC 6: DISTILL MODEL FAST TIER ---")
+        fast_model, tier_report = train_fast_tier(lgbm_model, X_train, X_test, y_test, categorical_features)
+        for tier, report in tier_report.items():
+            logging.info(f"[{tier}] {report['latency']['num_trees']} cây | MAE: {report['mean_absolute_error']:,.0f} VND | "
+                         f"R2: {report['r2_score']:.4f} | p50 1 dòng: {report['latency']['single_row_p50_ms']:.2f} ms")
+        fast_model.booster_.save_model(FAST_MODEL_PATH)
+        logging.info(f"✅ Model fast tier đã được lưu tại: {FAST_MODEL_PATH}")
+
+        # ==============================================================================
+        # BƯỚC 7: TÍNH SẴN GIẢI THÍCH TOÀN CỤC (SONG SONG)
+        # ==============================================================================
+        logging.info("\n--- BƯỚC 7: TÍNH SẴN GIẢI THÍCH TOÀN CỤC ---")
+        explanations = build_global_explanations(lgbm_model.booster_, X_test)
+        with open(EXPLANATIONS_PATH, 'w', encoding='utf-8') as f:
+            json.dump(explanations, f, ensure_ascii=False, indent=4)
+        logging.info(f"✅ Giải thích toàn cục ({len(X_test)} dòng test) đã được lưu tại: {EXPLANATIONS_PATH}")
+
+        metadata = {"model_version": "1.2.0", "training_data_shape": str(X_train.shape), "performance_metrics": metrics,
+                    "tiers": tier_report, "input_fingerprint": fingerprint}
         with open(METADATA_PATH, 'w', encoding='utf-8') as f:
             json.dump(metadata, f, ensure_ascii=False, indent=4)
         logging.info(f"✅ Metadata đã được lưu tại: {METADATA_PATH}")
 
         # Ghi lại trạng thái thành công
         log_status("SUCCESS", "Quy trình huấn luyện và lưu model hoàn tất.", metrics)
+        return True
 
     except Exception as e:
         # Ghi lại lỗi và trạng thái thất bại
@@ -161,5 +399,195 @@ def train_and_save_model():
         log_status("FAILED", str(e))
         sys.exit(1) # Thoát với mã lỗi
 
+# --- Giải thích toàn cục (global explanations) tính sẵn lúc training ---
+EXPLAIN_CHUNK_ROWS = 500 # Số dòng mỗi khối gửi cho một worker
+EXPLAIN_MIN_GROUP_ROWS = 5 # Bỏ các nhóm category/area quá ít dòng để artifact gọn
+DEPENDENCE_BINS = 10
+
+_contrib_booster = None
+
+def _init_contrib_worker(model_str):
+    """Khởi tạo worker: load booster một lần cho mỗi process."""
+    global _contrib_booster
+    _contrib_booster = lgb.Booster(model_str=model_str)
+
+def _compute_contrib_chunk(X_chunk):
+    """Worker: tính giá trị đóng góp (SHAP của LightGBM) cho một khối dữ liệu."""
+    return _contrib_booster.predict(X_chunk, pred_contrib=True, num_threads=1)
+
+def compute_contributions(booster, X):
+    """Tính giá trị đóng góp cho X theo từng khối trên process pool. Trả về mảng (n_rows, n_features + 1)."""
+    chunks = [X.iloc[i:i + EXPLAIN_CHUNK_ROWS] for i in range(0, len(X), EXPLAIN_CHUNK_ROWS)]
+    with ProcessPoolExecutor(max_workers=WORKER_PROCESSES, initializer=_init_contrib_worker,
+                             initargs=(booster.model_to_string(),)) as executor:
+        results = list(executor.map(_compute_contrib_chunk, chunks))
+    return np.vstack(results)
+
+def _group_mean_contributions(X, contrib_df, column):
+    """Trung bình giá trị đóng góp của từng đặc trưng theo từng giá trị của `column`."""
+    grouped = contrib_df.groupby(X[column].astype(str).values)
+    counts = grouped.size()
+    means = grouped.mean()
+    return {
+        str(group): {"rows": int(counts[group]), "mean_contributions": {k: float(v) for k, v in means.loc[group].items()}}
+        for group in counts.index if counts[group] >= EXPLAIN_MIN_GROUP_ROWS
+    }
+
+def build_global_explanations(booster, X):
+    """
+    Tổng hợp giá trị đóng góp trên X thành các artifact gọn cho dashboard:
+    mean |contribution| toàn cục, trung bình theo category/area và đường dependence theo bin.
+    """
+    feature_names = booster.feature_name()
+    contrib = compute_contributions(booster, X)
+    contrib_df = pd.DataFrame(contrib[:, :-1], columns=feature_names, index=X.index)
+
+    global_importance = contrib_df.abs().mean().sort_values(ascending=False)
+
+    dependence = {}
+    for feature in NUMERICAL_FEATURES:
+        values = X[feature].astype('float64')
+        valid = values.notna()
+        if valid.sum() < DEPENDENCE_BINS:
+            continue
+        bins = pd.qcut(values[valid], q=DEPENDENCE_BINS, duplicates='drop')
+        stats = contrib_df.loc[valid, feature].groupby(bins, observed=True).agg(['mean', 'size'])
+        dependence[feature] = [
+            {"bin_left": float(interval.left), "bin_right": float(interval.right),
+             "rows": int(row['size']), "mean_contribution": float(row['mean'])}
+            for interval, row in stats.iterrows()
+        ]
+
+    return {
+        "generated_at_utc": datetime.utcnow().isoformat(),
+        "rows": len(X),
+        "base_value": float(contrib[0, -1]) if len(contrib) else None,
+        "global_importance": {k: float(v) for k, v in global_importance.items()},
+        "by_category": _group_mean_contributions(X, contrib_df, 'category'),
+        "by_area": _group_mean_contributions(X, contrib_df, 'area'),
+        "dependence": dependence,
+    }
+
+def shard_file_name(region):
+    """Tên file ASCII ổn định cho shard của một region (vd: 'Tp Hồ Chí Minh' -> 'tp_ho_chi_minh.txt')."""
+    ascii_name = unicodedata.normalize('NFKD', region.replace('Đ', 'D').replace('đ', 'd'))
+    ascii_name = ascii_name.encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '_', ascii_name.lower()).strip('_') + '.txt'
+
+def _train_region_shard(region, X_region, y_region):
+    """Worker: huấn luyện và lưu model cho một region. Chạy trong process riêng."""
+    X_train, X_test, y_train, y_test = train_test_split(X_region, y_region, test_size=0.2, random_state=42)
+    shard_model = lgb.LGBMRegressor(**SHARD_PARAMS)
+    shard_model.fit(X_train, y_train,
+                    eval_set=[(X_test, y_test)],
+                    eval_metric='mae',
+                    callbacks=[lgb.early_stopping(50, verbose=False)],
+                    categorical_feature=CATEGORICAL_FEATURES)
+    y_pred = shard_model.predict(X_test)
+
+    file_name = shard_file_name(region)
+    shard_model.booster_.save_model(os.path.join(SHARDS_DIR, file_name))
+    return {
+        "model_file": file_name,
+        "rows": len(X_region),
+        "num_trees": shard_model.booster_.num_trees(),
+        "mean_absolute_error": mean_absolute_error(y_test, y_pred),
+        "r2_score": r2_score(y_test, y_pred),
+        "trained_at_utc": datetime.utcnow().isoformat(),
+    }
+
+def load_shard_manifest():
+    if os.path.exists(SHARD_MANIFEST_PATH):
+        with open(SHARD_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {"fallback_model": os.path.basename(MODEL_PATH), "shards": {}}
+
+def remove_unlisted_shards(manifest):
+    """Xoá file shard không còn trong manifest (region giờ dùng model toàn cục)."""
+    listed = {info["model_file"] for info in manifest["shards"].values()}
+    for file_name in os.listdir(SHARDS_DIR):
+        if file_name.endswith('.txt') and file_name not in listed:
+            os.remove(os.path.join(SHARDS_DIR, file_name))
+            logging.info(f"🗑️ Đã xoá shard cũ: {file_name}")
+
+def train_region_shards(regions=None):
+    """
+    Huấn luyện model theo từng region song song trên nhiều process và cập nhật manifest.
+    `regions=None`: huấn luyện lại tất cả region đủ dữ liệu; ngược lại chỉ các region được chỉ định.
+    Region không đủ dữ liệu (< SHARD_MIN_ROWS) sẽ dùng model toàn cục khi phục vụ.
+    """
+    logging.info("\n--- HUẤN LUYỆN MODEL THEO REGION (SHARDED) ---")
+    X, y = load_training_data()
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+
+    region_counts = X['region'].value_counts()
+    eligible = [r for r, n in region_counts.items() if n >= SHARD_MIN_ROWS]
+    if regions:
+        unknown = [r for r in regions if r not in eligible]
+        if unknown:
+            raise ValueError(f"Region không có hoặc không đủ {SHARD_MIN_ROWS} dòng dữ liệu: {unknown}")
+        eligible = list(regions)
+    logging.info(f"Sẽ huấn luyện {len(eligible)} shard với {WORKER_PROCESSES} worker; "
+                 f"{len(region_counts) - len(eligible)} region còn lại dùng model toàn cục.")
+
+    manifest = load_shard_manifest()
+    if not regions:
+        # Huấn luyện lại toàn bộ: region không còn đủ dữ liệu không được giữ shard cũ
+        manifest["shards"] = {}
+    with ProcessPoolExecutor(max_workers=WORKER_PROCESSES) as executor:
+        futures = {}
+        for region in eligible:
+            mask = X['region'] == region
+            futures[executor.submit(_train_region_shard, region, X[mask], y[mask])] = region
+        for future in as_completed(futures):
+            region = futures[future]
+            shard_info = future.result()
+            manifest["shards"][region] = shard_info
+            logging.info(f"✅ Shard '{region}': {shard_info['rows']} dòng, {shard_info['num_trees']} cây, "
+                         f"MAE {shard_info['mean_absolute_error']:,.0f} VND")
+
+    manifest["updated_at_utc"] = datetime.utcnow().isoformat()
+    if not regions:
+        # Chỉ ghi fingerprint khi mọi shard được huấn luyện lại từ dữ liệu hiện tại
+        manifest["input_fingerprint"] = compute_input_fingerprint()["fingerprint"]
+    with open(SHARD_MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    logging.info(f"✅ Shard manifest đã được lưu tại: {SHARD_MANIFEST_PATH}")
+    if not regions:
+        remove_unlisted_shards(manifest)
+    return manifest
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Huấn luyện model ước tính giá bất động sản.")
+    parser.add_argument('--sharded', action='store_true',
+                        help="Sau model toàn cục, huấn luyện thêm model riêng cho từng region.")
+    parser.add_argument('--force', action='store_true',
+                        help="Huấn luyện lại kể cả khi fingerprint đầu vào không đổi.")
+    parser.add_argument('--profile-ingest', action='store_true',
+                        help="Chỉ so sánh bộ nhớ đỉnh giữa cách đọc CSV cũ và ingest theo khối, không huấn luyện.")
+    parser.add_argument('--region', action='append',
+                        help="Chỉ huấn luyện lại shard của region này (có thể lặp lại), bỏ qua model toàn cục.")
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    train_and_save_model()
\ No newline at end of file
+    args = parse_args()
+    if args.profile_ingest:
+        profile_ingest()
+    elif args.region:
+        try:
+            manifest = train_region_shards(args.region)
+            log_status("SUCCESS", f"Huấn luyện lại shard cho region: {', '.join(args.region)}.",
+                       {r: manifest["shards"][r] for r in args.region})
+        except Exception as e:
+            logging.error(f"❌ HUẤN LUYỆN SHARD THẤT BẠI: {e}", exc_info=True)
+            log_status("FAILED", str(e))
+            sys.exit(1)
+    else:
+        trained = train_and_save_model(force=args.force, sharded=args.sharded)
+        if args.sharded and trained:
+            try:
+                train_region_shards()
+            except Exception as e:
+                logging.error(f"❌ HUẤN LUYỆN SHARD THẤT BẠI: {e}", exc_info=True)
+                log_status("FAILED", str(e))
+                sys.exit(1)
\ No newline at end of file
@@ -1,10 +1,13 @@
 # app/main.py
 import os
+import json
+import threading
 import joblib
 import lightgbm as lgb
 import pandas as pd
 import shap  # Thêm thư viện SHAP
-from fastapi import FastAPI, HTTPException
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Query, Header
 from . import schemas
 
 # --- KHỞI TẠO ỨNG DỤNG VÀ LOAD MODEL ---
@@ -30,19 +33,79 @@ if not MODEL_PATH:
         MODEL_PATH = "./lightgbm_model.txt"
     else:
         MODEL_PATH = "../model_artifacts/lightgbm_model.txt"
+# Model "fast tier" (distilled, ít cây hơn) nằm cạnh model đầy đủ
+FAST_MODEL_PATH = os.getenv("FAST_MODEL_PATH") or os.path.join(
+    os.path.dirname(MODEL_PATH), "lightgbm_model_fast.txt"
+)
+# Request có latency budget (header X-Latency-Budget-Ms) dưới ngưỡng này sẽ dùng fast tier
+FAST_TIER_BUDGET_MS = float(os.getenv("FAST_TIER_BUDGET_MS", "50"))
+
+def load_model_and_explainer(path):
+    """Load một LightGBM booster và SHAP explainer tương ứng. Trả về (None, None) nếu thiếu file."""
+    try:
+        booster = lgb.Booster(model_file=path)
+        # Khởi tạo SHAP explainer ngay từ đầu để tái sử dụng
+        return booster, shap.TreeExplainer(booster)
+    except Exception as e:
+        print(f"❌ LỖI: Không load được model tại {path}. Chi tiết: {e}")
+        return None, None
+
 # Load model và SHAP explainer khi ứng dụng khởi động
-try:
-    model = lgb.Booster(model_file=MODEL_PATH)
-    print("✅ Mô hình LightGBM đã được load thành công.")
-    
-    # Khởi tạo SHAP explainer ngay từ đầu để tái sử dụng
-    explainer = shap.TreeExplainer(model)
-    print("✅ SHAP Explainer đã được khởi tạo thành công.")
-    
-except FileNotFoundError as e:
-    print(f"❌ LỖI: Không tìm thấy file model. Chi tiết: {e}")
-    model = None
-    explainer = None
+model, explainer = load_model_and_explainer(MODEL_PATH)
+if model:
+    print("✅ Mô hình LightGBM và SHAP Explainer đã được load thành công.")
+
+fast_model, fast_explainer = (None, None)
+if os.path.exists(FAST_MODEL_PATH):
+    fast_model, fast_explainer = load_model_and_explainer(FAST_MODEL_PATH)
+    if fast_model:
+        print(f"✅ Model fast tier đã được load ({fast_model.num_trees()} cây).")
+
+# --- MODEL THEO REGION (SHARD) ---
+# Manifest do `train_model.py --sharded` tạo ra; shard chỉ được load khi có request cho region đó
+SHARD_MANIFEST_PATH = os.getenv("SHARD_MANIFEST_PATH") or os.path.join(
+    os.path.dirname(MODEL_PATH), "shards", "manifest.json"
+)
+shard_manifest = {}
+if os.path.exists(SHARD_MANIFEST_PATH):
+    with open(SHARD_MANIFEST_PATH, "r", encoding="utf-8") as f:
+        shard_manifest = json.load(f).get("shards", {})
+    print(f"✅ Shard manifest: {len(shard_manifest)} region có model riêng.")
+
+loaded_shards = {}
+shard_lock = threading.Lock()
+
+def get_region_shard(region: str):
+    """Trả về (booster, explainer) của shard cho region, load lười ở lần đầu. None nếu không có shard."""
+    shard_info = shard_manifest.get(region)
+    if not shard_info:
+        return None
+    if region not in loaded_shards:
+        with shard_lock:
+            if region not in loaded_shards:
+                path = os.path.join(os.path.dirname(SHARD_MANIFEST_PATH), shard_info["model_file"])
+                booster, shard_explainer = load_model_and_explainer(path)
+                # Lưu cả kết quả thất bại để không thử load lại ở mỗi request
+                loaded_shards[region] = (booster, shard_explainer) if booster else None
+    return loaded_shards[region]
+
+# --- GIẢI THÍCH TOÀN CỤC (TÍNH SẴN LÚC TRAINING) ---
+EXPLANATIONS_PATH = os.getenv("EXPLANATIONS_PATH") or os.path.join(
+    os.path.dirname(MODEL_PATH), "explanations.json"
+)
+global_explanations = None
+if os.path.exists(EXPLANATIONS_PATH):
+    with open(EXPLANATIONS_PATH, "r", encoding="utf-8") as f:
+        global_explanations = json.load(f)
+    print("✅ Giải thích toàn cục đã được load.")
+
+def select_tier(tier: Optional[str], latency_budget_ms: Optional[float]) -> str:
+    """Chọn tier cho request: ưu tiên tham số `tier`, sau đó tới latency budget."""
+    if tier is None and latency_budget_ms is not None and latency_budget_ms < FAST_TIER_BUDGET_MS:
+        tier = "fast"
+    if tier == "fast" and fast_model and fast_explainer:
+        return "fast"
+    return "full"
 
 # --- ĐỊNH NGHĨA CÁC ENDPOINTS ---
 
@@ -51,15 +114,49 @@ def read_root():
     """Endpoint gốc để kiểm tra trạng thái của API."""
     return {"status": "OK", "message": "Chào mừng đến với API Ước tính Giá trị Bất động sản!"}
 
+@app.get("/explanations",
+         tags=["Explanation"],
+         summary="Giải thích toàn cục của model (tính sẵn lúc training)")
+def get_global_explanations(
+    section: Optional[str] = Query(None, pattern="^(global_importance|by_category|by_area|dependence)$",
+                                   description="Chỉ trả về một phần của artifact")
+):
+    """
+    Trả về mức độ quan trọng toàn cục, đóng góp trung bình theo loại BĐS/quận huyện và
+    đường dependence của các đặc trưng số. Không tính toán gì theo request.
+    """
+    if global_explanations is None:
+        raise HTTPException(status_code=503, detail="Chưa có artifact giải thích toàn cục.")
+    if section:
+        return {"generated_at_utc": global_explanations.get("generated_at_utc"),
+                section: global_explanations.get(section, {})}
+    return global_explanations
+
 @app.post("/predict", 
           response_model=schemas.PredictionResponse, 
           tags=["Prediction"],
           summary="Dự đoán và phân tích giá bất động sản")
-def predict_price(features: schemas.RealEstateFeatures):
+def predict_price(
+    features: schemas.RealEstateFeatures,
+    tier: Optional[str] = Query(None, pattern="^(full|fast)$", description="Tier model: 'full' hoặc 'fast' (xem trước nhanh)"),
+    latency_budget_ms: Optional[float] = Header(None, alias="X-Latency-Budget-Ms"),
+):
     """
     Nhận các đặc điểm của bất động sản, trả về giá trị ước tính và phân tích chi tiết.
+
+    Dùng `?tier=fast` hoặc header `X-Latency-Budget-Ms` nhỏ để chọn model fast tier
+    (ít cây hơn, rẻ hơn) cho các bản xem trước trên form.
     """
-    if not model or not explainer:
+    selected_tier = select_tier(tier, latency_budget_ms)
+    tier_model, tier_explainer = (fast_model, fast_explainer) if selected_tier == "fast" else (model, explainer)
+    # Tier đầy đủ ưu tiên model riêng của region nếu có, còn lại dùng model toàn cục
+    shard_region = None
+    if selected_tier == "full":
+        shard = get_region_shard(features.region)
+        if shard:
+            tier_model, tier_explainer = shard
+            shard_region = features.region
+    if not tier_model or not tier_explainer:
         raise HTTPException(status_code=503, detail="Model hoặc Explainer không sẵn sàng.")
 
     # 1. Chuyển Pydantic model thành pandas DataFrame
@@ -75,7 +172,7 @@ def predict_price(features: schemas.RealEstateFeatures):
 
     # 3. Thực hiện dự đoán
     try:
-        prediction = model.predict(input_df)
+        prediction = tier_model.predict(input_df)
         estimated_price = prediction[0]
         print(f"\n--- Kết quả dự đoán (VND) ---\n{estimated_price:,.0f} VND")
     except Exception as e:
@@ -84,11 +181,11 @@ def predict_price(features: schemas.RealEstateFeatures):
     # 4. Phân tích dự đoán bằng SHAP
     try:
         # Tính toán giá trị SHAP
-        shap_values_array = explainer.shap_values(input_df)
+        shap_values_array = tier_explainer.shap_values(input_df)
         
         # Lấy các thông tin cần thiết
-        base_value = explainer.expected_value
-        feature_names = model.feature_name()
+        base_value = tier_explainer.expected_value
+        feature_names = tier_model.feature_name()
         
         # Ghép tên cột và giá trị SHAP
         shap_dict = dict(zip(feature_names, shap_values_array[0]))
@@ -111,6 +208,8 @@ def predict_price(features: schemas.RealEstateFeatures):
         print(f"Lỗi khi tính toán SHAP: {e}")
         return schemas.PredictionResponse(
             estimated_price_vnd=estimated_price,
+            tier_used=selected_tier,
+            shard_region=shard_region,
             analysis=schemas.PredictionAnalysis(
                 base_price_vnd=0,
                 factors=[schemas.ShapFactor(feature="error", value=str(e), shap_value=0)]
@@ -120,6 +219,8 @@ def predict_price(features: schemas.RealEstateFeatures):
     # 5. Xây dựng và trả về response cuối cùng
     return schemas.PredictionResponse(
         estimated_price_vnd=estimated_price,
+        tier_used=selected_tier,
+        shard_region=shard_region,
         analysis=schemas.PredictionAnalysis(
             base_price_vnd=base_value,
             factors=analysis_factors
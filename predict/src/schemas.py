@@ -32,4 +32,6 @@ class PredictionAnalysis(BaseModel):
 class PredictionResponse(BaseModel):
     """Schema cho kết quả trả về của API"""
     estimated_price_vnd: float = Field(..., example=6150450123, description="Giá trị ước tính cuối cùng (VNĐ)")
+    tier_used: str = Field("full", example="full", description="Tier model đã dùng để dự đoán ('full' hoặc 'fast')")
+    shard_region: Optional[str] = Field(None, example="Tp Hồ Chí Minh", description="Region của model shard đã dùng (None nếu dùng model toàn cục)")
     analysis: PredictionAnalysis = Field(..., description="Phân tích chi tiết các yếu tố ảnh hưởng đến giá")
\ No newline at end of file
@@ -0,0 +1,357 @@
+# bench_e2e.py - Benchmark end-to-end: warp (uvicorn, process riêng) với OpenAI / S3 / SMTP giả lập local
+#
+# Usage:
+#   python benchmarks/bench_e2e.py [--users 4] [--iterations 3] [--images 4] [--llm-latency-ms 800]
+#                                  [--s3-latency-ms 20] [--llm-responses canned.json] [--cache-hits]
+#                                  [--database-url postgresql://...] [--json result.json]
+# Không cần mạng / credentials thật: fake_llm_server, fake_s3_server và fake_smtp_server chạy trong process này,
+# server warp được trỏ sang chúng bằng biến môi trường. Mỗi virtual user (chạy đồng thời):
+#   register -> verify-email (token lấy từ email trong SMTP sink) -> login, rồi lặp --iterations lần
+#   upload-and-analyze -> POST /api/reports -> GET /api/reports -> GET /api/reports/{id}.
+# Báo cáo throughput, p50/p95/p99 theo endpoint, các stage của upload-and-analyze (timings trong response)
+# và event-loop lag của server (đo bằng task trong chính process server). Có request lỗi -> exit code 1 (CI).
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from io import BytesIO
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, "..", "src")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SRC_DIR)
+
+from percentiles import percentile_stats  # noqa: E402
+
+LAG_INTERVAL_SECONDS = 0.01
+PASSWORD = "bench-password"
+# Giá trị trong timings không phải thời gian (ms)
+NON_TIME_STAGES = ("deduplicated", "spooled_to_disk")
+NON_TIME_SUFFIXES = ("_kb", "_mb", "quality")
+
+
+# =====================================================
+# SERVER (process con): warp + task đo event-loop lag
+# =====================================================
+
+def serve(port: int) -> None:
+    import uvicorn
+    import main as warp_main
+
+    samples = deque(maxlen=200_000)
+
+    async def sample_loop_lag():
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL_SECONDS)
+            samples.append((time.perf_counter() - start - LAG_INTERVAL_SECONDS) * 1000)
+
+    @warp_main.app.on_event("startup")
+    async def start_lag_sampler():
+        asyncio.create_task(sample_loop_lag())
+
+    @warp_main.app.get("/__bench/loop-lag")
+    async def loop_lag(reset: bool = False):
+        lag = list(samples)
+        if reset:
+            samples.clear()
+        return _summary(lag)
+
+    uvicorn.run(warp_main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+# =====================================================
+# DRIVER
+# =====================================================
+
+def _summary(values) -> dict:
+    return {
+        "count": len(values),
+        **percentile_stats(values, quantiles=(0.5, 0.95, 0.99)),
+        "max": round(max(values), 1) if values else 0.0
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _image_pool(count: int, size) -> list:
+    from bench_gating import _room
+
+    rng = np.random.default_rng(11)
+    pool = []
+    for _ in range(count):
+        buffered = BytesIO()
+        _room(rng, size=size).save(buffered, format="JPEG", quality=90)
+        pool.append(buffered.getvalue())
+    return pool
+
+
+def _report_payload(result: dict) -> dict:
+    """Body POST /api/reports từ kết quả upload-and-analyze (như frontend gửi sau khi user xác nhận form)"""
+    info = result["data"].get("property_info") or {}
+    condition = result["data"].get("condition_assessment") or {}
+    return {
+        "address": info.get("address") or "N/A",
+        "property_type": info.get("property_type") or "N/A",
+        "land_area": info.get("land_area_m2"),
+        "usable_area": info.get("usable_area_m2") or 0,
+        "bedrooms": info.get("bedrooms") or 0,
+        "bathrooms": info.get("bathrooms") or 0,
+        "floors": info.get("floors") or 0,
+        "direction": info.get("direction") or "N/A",
+        "legal_status": info.get("legal_status") or "N/A",
+        "furniture": info.get("furniture_status") or "N/A",
+        "width": info.get("width_m"),
+        "length": info.get("length_m"),
+        "overall_condition": condition.get("overall_condition") or "N/A",
+        "cleanliness": condition.get("cleanliness") or "N/A",
+        "maintenance_status": condition.get("maintenance_status") or "N/A",
+        "major_issues": condition.get("major_issues") or [],
+        "overall_description": condition.get("overall_description") or "N/A",
+        "images": result["images"],
+        "ai_analysis_raw": result["data"]
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(list)
+        self.stages = defaultdict(list)
+        self.image_stages = defaultdict(list)
+
+    async def call(self, client, endpoint: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception as e:
+            self.errors[endpoint].append(f"{type(e).__name__}: {e}")
+            return None
+        self.latencies[endpoint].append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            self.errors[endpoint].append(f"{response.status_code}: {response.text[:200]}")
+            return None
+        return response
+
+    def add_timings(self, timings: dict) -> None:
+        """Stage (ms) của request và của từng ảnh"""
+        groups = [(self.stages, timings)] + [(self.image_stages, image) for image in timings.get("images", [])]
+        for target, stages in groups:
+            for stage, value in stages.items():
+                if isinstance(value, (int, float)) and stage not in NON_TIME_STAGES and not stage.endswith(NON_TIME_SUFFIXES):
+                    target[stage].append(value)
+
+
+async def _signup(client, recorder: Recorder, inbox, index: int) -> str:
+    """register -> verify-email -> login; trả về access token"""
+    email = f"bench{index}-{int(time.time())}@example.com"
+    await recorder.call(client, "POST /api/auth/register", "POST", "/api/auth/register",
+                        json={"email": email, "password": PASSWORD, "name": f"Bench {index}"})
+    token = await asyncio.to_thread(inbox.wait_for_link, email)
+    if token is None:
+        raise RuntimeError(f"No verification email for {email}")
+    await recorder.call(client, "GET /api/auth/verify-email", "GET", "/api/auth/verify-email", params={"token": token})
+    response = await recorder.call(client, "POST /api/auth/login", "POST", "/api/auth/login",
+                                   json={"email": email, "password": PASSWORD})
+    if response is None:
+        raise RuntimeError(f"Login failed for {email}")
+    return response.json()["access_token"]
+
+
+async def _user_session(client, recorder: Recorder, access_token: str, index: int, args, pool: list) -> None:
+    headers = {"Authorization": f"Bearer {access_token}"}
+    for iteration in range(args.iterations):
+        files = []
+        for n in range(args.images):
+            content = pool[(index * args.images + n) % len(pool)]
+            if not args.cache_hits:
+                # Byte thêm sau EOI: ảnh y hệt nhưng SHA-256 khác -> không trúng analysis cache / blob dedup
+                content += f"bench-{index}-{iteration}-{n}".encode()
+            files.append(("files", (f"u{index}_i{iteration}_{n}.jpg", content, "image/jpeg")))
+        response = await recorder.call(client, "POST /api/analysis/upload-and-analyze", "POST",
+                                       "/api/analysis/upload-and-analyze", files=files, headers=headers)
+        if response is None:
+            continue
+        result = response.json()
+        recorder.add_timings(result.get("timings") or {})
+
+        response = await recorder.call(client, "POST /api/reports", "POST", "/api/reports",
+                                       json=_report_payload(result), headers=headers)
+        await recorder.call(client, "GET /api/reports", "GET", "/api/reports", headers=headers)
+        if response is not None:
+            report_id = response.json()["report_id"]
+            await recorder.call(client, "GET /api/reports/{id}", "GET", f"/api/reports/{report_id}", headers=headers)
+
+
+async def drive(base_url: str, args, inbox, pool: list) -> dict:
+    import httpx
+
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        await client.get("/__bench/loop-lag", params={"reset": True})
+        start = time.perf_counter()
+        tokens = await asyncio.gather(*(_signup(client, recorder, inbox, i) for i in range(args.users)))
+        auth_seconds = time.perf_counter() - start
+        auth_lag = (await client.get("/__bench/loop-lag", params={"reset": True})).json()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _user_session(client, recorder, token, i, args, pool) for i, token in enumerate(tokens)
+        ))
+        load_seconds = time.perf_counter() - start
+        load_lag = (await client.get("/__bench/loop-lag", params={"reset": True})).json()
+
+    load_requests = sum(
+        len(v) for k, v in recorder.latencies.items() if not k.startswith("POST /api/auth") and "verify" not in k
+    )
+    analyses = len(recorder.latencies["POST /api/analysis/upload-and-analyze"])
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "serve", "port")},
+        "auth_phase": {"seconds": round(auth_seconds, 2), "loop_lag_ms": auth_lag},
+        "load_phase": {
+            "seconds": round(load_seconds, 2),
+            "requests_per_s": round(load_requests / load_seconds, 2),
+            "analyses_per_s": round(analyses / load_seconds, 3),
+            "images_per_s": round(analyses * args.images / load_seconds, 2),
+            "loop_lag_ms": load_lag
+        },
+        "endpoints": {
+            endpoint: {**_summary(values), "errors": len(recorder.errors[endpoint]),
+                       "mean": round(sum(values) / len(values), 1) if values else 0.0}
+            for endpoint, values in recorder.latencies.items()
+        },
+        "errors": {endpoint: errors[:5] for endpoint, errors in recorder.errors.items() if errors},
+        "stages_ms": {stage: _summary(values) for stage, values in recorder.stages.items()},
+        "image_stages_ms": {stage: _summary(values) for stage, values in recorder.image_stages.items()}
+    }
+
+
+def _print_report(report: dict, llm_config, s3_store, inbox) -> None:
+    load, auth = report["load_phase"], report["auth_phase"]
+    print(f"\nauth phase: {auth['seconds']}s, loop lag p50/p99/max "
+          f"{auth['loop_lag_ms']['p50']}/{auth['loop_lag_ms']['p99']}/{auth['loop_lag_ms']['max']} ms")
+    print(f"load phase: {load['seconds']}s, {load['requests_per_s']} req/s, {load['analyses_per_s']} analyses/s, "
+          f"{load['images_per_s']} images/s, loop lag p50/p99/max "
+          f"{load['loop_lag_ms']['p50']}/{load['loop_lag_ms']['p99']}/{load['loop_lag_ms']['max']} ms")
+
+    print(f"\n{'endpoint':<40} {'n':>4} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for endpoint, s in report["endpoints"].items():
+        print(f"{endpoint:<40} {s['count']:>4} {s['errors']:>4} {s['p50']:>8.0f} {s['p95']:>8.0f} "
+              f"{s['p99']:>8.0f} {s['max']:>8.0f}")
+    for title, stages in (("upload-and-analyze stage", report["stages_ms"]), ("per-image stage", report["image_stages_ms"])):
+        print(f"\n{title:<40} {'n':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for stage, s in stages.items():
+            print(f"{stage:<40} {s['count']:>4} {s['p50']:>8.1f} {s['p95']:>8.1f} {s['p99']:>8.1f}")
+    for endpoint, errors in report["errors"].items():
+        print(f"\nerrors {endpoint}: {errors}")
+    print(f"\nfake LLM: {llm_config.requests} requests (max in flight {llm_config.max_in_flight}); "
+          f"fake S3: {s3_store.stats['puts']} puts, {s3_store.stats['bytes_in'] / 1024 / 1024:.1f} MB in; "
+          f"SMTP sink: {len(inbox.messages)} emails")
+
+
+def _wait_ready(server: subprocess.Popen, base_url: str, log_path: str, timeout: float = 60.0) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            with open(log_path) as f:
+                raise RuntimeError(f"warp server exited:\n{f.read()[-2000:]}")
+        try:
+            if httpx.get(f"{base_url}/__bench/loop-lag", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"warp server not ready after {timeout}s (log: {log_path})")
+
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=4, help="Số virtual user chạy đồng thời")
+    parser.add_argument("--iterations", type=int, default=3, help="Số lần upload-and-analyze mỗi user")
+    parser.add_argument("--images", type=int, default=4, help="Số ảnh mỗi lần upload")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[1600, 1200])
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--llm-responses", help="JSON list các response (chuỗi / object) cho fake LLM")
+    parser.add_argument("--s3-latency-ms", type=float, default=20.0)
+    parser.add_argument("--cache-hits", action="store_true", help="Upload lại cùng bộ ảnh (đo đường analysis cache)")
+    parser.add_argument("--database-url", help="Mặc định SQLite trong thư mục tạm")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return
+
+    from fake_llm_server import start_fake_llm_server
+    from fake_s3_server import start_fake_s3_server
+    from fake_smtp_server import start_fake_smtp_server
+
+    responses = None
+    if args.llm_responses:
+        with open(args.llm_responses, encoding="utf-8") as f:
+            responses = json.load(f)
+    llm_server, llm_config, llm_url = start_fake_llm_server(
+        latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, responses=responses
+    )
+    s3_server, s3_store, s3_url = start_fake_s3_server(latency_ms=args.s3_latency_ms)
+    smtp_server, inbox, smtp_port = start_fake_smtp_server()
+
+    workdir = tempfile.mkdtemp(prefix="warp-bench-")
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {
+        **os.environ,
+        "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(workdir, 'warp.db')}",
+        "OPENAI_API_KEY": "benchmark", "OPENAI_BASE_URL": llm_url,
+        "S3_ENDPOINT_URL": s3_url, "BUCKET_ACCOUNT_ID": "benchmark", "BUCKET_SECRET_ACCESS_KEY": "benchmark",
+        "BUCKET_NAME": "warp-bench",
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(smtp_port), "SMTP_USE_TLS": "false",
+        "SMTP_USERNAME": "benchmark", "SMTP_PASSWORD": "benchmark", "SMTP_FROM_EMAIL": "bench@example.com",
+        "WARP": base_url, "JOB_SPOOL_DIR": os.path.join(workdir, "jobs")
+    }
+    log_path = os.path.join(workdir, "server.log")
+    print(f"warp server on {base_url} (log: {log_path})")
+    pool = _image_pool(max(args.images * 2, 8), tuple(args.image_size))
+
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port)],
+            env=env, cwd=workdir, stdout=log, stderr=subprocess.STDOUT
+        )
+        try:
+            _wait_ready(server, base_url, log_path)
+            report = asyncio.run(drive(base_url, args, inbox, pool))
+        finally:
+            server.terminate()
+            server.wait(10)
+            for fake in (llm_server, s3_server, smtp_server):
+                fake.shutdown()
+
+    _print_report(report, llm_config, s3_store, inbox)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
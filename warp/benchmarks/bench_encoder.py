@@ -0,0 +1,99 @@
+# bench_encoder.py - Payload (bytes / base64), thời gian encode và PSNR: quality cố định hiện tại vs byte-budget encoder
+#
+# Usage:
+#   python benchmarks/bench_encoder.py [image_dir]
+# Không truyền image_dir thì dùng bộ ảnh tổng hợp của bench_preprocess + bench_gating.
+# LLM input được đo trên buffer sau preprocessing (đúng ảnh gửi model); renditions trên ảnh gốc đã xoay EXIF.
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from image_analysis_service import decode_image_for_ocr, transform_for_ocr, apply_exif_orientation, decode_image  # noqa: E402
+from image_encoder import ENCODE_PROFILES, encode_to_budget  # noqa: E402
+from bench_preprocess import synthetic_corpus, load_corpus  # noqa: E402
+from bench_gating import synthetic_listing  # noqa: E402
+
+# Cấu hình trước byte-budget encoder: (đích, format, quality cố định)
+CURRENT_SETTINGS = [
+    ("llm", "JPEG", 95, "legacy base64 (q95)"),
+    ("llm", "JPEG", 88, "llm (q88)"),
+    ("preview", "JPEG", 82, "preview (q82)"),
+    ("preview_webp", "WEBP", 80, "preview_webp (q80)"),
+    ("thumbnail", "JPEG", 82, "thumbnail (q82)"),
+]
+
+
+def _fixed_encode(img: Image.Image, image_format: str, quality: int) -> bytes:
+    buffered = BytesIO()
+    img.save(buffered, format=image_format, quality=quality)
+    return buffered.getvalue()
+
+
+def _resized(img: Image.Image, max_side) -> Image.Image:
+    if not max_side or max(img.size) <= max_side:
+        return img
+    img = img.copy()
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    return img
+
+
+def psnr(reference: Image.Image, content: bytes) -> float:
+    decoded = Image.open(BytesIO(content)).convert(reference.mode)
+    if decoded.size != reference.size:
+        decoded = decoded.resize(reference.size, Image.Resampling.LANCZOS)
+    mse = np.mean((np.asarray(reference, dtype=np.float32) - np.asarray(decoded, dtype=np.float32)) ** 2)
+    return 99.0 if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
+
+
+def measure(sources: dict, destination: str, encode) -> dict:
+    """encode(img) -> bytes; ảnh tham chiếu = buffer đã thu về max_side của đích"""
+    sizes, times, scores = [], [], []
+    for img in sources[destination]:
+        start = time.perf_counter()
+        content = encode(img)
+        times.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(content))
+        scores.append(psnr(img, content))
+    budget = ENCODE_PROFILES[destination]["max_bytes"]
+    return {
+        "avg_kb": np.mean(sizes) / 1024, "max_kb": max(sizes) / 1024, "total_b64_kb": sum(sizes) * 4 / 3 / 1024,
+        "avg_ms": np.mean(times), "psnr": np.mean(scores), "over_budget": sum(1 for s in sizes if s > budget)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image_dir", nargs="?", help="Thư mục ảnh mẫu")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.image_dir) if args.image_dir else {**synthetic_corpus(), **synthetic_listing()}
+    sources = {"llm": [transform_for_ocr(decode_image_for_ocr(content)).convert("RGB") for content in corpus.values()]}
+    originals = [apply_exif_orientation(decode_image(content)).convert("RGB") for content in corpus.values()]
+    for kind in ("preview", "preview_webp", "thumbnail"):
+        sources[kind] = [_resized(img, ENCODE_PROFILES[kind]["max_side"]) for img in originals]
+    print(f"{len(corpus)} images")
+
+    rows = []
+    for destination, image_format, quality, label in CURRENT_SETTINGS:
+        rows.append((label, measure(sources, destination, lambda img: _fixed_encode(img, image_format, quality))))
+    for destination in ("llm", "preview", "preview_webp", "thumbnail"):
+        budget_kb = ENCODE_PROFILES[destination]["max_bytes"] // 1024
+        rows.append((f"{destination} (budget {budget_kb} KB)",
+                     measure(sources, destination, lambda img: encode_to_budget(img, destination)[0])))
+
+    print(f"{'encoder':<30} {'avg KB':>8} {'max KB':>8} {'b64 KB':>9} {'ms/img':>8} {'PSNR':>6} {'over':>5}")
+    for label, r in rows:
+        print(f"{label:<30} {r['avg_kb']:>8.1f} {r['max_kb']:>8.1f} {r['total_b64_kb']:>9.0f} "
+              f"{r['avg_ms']:>8.1f} {r['psnr']:>6.1f} {r['over_budget']:>5}")
+
+
+if __name__ == "__main__":
+    main()
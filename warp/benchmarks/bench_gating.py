@@ -0,0 +1,114 @@
+# bench_gating.py - Số token ảnh gửi LLM trước / sau gating (bỏ ảnh gần trùng và ảnh mờ)
+#
+# Usage:
+#   python benchmarks/bench_gating.py [image_dir]
+# Không truyền image_dir thì dùng bộ ảnh tổng hợp mô phỏng một lần upload tin đăng: mỗi phòng chụp
+# liên tiếp vài tấm gần giống nhau, vài khung hình bị rung mờ, kèm screenshot thông tin tin đăng.
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from image_analysis_service import (  # noqa: E402
+    assess_image, gate_images, estimate_image_tokens, choose_detail, _target_size
+)
+from bench_preprocess import load_corpus  # noqa: E402
+
+
+def _to_jpeg(img: Image.Image, quality: int = 90) -> bytes:
+    buffered = BytesIO()
+    img.convert("RGB").save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+def _room(rng, size=(4032, 3024)) -> Image.Image:
+    """Một 'phòng': tường, sàn, cửa sổ, đồ đạc (khối màu) + texture nhẹ"""
+    w, h = size
+    img = Image.new("RGB", size, tuple(int(c) for c in rng.integers(150, 230, 3)))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, int(h * 0.65), w, h], fill=tuple(int(c) for c in rng.integers(80, 160, 3)))
+    for _ in range(int(rng.integers(6, 12))):
+        x0, y0 = int(rng.integers(0, w - 600)), int(rng.integers(0, h - 600))
+        x1, y1 = x0 + int(rng.integers(200, 1200)), y0 + int(rng.integers(200, 900))
+        draw.rectangle([x0, y0, x1, y1], fill=tuple(int(c) for c in rng.integers(0, 255, 3)), outline=(20, 20, 20), width=6)
+    texture = rng.normal(0, 6, (h // 4, w // 4, 1)).repeat(3, axis=2)
+    arr = np.asarray(img, dtype=np.float32) + np.asarray(Image.fromarray(
+        np.clip(texture + 128, 0, 255).astype(np.uint8)).resize(size), dtype=np.float32) - 128
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+
+
+def _burst_shot(base: Image.Image, rng) -> Image.Image:
+    """Chụp liên tiếp: lệch khung vài %, sáng tối khác chút"""
+    w, h = base.size
+    dx, dy = int(rng.integers(0, w // 50)), int(rng.integers(0, h // 50))
+    shot = base.crop((dx, dy, w - w // 50 + dx, h - h // 50 + dy)).resize(base.size)
+    return Image.fromarray(np.clip(np.asarray(shot, dtype=np.float32) * rng.uniform(0.95, 1.05), 0, 255).astype(np.uint8))
+
+
+def _screenshot(lines) -> Image.Image:
+    img = Image.new("RGB", (1170, 2532), "white")
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(lines * 10):
+        draw.text((60, 80 + i * 48), line, fill="black")
+    return img
+
+
+def synthetic_listing() -> dict:
+    rng = np.random.default_rng(3)
+    corpus = {}
+    for room in range(4):
+        base = _room(rng)
+        corpus[f"room{room}_shot0.jpg"] = _to_jpeg(base)
+        for shot in range(1, 3):
+            corpus[f"room{room}_shot{shot}.jpg"] = _to_jpeg(_burst_shot(base, rng))
+        if room % 2 == 0:
+            corpus[f"room{room}_shaky.jpg"] = _to_jpeg(_burst_shot(base, rng).filter(ImageFilter.GaussianBlur(24)))
+    corpus["listing_screenshot_1.png"] = _to_jpeg(_screenshot(["Diện tích: 95,25 m²", "Phòng ngủ: 3", "Hướng: Tây"]))
+    corpus["listing_screenshot_2.png"] = _to_jpeg(_screenshot(["Pháp lý: Sổ hồng", "Nội thất: Cơ bản", "Mặt tiền: 4,5 m"]))
+    return corpus
+
+
+def llm_image_tokens(info: dict) -> int:
+    """Token ảnh của PASS 1 cho ảnh sau preprocessing (kích thước model dùng)"""
+    width, height = _target_size(info["width"], info["height"])
+    detail = choose_detail({"width": width, "height": height, "source_width": info["width"],
+                            "source_height": info["height"], "document": info["document"]})
+    return estimate_image_tokens(width, height, detail)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("image_dir", nargs="?", help="Thư mục ảnh của một lần upload")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.image_dir) if args.image_dir else synthetic_listing()
+    names = list(corpus)
+    start = time.perf_counter()
+    assessments = [assess_image(corpus[name]) for name in names]
+    gate_ms = (time.perf_counter() - start) * 1000
+    kept, skipped = gate_images(assessments)
+
+    print(f"{'image':<28} {'sharpness':>10} {'tokens':>7}  decision")
+    skipped_by_index = {s["index"]: s for s in skipped}
+    for i, name in enumerate(names):
+        s = skipped_by_index.get(i)
+        decision = "keep" if s is None else (
+            f"skip: {s['reason']}" + (f" of {names[s['duplicate_of']]} (d={s['distance']})" if "duplicate_of" in s else "")
+        )
+        print(f"{name[:28]:<28} {assessments[i]['sharpness']:>10.1f} {llm_image_tokens(assessments[i]):>7}  {decision}")
+
+    before = sum(llm_image_tokens(a) for a in assessments)
+    after = sum(llm_image_tokens(assessments[i]) for i in kept)
+    print(f"\nimages: {len(names)} -> {len(kept)}  |  pass-1 image tokens: {before} -> {after} "
+          f"(-{(before - after) / before:.0%})  |  gating: {gate_ms:.0f} ms total")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# bench_ingest.py - Bộ nhớ đỉnh mỗi request: đọc toàn bộ upload vào RAM vs streaming ingestion
+#
+# Usage:
+#   python benchmarks/bench_ingest.py [--files 12] [--width 6000] [--height 4000]
+# Mỗi chế độ chạy trong một process riêng. Upload được đặt sẵn trong SpooledTemporaryFile như sau khi
+# Starlette parse multipart; đo RSS tăng thêm (lấy mẫu /proc/self/statm) khi xử lý cả request.
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+IMAGE_WORKERS = 4
+
+
+def _current_rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def make_photo(width: int, height: int) -> bytes:
+    """Ảnh chụp điện thoại giả lập: JPEG lớn, nhiều chi tiết"""
+    rng = np.random.default_rng(7)
+    small = rng.integers(0, 255, (height // 8, width // 8, 3), dtype=np.uint8)
+    buffered = BytesIO()
+    Image.fromarray(small).resize((width, height)).save(buffered, format="JPEG", quality=95)
+    return buffered.getvalue()
+
+
+def _make_upload_files(content: bytes, count: int):
+    from fastapi import UploadFile
+    files = []
+    for i in range(count):
+        spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)  # giống Starlette MultiPartParser
+        spool.write(content)
+        spool.seek(0)
+        files.append(UploadFile(file=spool, size=len(content), filename=f"photo_{i}.jpg"))
+    return files
+
+
+async def buffered_request(files):
+    """Cách cũ: await file.read() mọi file rồi decode đầy đủ độ phân giải"""
+    from image_analysis_service import decode_image, transform_for_ocr, encode_jpeg
+    contents = [await f.read() for f in files]
+
+    def prepare(content):
+        return encode_jpeg(transform_for_ocr(decode_image(content)))
+
+    with ThreadPoolExecutor(IMAGE_WORKERS) as pool:
+        return await asyncio.gather(*(asyncio.wrap_future(pool.submit(prepare, c)) for c in contents))
+
+
+async def streaming_request(files):
+    """Streaming ingestion: đọc theo chunk + spool ra đĩa, decode bằng draft()"""
+    from upload_ingest import ingest_uploads
+    from image_analysis_service import decode_image_for_ocr, transform_for_ocr, encode_jpeg
+    uploads = await ingest_uploads(files)
+
+    def prepare(upload):
+        return encode_jpeg(transform_for_ocr(decode_image_for_ocr(upload.open())))
+
+    try:
+        with ThreadPoolExecutor(IMAGE_WORKERS) as pool:
+            return await asyncio.gather(*(asyncio.wrap_future(pool.submit(prepare, u)) for u in uploads))
+    finally:
+        for upload in uploads:
+            upload.close()
+
+
+MODES = {"buffered": buffered_request, "streaming": streaming_request}
+
+
+def _measure(args) -> dict:
+    mode, content, count = args
+    os.environ["MAX_UPLOAD_REQUEST_BYTES"] = str(len(content) * count + 1)
+    files = _make_upload_files(content, count)
+    import image_analysis_service  # noqa: F401  (import trước khi lấy baseline)
+    import upload_ingest  # noqa: F401
+    baseline = _current_rss_mb()
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], _current_rss_mb())
+            time.sleep(0.002)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    asyncio.run(MODES[mode](files))
+    wall = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    return {"wall_s": wall, "peak_rss_growth_mb": max(peak[0], _current_rss_mb()) - baseline}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=12)
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    args = parser.parse_args()
+
+    content = make_photo(args.width, args.height)
+    print(f"{args.files} x {len(content) / (1024 * 1024):.1f} MB JPEG ({args.width}x{args.height})")
+    print(f"{'mode':<12} {'wall s':>8} {'peak RSS growth MB':>20}")
+    for mode in MODES:
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            result = pool.apply(_measure, ((mode, content, args.files),))
+        print(f"{mode:<12} {result['wall_s']:>8.2f} {result['peak_rss_growth_mb']:>20.1f}")
+
+
+if __name__ == "__main__":
+    main()
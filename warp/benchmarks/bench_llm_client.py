@@ -0,0 +1,80 @@
+# bench_llm_client.py - Kiểm tra async LLM client: event loop không bị chặn, semaphore, retry
+#
+# Usage:
+#   python benchmarks/bench_llm_client.py [--requests 12] [--latency-ms 500] [--fail-rate 0.2]
+# Dùng fake_llm_server trong process (không cần mạng / API key thật).
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_llm_server import start_fake_llm_server  # noqa: E402
+
+
+def _sample_image() -> str:
+    buffered = BytesIO()
+    Image.new("RGB", (1170, 2532), "white").save(buffered, format="JPEG")
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+async def _measure_loop_lag(stop: asyncio.Event, samples: list, interval: float = 0.01):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - start - interval) * 1000)
+
+
+async def run(requests: int):
+    from image_analysis_service import ImageToFormAnalyzer, describe_image, decode_image, LLM_MAX_CONCURRENCY
+
+    image = _sample_image()
+    info = [describe_image(decode_image(base64.b64decode(image)))]
+    stop, lag = asyncio.Event(), []
+    lag_task = asyncio.create_task(_measure_loop_lag(stop, lag))
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        ImageToFormAnalyzer.analyze_images_to_form([image], info) for _ in range(requests)
+    ))
+    wall = time.perf_counter() - start
+    stop.set()
+    await lag_task
+    return results, wall, lag, LLM_MAX_CONCURRENCY
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=12)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--fail-rate", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server, config, base_url = start_fake_llm_server(latency_ms=args.latency_ms, fail_rate=args.fail_rate)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("LLM_BACKOFF_BASE_SECONDS", "0.05")
+
+    results, wall, lag, max_concurrency = asyncio.run(run(args.requests))
+    server.shutdown()
+
+    ok = sum(1 for r in results if r.get("success"))
+    lag_sorted = sorted(lag) or [0.0]
+    print(f"{'requests':<28}{args.requests}")
+    print(f"{'succeeded':<28}{ok}")
+    print(f"{'server calls (incl. retry)':<28}{config.requests}  (injected failures: {config.failures})")
+    print(f"{'max in-flight at server':<28}{config.max_in_flight}  (LLM_MAX_CONCURRENCY={max_concurrency})")
+    print(f"{'wall time':<28}{wall:.2f}s")
+    print(f"{'event-loop lag p50/max':<28}{lag_sorted[len(lag_sorted) // 2]:.1f} / {lag_sorted[-1]:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# bench_parallel.py - PASS 1 một request vs song song theo nhóm ảnh: wall-clock và tổng token
+#
+# Usage:
+#   python benchmarks/bench_parallel.py [--latency-ms 600] [--latency-per-image-ms 250] [--sizes 4 8 12 16]
+# Chạy offline với fake_llm_server; latency mỗi request = latency-ms + latency-per-image-ms x số ảnh
+# (request nhiều ảnh chậm gần tỉ lệ thuận như model thật). Ảnh là các "phòng" tổng hợp khác nhau
+# (không bị planning bỏ vì gần trùng).
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from fake_llm_server import start_fake_llm_server  # noqa: E402
+
+
+def _images(count: int):
+    from bench_gating import _room
+    from image_analysis_service import transform_for_ocr, describe_image
+    from image_encoder import encode_to_budget
+
+    rng = np.random.default_rng(7)
+    images = []
+    for _ in range(count):
+        img = transform_for_ocr(_room(rng, size=(1600, 1200)))
+        images.append((base64.b64encode(encode_to_budget(img, "llm")[0]).decode(), describe_image(img)))
+    return images
+
+
+async def run(images, sizes):
+    import image_analysis_service
+    from image_analysis_service import ImageToFormAnalyzer
+
+    rows = []
+    for size in sizes:
+        for parallel in (False, True):
+            image_analysis_service.PARALLEL_EXTRACTION_ENABLED = parallel
+            start = time.perf_counter()
+            result = await ImageToFormAnalyzer.analyze_images_to_form(
+                [b for b, _ in images[:size]], [i for _, i in images[:size]]
+            )
+            usage = result.get("usage", {})
+            plan = result["plan"]
+            rows.append({
+                "images": size,
+                "mode": "parallel" if parallel else "single",
+                "groups": len(plan.get("parallel", {}).get("groups", [size])) if parallel else 1,
+                "wall_ms": (time.perf_counter() - start) * 1000,
+                "input_tokens": usage.get("input_tokens") or 0,
+                "output_tokens": usage.get("output_tokens") or 0,
+                "sent": plan["images_sent_pass1"]
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency-ms", type=float, default=600.0)
+    parser.add_argument("--latency-per-image-ms", type=float, default=250.0)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 8, 12, 16])
+    args = parser.parse_args()
+
+    _, config, base_url = start_fake_llm_server(
+        latency_ms=args.latency_ms, latency_per_image_ms=args.latency_per_image_ms
+    )
+    os.environ["OPENAI_BASE_URL"] = base_url
+    images = _images(max(args.sizes))
+
+    rows = asyncio.run(run(images, args.sizes))
+    print(f"{'images':>6} {'mode':<9} {'groups':>6} {'wall ms':>8} {'in tok':>7} {'out tok':>8}")
+    for row in rows:
+        print(f"{row['images']:>6} {row['mode']:<9} {row['groups']:>6} {row['wall_ms']:>8.0f} "
+              f"{row['input_tokens']:>7} {row['output_tokens']:>8}")
+    print(f"\nfake server: {config.requests} requests, max in flight {config.max_in_flight}")
+
+
+if __name__ == "__main__":
+    main()
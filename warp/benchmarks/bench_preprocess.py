@@ -0,0 +1,101 @@
+# bench_preprocess.py - So sánh preprocessing legacy và adaptive cho OCR
+#
+# Usage:
+#   python benchmarks/bench_preprocess.py [image_dir] [--repeat N]
+# Không truyền image_dir thì dùng bộ ảnh tổng hợp (screenshot, ảnh chụp nhiễu, ảnh mờ).
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from image_analysis_service import preprocess_image_for_ocr_legacy, adaptive_preprocess, OCR_JPEG_QUALITY  # noqa: E402
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def _to_jpeg(img: Image.Image, quality: int = 90) -> bytes:
+    buffered = BytesIO()
+    img.convert("RGB").save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+def synthetic_corpus() -> dict:
+    """Bộ ảnh mẫu: screenshot tin đăng, ảnh chụp điện thoại có nhiễu, ảnh chụp mờ"""
+    rng = np.random.default_rng(42)
+
+    screenshot = Image.new("RGB", (1170, 2532), "white")
+    draw = ImageDraw.Draw(screenshot)
+    for i, line in enumerate(["Diện tích: 95,25 m²", "Phòng ngủ: 3", "Nội thất: Cơ bản", "Hướng nhà: Tây - Bắc"] * 12):
+        draw.text((60, 80 + i * 48), line, fill="black")
+
+    gradient = np.linspace(40, 220, 4032, dtype=np.float32)[None, :, None].repeat(3024, axis=0).repeat(3, axis=2)
+    noisy = np.clip(gradient + rng.normal(0, 18, gradient.shape), 0, 255).astype(np.uint8)
+    noisy_photo = Image.fromarray(noisy)
+    ImageDraw.Draw(noisy_photo).text((400, 400), "Sổ hồng - 4,3 m x 22 m", fill="white")
+
+    blurred = screenshot.resize((585, 1266)).filter(ImageFilter.GaussianBlur(2))
+
+    return {
+        "screenshot_1170x2532.jpg": _to_jpeg(screenshot),
+        "noisy_photo_4032x3024.jpg": _to_jpeg(noisy_photo),
+        "blurred_screenshot_585x1266.jpg": _to_jpeg(blurred),
+    }
+
+
+def load_corpus(image_dir: str) -> dict:
+    corpus = {}
+    for name in sorted(os.listdir(image_dir)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(image_dir, name), "rb") as f:
+                corpus[name] = f.read()
+    return corpus
+
+
+def run_adaptive(content: bytes) -> tuple:
+    stats = {}
+    img = adaptive_preprocess(Image.open(BytesIO(content)), stats)
+    buffered = BytesIO()
+    img.save(buffered, format="JPEG", quality=OCR_JPEG_QUALITY)
+    return buffered.getvalue(), stats
+
+
+def timed(func, content: bytes, repeat: int) -> tuple:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(content)
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("image_dir", nargs="?", help="Thư mục ảnh mẫu")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.image_dir) if args.image_dir else synthetic_corpus()
+    print(f"{'image':<36} {'legacy ms':>10} {'adaptive ms':>12} {'legacy KB':>10} {'adaptive KB':>12}  decisions")
+    totals = np.zeros(4)
+    for name, content in corpus.items():
+        legacy_out, legacy_ms = timed(preprocess_image_for_ocr_legacy, content, args.repeat)
+        (adaptive_out, stats), adaptive_ms = timed(run_adaptive, content, args.repeat)
+        row = np.array([legacy_ms, adaptive_ms, len(legacy_out) / 1024, len(adaptive_out) / 1024])
+        totals += row
+        decisions = ", ".join(k for k in ("resized", "denoised", "sharpened") if stats.get(k)) or "none"
+        print(f"{name[:36]:<36} {row[0]:>10.0f} {row[1]:>12.0f} {row[2]:>10.0f} {row[3]:>12.0f}  "
+              f"{decisions} (noise={stats['noise_sigma']}, blur_var={stats['blur_variance']})")
+
+    n = max(len(corpus), 1)
+    print(f"{'MEAN':<36} {totals[0] / n:>10.0f} {totals[1] / n:>12.0f} {totals[2] / n:>10.0f} {totals[3] / n:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# bench_routing.py - Model routing theo tier: latency, token, độ chính xác trường quan trọng, tỉ lệ escalate
+#
+# Usage:
+#   python benchmarks/bench_routing.py [--fast-latency-ms 300] [--large-latency-ms 900] [--uploads 6]
+# Chạy hoàn toàn offline với fake_llm_server: model nhanh (LLM_FAST_MODEL) và model lớn (LLM_LARGE_MODEL)
+# có latency riêng; kịch bản "fast misses" cho model nhanh đọc sót vài trường -> phải escalate ở PASS 2.
+# Mỗi lần upload là screenshot tin đăng (đi tier nhanh) hoặc ảnh chụp phòng (đi tier lớn); so với routing tắt.
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from fake_llm_server import start_fake_llm_server, DEFAULT_RESPONSE  # noqa: E402
+
+
+def _uploads(count: int):
+    from bench_gating import synthetic_listing
+    from image_analysis_service import decode_image, transform_for_ocr, describe_image
+    from image_encoder import encode_to_budget
+    import base64
+
+    corpus = synthetic_listing()
+    screenshots = [name for name in corpus if name.startswith("listing_screenshot")]
+    photos = [name for name in corpus if name.endswith("_shot0.jpg")]
+    prepared = {}
+    for name in screenshots + photos:
+        img = transform_for_ocr(decode_image(corpus[name]))
+        prepared[name] = (base64.b64encode(encode_to_budget(img, "llm")[0]).decode(), describe_image(img))
+    # Xen kẽ: upload chẵn là screenshot, lẻ là ảnh chụp
+    uploads = []
+    for i in range(count):
+        names = screenshots if i % 2 == 0 else photos[:2]
+        uploads.append(("screenshots" if i % 2 == 0 else "photos", [prepared[n] for n in names]))
+    return uploads
+
+
+def _accuracy(result: dict, critical_fields) -> float:
+    expected = DEFAULT_RESPONSE["property_info"]
+    found = result.get("data", {}).get("property_info", {})
+    return sum(1 for f in critical_fields if found.get(f) == expected.get(f)) / len(critical_fields)
+
+
+async def run(uploads, routing: bool):
+    import model_router
+    from image_analysis_service import ImageToFormAnalyzer
+
+    model_router.MODEL_ROUTING_ENABLED = routing
+    rows = []
+    for kind, images in uploads:
+        start = time.perf_counter()
+        result = await ImageToFormAnalyzer.analyze_images_to_form([b for b, _ in images], [i for _, i in images])
+        usage = result.get("usage", {})
+        rows.append({
+            "kind": kind,
+            "ms": (time.perf_counter() - start) * 1000,
+            "tokens": (usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0),
+            "accuracy": _accuracy(result, ImageToFormAnalyzer.CRITICAL_FIELDS),
+            "tier": result["plan"]["routing"]["tier"],
+            "escalated": result["plan"]["routing"]["escalated"]
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fast-latency-ms", type=float, default=300.0)
+    parser.add_argument("--large-latency-ms", type=float, default=900.0)
+    parser.add_argument("--uploads", type=int, default=6)
+    args = parser.parse_args()
+
+    fast_model = os.getenv("LLM_FAST_MODEL", "gpt-4o-mini")
+    large_model = os.getenv("LLM_LARGE_MODEL", "gpt-4o")
+    _, config, base_url = start_fake_llm_server(
+        latency_ms=args.large_latency_ms,
+        model_latency_ms={fast_model: args.fast_latency_ms, large_model: args.large_latency_ms}
+    )
+    os.environ["OPENAI_BASE_URL"] = base_url
+    import model_router
+
+    uploads = _uploads(args.uploads)
+    scenarios = [
+        ("routing off", False, []),
+        ("routing on", True, []),
+        ("routing on, fast misses", True, ["width_m", "length_m"]),
+    ]
+
+    async def run_scenarios():
+        results = []
+        for label, routing, fast_missing in scenarios:
+            config.model_missing_fields = {fast_model: fast_missing}
+            results.append((label, await run(uploads, routing)))
+        return results
+
+    print(f"{'scenario':<26} {'upload':<12} {'avg ms':>8} {'tokens':>7} {'accuracy':>9} {'fast':>5} {'escalated':>10}")
+    for label, rows in asyncio.run(run_scenarios()):
+        for kind in ("screenshots", "photos"):
+            group = [r for r in rows if r["kind"] == kind]
+            print(f"{label:<26} {kind:<12} {sum(r['ms'] for r in group) / len(group):>8.0f} "
+                  f"{sum(r['tokens'] for r in group) // len(group):>7} "
+                  f"{sum(r['accuracy'] for r in group) / len(group):>9.0%} "
+                  f"{sum(r['tier'] == 'fast' for r in group):>5} {sum(r['escalated'] for r in group):>10}")
+
+    print("\nper-tier stats (all scenarios):")
+    for tier, stats in model_router.get_stats()["tiers"].items():
+        print(f"  {tier:<6} {stats['model']:<12} calls={stats['calls']} p50={stats['latency_ms_p50']:.0f}ms "
+              f"p95={stats['latency_ms_p95']:.0f}ms avg_in={stats['avg_input_tokens']:.0f} "
+              f"critical_field_rate={stats['critical_field_rate']} escalation_rate={stats['escalation_rate']}")
+    print(f"fake server requests by model: {config.requests_by_model}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# bench_single_decode.py - CPU time và bộ nhớ đỉnh: pipeline nhiều lần decode/encode vs single-decode
+#
+# Usage:
+#   python benchmarks/bench_single_decode.py [image_dir]
+# Mỗi lần đo chạy trong một process riêng; bộ nhớ đỉnh = RSS lớn nhất (lấy mẫu /proc/self/statm) trừ RSS lúc bắt đầu.
+import argparse
+import base64
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from image_analysis_service import compress_image_if_needed, preprocess_image_for_ocr, prepare_llm_image  # noqa: E402
+from bench_preprocess import synthetic_corpus, load_corpus  # noqa: E402
+
+
+def multi_decode_pipeline(content: bytes) -> str:
+    """Pipeline trước đây: compress -> preprocess (decode + encode) -> base64 (decode + encode q95)"""
+    content = compress_image_if_needed(content)
+    preprocessed = preprocess_image_for_ocr(content)
+    img = Image.open(BytesIO(preprocessed))
+    buffered = BytesIO()
+    img.save(buffered, format="JPEG", quality=95)
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+PIPELINES = {"multi_decode": multi_decode_pipeline, "single_decode": prepare_llm_image}
+
+
+def _current_rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _measure(args) -> dict:
+    pipeline, content = args
+    baseline = _current_rss_mb()
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], _current_rss_mb())
+            time.sleep(0.001)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    cpu_start = time.thread_time()
+    PIPELINES[pipeline](content)
+    cpu_ms = (time.thread_time() - cpu_start) * 1000
+    done.set()
+    sampler.join()
+    return {"cpu_ms": cpu_ms, "peak_rss_growth_mb": max(peak[0], _current_rss_mb()) - baseline}
+
+
+def measure_isolated(pipeline: str, content: bytes) -> dict:
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_measure, ((pipeline, content),))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("image_dir", nargs="?", help="Thư mục ảnh mẫu")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.image_dir) if args.image_dir else synthetic_corpus()
+    print(f"{'image':<36} {'multi cpu ms':>13} {'single cpu ms':>14} {'multi MB':>9} {'single MB':>10}")
+    for name, content in corpus.items():
+        multi = measure_isolated("multi_decode", content)
+        single = measure_isolated("single_decode", content)
+        print(f"{name[:36]:<36} {multi['cpu_ms']:>13.0f} {single['cpu_ms']:>14.0f} "
+              f"{multi['peak_rss_growth_mb']:>9.1f} {single['peak_rss_growth_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# fake_llm_server.py - Server giả lập OpenAI chat completions (không cần mạng)
+#
+# Usage:
+#   python benchmarks/fake_llm_server.py [--port 8765] [--latency-ms 800] [--jitter-ms 200]
+#                                        [--fail-rate 0.1] [--fail-status 429] [--responses canned.json]
+#                                        [--model-latency gpt-4o-mini=300] [--model-missing gpt-4o-mini=width_m,length_m]
+#                                        [--latency-per-image-ms 250]
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 uvicorn main:app
+#
+# Trả lần lượt (vòng tròn) các nội dung trong --responses (JSON list các chuỗi / object),
+# mặc định là một kết quả PASS 1 đầy đủ nên analyzer không cần PASS 2.
+# Mô phỏng các tier model: --model-latency đặt latency riêng theo model, --model-missing cho model đó
+# "đọc sót" các trường (null trong PASS 1 và PASS 2); --latency-per-image-ms cộng thêm latency theo số ảnh
+# trong request (request nhiều ảnh chậm hơn gần tỉ lệ thuận như model thật). Request PASS 2 (targeted retry) nhận object phẳng
+# chỉ gồm các trường được hỏi, lấy từ property_info của response.
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+
+DEFAULT_RESPONSE = {
+    "all_visible_text": "Nhà mặt tiền. Diện tích: 95,25 m². Phòng ngủ: 3. Nội thất: Cơ bản",
+    "image_texts": [],
+    "property_info": {
+        "address": "12 Nguyễn Trãi, Phường 2, Quận 5, TP.HCM",
+        "property_type": "Nhà phố",
+        "usable_area_m2": 95.25,
+        "bedrooms": 3,
+        "bathrooms": 2,
+        "floors": 3,
+        "direction": "Tây - Bắc",
+        "legal_status": "Sổ hồng",
+        "furniture_status": "Cơ bản",
+        "width_m": 4.5,
+        "length_m": 21.0,
+        "land_area_m2": None
+    },
+    "condition_assessment": {
+        "overall_condition": "Tốt",
+        "cleanliness": "Sạch sẽ",
+        "maintenance_status": "Được bảo trì",
+        "major_issues": [],
+        "overall_description": "Nhà còn mới"
+    }
+}
+
+# stream=True: độ trễ tới token đầu tiên (phần còn lại của latency chia đều cho các chunk)
+FIRST_TOKEN_SHARE = 0.25
+STREAM_CHUNK_CHARS = 24
+
+# Ước lượng token ảnh giống cách tính của gpt-4o (85 + 170 / tile 512px, tối đa 4 tile cho ảnh dọc thường gặp)
+IMAGE_TOKENS = {"low": 85, "high": 85 + 170 * 4}
+
+
+class FakeLLMConfig:
+    def __init__(self, latency_ms=800.0, jitter_ms=0.0, fail_rate=0.0, fail_status=429, responses=None,
+                 model_latency_ms=None, model_missing_fields=None, latency_per_image_ms=0.0):
+        self.latency_ms = latency_ms
+        self.latency_per_image_ms = latency_per_image_ms
+        self.jitter_ms = jitter_ms
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.responses = responses or [DEFAULT_RESPONSE]
+        self.model_latency_ms = model_latency_ms or {}
+        self.model_missing_fields = model_missing_fields or {}
+        self._sequence = count()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests_by_model = {}
+
+    def latency_for(self, payload: dict) -> float:
+        images = sum(
+            1 for message in payload.get("messages", []) if isinstance(message.get("content"), list)
+            for part in message["content"] if part.get("type") == "image_url"
+        )
+        return self.model_latency_ms.get(payload.get("model"), self.latency_ms) + self.latency_per_image_ms * images
+
+    def next_response(self, payload: dict = None) -> str:
+        response = self.responses[next(self._sequence) % len(self.responses)]
+        if isinstance(response, str) or payload is None:
+            return response if isinstance(response, str) else json.dumps(response, ensure_ascii=False)
+        missing = set(self.model_missing_fields.get(payload.get("model"), ()))
+        property_info = {k: (None if k in missing else v) for k, v in response.get("property_info", {}).items()}
+        requested = _RETRY_FIELD.findall(_prompt_text(payload))
+        if requested:
+            response = {field: property_info.get(field) for field in requested}
+        elif missing:
+            response = {**response, "property_info": property_info}
+        return json.dumps(response, ensure_ascii=False)
+
+
+# Schema output của prompt PASS 2: {"field": value, ...}
+_RETRY_FIELD = re.compile(r'"([A-Za-z_0-9]+)": value')
+
+
+def _prompt_text(payload: dict) -> str:
+    texts = []
+    for message in payload.get("messages", []):
+        parts = message.get("content")
+        parts = parts if isinstance(parts, list) else [{"type": "text", "text": parts or ""}]
+        texts.extend(part.get("text", "") for part in parts if part.get("type") == "text")
+    return "\n".join(texts)
+
+
+def _usage(payload: dict, completion: str) -> dict:
+    prompt_tokens = 0
+    for message in payload.get("messages", []):
+        parts = message.get("content")
+        parts = parts if isinstance(parts, list) else [{"type": "text", "text": parts or ""}]
+        for part in parts:
+            if part.get("type") == "image_url":
+                prompt_tokens += IMAGE_TOKENS.get(part["image_url"].get("detail", "high"), IMAGE_TOKENS["high"])
+            else:
+                prompt_tokens += len(part.get("text", "")) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(completion) // 4,
+            "total_tokens": prompt_tokens + len(completion) // 4}
+
+
+def make_handler(config: FakeLLMConfig):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict, headers: dict = None):
+            data = json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, payload: dict, completion: str, duration: float):
+            """SSE giống OpenAI: các chunk delta, chunk usage (nếu stream_options.include_usage), [DONE]"""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            pieces = [completion[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(completion), STREAM_CHUNK_CHARS)]
+            base = {"id": f"chatcmpl-fake-{config.requests}", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": payload.get("model", "gpt-4o")}
+            for piece in pieces:
+                chunk = {**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(duration / max(1, len(pieces)))
+            final = {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            self.wfile.write(f"data: {json.dumps(final)}\n\n".encode())
+            if payload.get("stream_options", {}).get("include_usage"):
+                self.wfile.write(f"data: {json.dumps({**base, 'choices': [], 'usage': _usage(payload, completion)})}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send_json(200, {"requests": config.requests, "failures": config.failures,
+                                      "max_in_flight": config.max_in_flight,
+                                      "requests_by_model": dict(config.requests_by_model)})
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            model = payload.get("model", "gpt-4o")
+            with config.lock:
+                config.requests += 1
+                config.requests_by_model[model] = config.requests_by_model.get(model, 0) + 1
+                config.in_flight += 1
+                config.max_in_flight = max(config.max_in_flight, config.in_flight)
+            try:
+                latency = max(0.0, config.latency_for(payload) + random.uniform(-config.jitter_ms, config.jitter_ms)) / 1000
+                streaming = bool(payload.get("stream"))
+                time.sleep(latency * FIRST_TOKEN_SHARE if streaming else latency)
+                if random.random() < config.fail_rate:
+                    with config.lock:
+                        config.failures += 1
+                    self._send_json(config.fail_status, {"error": {"message": "injected failure", "type": "fake"}},
+                                    {"Retry-After": "0"})
+                    return
+                completion = config.next_response(payload)
+                if streaming:
+                    self._stream(payload, completion, latency * (1 - FIRST_TOKEN_SHARE))
+                    return
+                self._send_json(200, {
+                    "id": f"chatcmpl-fake-{config.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get("model", "gpt-4o"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": completion}}],
+                    "usage": _usage(payload, completion)
+                })
+            finally:
+                with config.lock:
+                    config.in_flight -= 1
+
+    return Handler
+
+
+def start_fake_llm_server(port: int = 0, **config_kwargs):
+    """Chạy server trong thread nền; trả về (server, config, base_url cho OPENAI_BASE_URL)"""
+    config = FakeLLMConfig(**config_kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, config, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Tỉ lệ request trả lỗi (0-1)")
+    parser.add_argument("--fail-status", type=int, default=429)
+    parser.add_argument("--responses", help="File JSON: list các response trả lần lượt")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=MS",
+                        help="Latency riêng cho một model (lặp lại được)")
+    parser.add_argument("--model-missing", action="append", default=[], metavar="MODEL=FIELD,FIELD",
+                        help="Các trường property_info mà model trả null (lặp lại được)")
+    parser.add_argument("--latency-per-image-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            responses = json.load(f)
+    model_latency = {m: float(v) for m, v in (item.split("=", 1) for item in args.model_latency)}
+    model_missing = {m: v.split(",") for m, v in (item.split("=", 1) for item in args.model_missing)}
+    config = FakeLLMConfig(args.latency_ms, args.jitter_ms, args.fail_rate, args.fail_status, responses,
+                           model_latency, model_missing, args.latency_per_image_ms)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(config))
+    print(f"Fake LLM server: OPENAI_BASE_URL=http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
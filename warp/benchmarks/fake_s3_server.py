@@ -0,0 +1,215 @@
+# fake_s3_server.py - S3-compatible stand-in trong RAM (path-style, không kiểm tra chữ ký)
+#
+# Usage:
+#   python benchmarks/fake_s3_server.py [--port 9000] [--latency-ms 0]
+#   S3_ENDPOINT_URL=http://127.0.0.1:9000 BUCKET_ACCOUNT_ID=test BUCKET_SECRET_ACCESS_KEY=test uvicorn main:app
+#
+# Hỗ trợ đủ cho warp: PutObject / GetObject (Range) / HeadObject / DeleteObject, multipart upload
+# của upload_fileobj, presigned PUT URL và presigned POST (multipart/form-data).
+import argparse
+import hashlib
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+
+class FakeS3Store:
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.objects = {}  # (bucket, key) -> {"body", "content_type", "etag"}
+        self.multipart = {}  # upload_id -> {"bucket", "key", "content_type", "parts": {n: bytes}}
+        self.lock = threading.Lock()
+        self.stats = {"puts": 0, "gets": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def put(self, bucket: str, key: str, body: bytes, content_type: str) -> str:
+        etag = hashlib.md5(body).hexdigest()
+        with self.lock:
+            self.objects[(bucket, key)] = {"body": body, "content_type": content_type, "etag": etag}
+            self.stats["puts"] += 1
+            self.stats["bytes_in"] += len(body)
+        return etag
+
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    """aws-chunked: '<hex size>[;chunk-signature=..]\\r\\n<data>\\r\\n' ... '0\\r\\n<trailers>\\r\\n'"""
+    out, pos = bytearray(), 0
+    while True:
+        line_end = body.index(b"\r\n", pos)
+        size = int(body[pos:line_end].split(b";")[0], 16)
+        pos = line_end + 2
+        if size == 0:
+            return bytes(out)
+        out += body[pos:pos + size]
+        pos += size + 2
+
+
+def make_handler(store: FakeS3Store):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        # ---------- helpers ----------
+        def _target(self):
+            parsed = urlparse(self.path)
+            bucket, _, key = parsed.path.lstrip("/").partition("/")
+            return bucket, unquote(key), {k: v[0] for k, v in parse_qs(parsed.query, keep_blank_values=True).items()}
+
+        def _read_body(self) -> bytes:
+            if "chunked" in self.headers.get("Transfer-Encoding", ""):
+                body = bytearray()
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0], 16)
+                    if size == 0:
+                        while self.rfile.readline() not in (b"\r\n", b""):
+                            pass
+                        break
+                    body += self.rfile.read(size)
+                    self.rfile.readline()
+                body = bytes(body)
+            else:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if "aws-chunked" in self.headers.get("Content-Encoding", "") or self.headers.get("x-amz-decoded-content-length"):
+                body = _decode_aws_chunked(body)
+            return body
+
+        def _send(self, status: int, body: bytes = b"", content_type: str = "application/xml", headers: dict = None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def _error(self, status: int, code: str):
+            self._send(status, f"<?xml version=\"1.0\"?><Error><Code>{code}</Code><Message>{code}</Message></Error>".encode())
+
+        def _delay(self):
+            if store.latency_ms:
+                time.sleep(store.latency_ms / 1000)
+
+        # ---------- verbs ----------
+        def do_PUT(self):
+            self._delay()
+            bucket, key, query = self._target()
+            body = self._read_body()
+            if "uploadId" in query:
+                upload = store.multipart.get(query["uploadId"])
+                if upload is None:
+                    return self._error(404, "NoSuchUpload")
+                upload["parts"][int(query["partNumber"])] = body
+                return self._send(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+            etag = store.put(bucket, key, body, self.headers.get("Content-Type", "application/octet-stream"))
+            self._send(200, headers={"ETag": f'"{etag}"'})
+
+        def do_GET(self):
+            self._delay()
+            bucket, key, _ = self._target()
+            obj = store.objects.get((bucket, key))
+            if obj is None:
+                return self._error(404, "NoSuchKey")
+            body, status, headers = obj["body"], 200, {"ETag": f'"{obj["etag"]}"', "Accept-Ranges": "bytes"}
+            range_header = self.headers.get("Range")
+            if range_header and range_header.startswith("bytes="):
+                start, _, end = range_header[6:].partition("-")
+                start, end = int(start or 0), int(end) if end else len(body) - 1
+                headers["Content-Range"] = f"bytes {start}-{min(end, len(body) - 1)}/{len(body)}"
+                body, status = body[start:end + 1], 206
+            with store.lock:
+                store.stats["gets"] += 1
+                store.stats["bytes_out"] += len(body)
+            self._send(status, body, obj["content_type"], headers)
+
+        def do_HEAD(self):
+            bucket, key, _ = self._target()
+            obj = store.objects.get((bucket, key))
+            if obj is None:
+                return self._error(404, "NoSuchKey")
+            self.send_response(200)
+            self.send_header("Content-Type", obj["content_type"])
+            self.send_header("Content-Length", str(len(obj["body"])))
+            self.send_header("ETag", f'"{obj["etag"]}"')
+            self.end_headers()
+
+        def do_DELETE(self):
+            bucket, key, query = self._target()
+            if "uploadId" in query:
+                store.multipart.pop(query["uploadId"], None)
+            else:
+                store.objects.pop((bucket, key), None)
+            self._send(204)
+
+        def do_POST(self):
+            self._delay()
+            bucket, key, query = self._target()
+            body = self._read_body()
+            if "uploads" in query:
+                upload_id = uuid.uuid4().hex
+                store.multipart[upload_id] = {"bucket": bucket, "key": key, "parts": {},
+                                              "content_type": self.headers.get("Content-Type", "application/octet-stream")}
+                return self._send(200, (
+                    f"<?xml version=\"1.0\"?><InitiateMultipartUploadResult><Bucket>{bucket}</Bucket>"
+                    f"<Key>{key}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+                ).encode())
+            if "uploadId" in query:
+                upload = store.multipart.pop(query["uploadId"], None)
+                if upload is None:
+                    return self._error(404, "NoSuchUpload")
+                data = b"".join(upload["parts"][n] for n in sorted(upload["parts"]))
+                etag = store.put(upload["bucket"], upload["key"], data, upload["content_type"])
+                return self._send(200, (
+                    f"<?xml version=\"1.0\"?><CompleteMultipartUploadResult><Bucket>{bucket}</Bucket>"
+                    f"<Key>{upload['key']}</Key><ETag>\"{etag}\"</ETag></CompleteMultipartUploadResult>"
+                ).encode())
+
+            # Presigned POST: multipart/form-data với các field của policy + "file"
+            message = BytesParser(policy=default_policy).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+            )
+            fields, file_body = {}, None
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if name == "file":
+                    file_body = part.get_payload(decode=True)
+                else:
+                    fields[name] = part.get_content().strip()
+            if file_body is None or "key" not in fields:
+                return self._error(400, "InvalidArgument")
+            store.put(bucket, fields["key"], file_body, fields.get("Content-Type", "application/octet-stream"))
+            self._send(204)
+
+    return Handler
+
+
+def start_fake_s3_server(port: int = 0, latency_ms: float = 0.0):
+    """Chạy server trong thread nền; trả về (server, store, endpoint_url cho S3_ENDPOINT_URL)"""
+    store = FakeS3Store(latency_ms)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(store))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, store, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory S3-compatible server")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(FakeS3Store(args.latency_ms)))
+    print(f"Fake S3 server: S3_ENDPOINT_URL=http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# fake_smtp_server.py - SMTP sink local: nhận mọi email (AUTH bất kỳ, không TLS) và giữ trong RAM
+#
+# Usage:
+#   python benchmarks/fake_smtp_server.py [--port 2525] [--latency-ms 0]
+#   SMTP_HOST=127.0.0.1 SMTP_PORT=2525 SMTP_USE_TLS=false SMTP_USERNAME=bench SMTP_PASSWORD=bench uvicorn main:app
+#
+# Đủ cho email_service: EHLO / AUTH PLAIN|LOGIN / MAIL / RCPT / DATA / RSET / NOOP / QUIT.
+# Link trong email (verify-email / reset password) đọc lại bằng SMTPInbox.wait_for_link().
+import argparse
+import re
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+from email.policy import default as default_policy
+from typing import List, Dict, Any, Optional
+
+TOKEN_LINK = re.compile(r"https?://\S+?[?&]token=([A-Za-z0-9_\-]+)")
+
+
+class SMTPInbox:
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.messages: List[Dict[str, Any]] = []
+        self.condition = threading.Condition()
+
+    def deliver(self, recipients: List[str], data: bytes) -> None:
+        message = message_from_bytes(data, policy=default_policy)
+        text = "\n".join(
+            part.get_content() for part in message.walk() if part.get_content_type() in ("text/plain", "text/html")
+        )
+        with self.condition:
+            self.messages.append({
+                "to": [r.lower() for r in recipients], "subject": str(message["Subject"] or ""),
+                "text": text, "bytes": len(data)
+            })
+            self.condition.notify_all()
+
+    def wait_for_link(self, recipient: str, timeout: float = 10.0) -> Optional[str]:
+        """Token trong link của email mới nhất gửi tới `recipient` (chờ tối đa `timeout` giây)"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                for message in reversed(self.messages):
+                    match = TOKEN_LINK.search(message["text"]) if recipient.lower() in message["to"] else None
+                    if match:
+                        return match.group(1)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+
+def make_handler(inbox: SMTPInbox):
+    class Handler(socketserver.StreamRequestHandler):
+        def _reply(self, line: str):
+            self.wfile.write(f"{line}\r\n".encode())
+
+        def handle(self):
+            self._reply("220 fake-smtp ready")
+            recipients, auth_step = [], None
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                command = line.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if auth_step:
+                    # AUTH LOGIN: username rồi password (base64), không kiểm tra
+                    auth_step -= 1
+                    self._reply("334 UGFzc3dvcmQ6" if auth_step else "235 2.7.0 Authentication successful")
+                elif verb in ("EHLO", "HELO"):
+                    self.wfile.write(b"250-fake-smtp\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+                elif verb == "AUTH":
+                    if command.upper().startswith("AUTH LOGIN"):
+                        auth_step = 2
+                        self._reply("334 VXNlcm5hbWU6")
+                    else:
+                        self._reply("235 2.7.0 Authentication successful")
+                elif verb == "MAIL":
+                    recipients = []
+                    self._reply("250 OK")
+                elif verb == "RCPT":
+                    recipients.append(command.split(":", 1)[1].strip().strip("<>"))
+                    self._reply("250 OK")
+                elif verb == "DATA":
+                    self._reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = bytearray()
+                    while (chunk := self.rfile.readline()) not in (b".\r\n", b".\n", b""):
+                        data += chunk[1:] if chunk.startswith(b"..") else chunk
+                    if inbox.latency_ms:
+                        time.sleep(inbox.latency_ms / 1000)
+                    inbox.deliver(recipients, bytes(data))
+                    self._reply("250 OK queued")
+                elif verb == "QUIT":
+                    self._reply("221 Bye")
+                    return
+                elif verb in ("RSET", "NOOP"):
+                    self._reply("250 OK")
+                else:
+                    self._reply("502 Command not implemented")
+
+    return Handler
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_fake_smtp_server(port: int = 0, latency_ms: float = 0.0):
+    """Chạy server trong thread nền; trả về (server, inbox, port cho SMTP_PORT)"""
+    inbox = SMTPInbox(latency_ms)
+    server = _Server(("127.0.0.1", port), make_handler(inbox))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, inbox, server.server_address[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SMTP sink")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    inbox = SMTPInbox(args.latency_ms)
+    server = _Server(("127.0.0.1", args.port), make_handler(inbox))
+    print(f"Fake SMTP server: SMTP_HOST=127.0.0.1 SMTP_PORT={args.port} SMTP_USE_TLS=false")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"{len(inbox.messages)} messages received")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# analysis_cache.py - Content-addressed cache of LLM image analysis results
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional
+
+from sqlalchemy import func
+
+from models import AnalysisCache, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+ANALYSIS_CACHE_TTL_HOURS = int(os.getenv("ANALYSIS_CACHE_TTL_HOURS", str(24 * 7)))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "5000"))
+# Chỉ kết quả LLM được cache; metadata / ảnh bị loại (tên file, thứ tự upload) thuộc về từng request
+CACHED_FIELDS = ("success", "data", "usage")
+
+# Thống kê trong process (reset khi restart); tổng tích luỹ nằm trong bảng analysis_cache
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "llm_seconds_saved": 0.0}
+
+
+def hash_image_bytes(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def compute_cache_key(image_hashes: List[str], prompt_version: str) -> str:
+    """Key = SHA-256(sorted image hashes + prompt/model version); thứ tự upload không ảnh hưởng"""
+    payload = "|".join(sorted(image_hashes)) + "#" + prompt_version
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get(image_hashes: List[str], prompt_version: str) -> Optional[Dict[str, Any]]:
+    """Return the cached analysis result (marked `cached`) or None. Records hit/miss stats."""
+    if not ANALYSIS_CACHE_ENABLED or not image_hashes:
+        return None
+    key = compute_cache_key(image_hashes, prompt_version)
+    db = SessionLocal()
+    try:
+        entry = db.query(AnalysisCache).filter(AnalysisCache.cache_key == key).first()
+        expired = entry is not None and entry.created_at < datetime.utcnow() - timedelta(hours=ANALYSIS_CACHE_TTL_HOURS)
+        if entry is None or expired:
+            with _stats_lock:
+                _stats["misses"] += 1
+            return None
+
+        entry.hit_count = (entry.hit_count or 0) + 1
+        entry.last_hit_at = datetime.utcnow()
+        db.commit()
+        with _stats_lock:
+            _stats["hits"] += 1
+            _stats["llm_seconds_saved"] += entry.llm_seconds or 0.0
+
+        result = {field: entry.result[field] for field in CACHED_FIELDS if field in entry.result}
+        result["cached"] = True
+        result["cache"] = {
+            "key": key,
+            "cached_at": entry.created_at.isoformat(),
+            "hit_count": entry.hit_count,
+            "llm_seconds_saved": entry.llm_seconds
+        }
+        return result
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Analysis cache read error: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def put(image_hashes: List[str], prompt_version: str, result: Dict[str, Any], llm_seconds: float) -> None:
+    """Store the LLM part (CACHED_FIELDS) of a successful analysis result, then evict expired and overflow entries"""
+    if not ANALYSIS_CACHE_ENABLED or not image_hashes or not result.get("success"):
+        return
+    key = compute_cache_key(image_hashes, prompt_version)
+    db = SessionLocal()
+    try:
+        db.merge(AnalysisCache(
+            cache_key=key,
+            prompt_version=prompt_version,
+            result={field: result[field] for field in CACHED_FIELDS if field in result},
+            llm_seconds=llm_seconds,
+            hit_count=0,
+            created_at=datetime.utcnow()
+        ))
+        _evict(db)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Analysis cache write error: {e}")
+    finally:
+        db.close()
+
+
+def _evict(db) -> None:
+    cutoff = datetime.utcnow() - timedelta(hours=ANALYSIS_CACHE_TTL_HOURS)
+    db.query(AnalysisCache).filter(AnalysisCache.created_at < cutoff).delete(synchronize_session=False)
+
+    overflow = db.query(func.count(AnalysisCache.cache_key)).scalar() - ANALYSIS_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        # Xoá các entry lâu không được dùng nhất
+        oldest = db.query(AnalysisCache.cache_key).order_by(
+            func.coalesce(AnalysisCache.last_hit_at, AnalysisCache.created_at).asc()
+        ).limit(overflow).subquery()
+        db.query(AnalysisCache).filter(AnalysisCache.cache_key.in_(oldest)).delete(synchronize_session=False)
+
+
+def get_stats() -> Dict[str, Any]:
+    """Process counters (hit rate, LLM seconds saved) + persistent totals from the cache table"""
+    with _stats_lock:
+        process_stats = dict(_stats)
+    lookups = process_stats["hits"] + process_stats["misses"]
+    process_stats["hit_rate"] = round(process_stats["hits"] / lookups, 4) if lookups else 0.0
+
+    db = SessionLocal()
+    try:
+        entries, total_hits, seconds_saved = db.query(
+            func.count(AnalysisCache.cache_key),
+            func.coalesce(func.sum(AnalysisCache.hit_count), 0),
+            func.coalesce(func.sum(AnalysisCache.hit_count * AnalysisCache.llm_seconds), 0.0)
+        ).one()
+    finally:
+        db.close()
+
+    return {
+        "process": process_stats,
+        "persistent": {
+            "entries": entries,
+            "total_hits": int(total_hits),
+            "llm_seconds_saved": round(float(seconds_saved), 2)
+        },
+        "config": {
+            "enabled": ANALYSIS_CACHE_ENABLED,
+            "ttl_hours": ANALYSIS_CACHE_TTL_HOURS,
+            "max_entries": ANALYSIS_CACHE_MAX_ENTRIES
+        }
+    }
@@ -14,6 +14,8 @@ WARP_KEY = os.getenv("WARP_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 VERIFICATION_TOKEN_EXPIRE_HOURS = 24
+# Email được xem các báo cáo toàn hệ thống (LLM usage của mọi user...), phân tách bằng dấu phẩy
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
 
 # Configure passlib with bcrypt
 pwd_context = CryptContext(
@@ -104,6 +106,15 @@ async def get_current_user(
             detail="Could not validate credentials"
         )
 
+async def get_admin_user(current_user: Dict[str, Any] = Depends(get_current_user)) -> Dict[str, Any]:
+    """Current user, only if listed in ADMIN_EMAILS"""
+    if (current_user.get("email") or "").lower() not in ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
+
 # Email validation
 def is_valid_email(email: str) -> bool:
     """Basic email validation"""
@@ -0,0 +1,212 @@
+# blob_store.py - Content-addressed image storage index: mỗi nội dung ảnh (SHA-256) chỉ upload / lưu S3 một lần
+#
+# Usage (dọn blob mồ côi, chạy định kỳ):
+#   python blob_store.py cleanup [--grace-hours 72] [--dry-run]
+#   python blob_store.py stats
+import argparse
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Dict, Any
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from models import ImageBlob, UserBlob, SessionLocal
+from storage import delete_s3_object
+
+logger = logging.getLogger(__name__)
+
+BLOB_DEDUP_ENABLED = os.getenv("BLOB_DEDUP_ENABLED", "true").lower() == "true"
+# Blob chưa được report nào tham chiếu (upload xong nhưng chưa tạo report) được giữ tối thiểu chừng này
+BLOB_ORPHAN_GRACE_HOURS = int(os.getenv("BLOB_ORPHAN_GRACE_HOURS", "72"))
+
+
+def _as_dict(blob: ImageBlob) -> Dict[str, Any]:
+    return {"sha256": blob.sha256, "key": blob.s3_key, "url": blob.s3_url,
+            "bytes": blob.size_bytes, "renditions": blob.renditions or {}}
+
+
+def find_blobs(sha256s: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Tra index local (không HEAD S3 từng file): sha256 -> blob đã lưu. Mỗi lần tìm thấy được tính là
+    một upload trùng đã bỏ qua (seen_count, last_seen_at - cũng gia hạn thời gian giữ blob mồ côi).
+    """
+    if not BLOB_DEDUP_ENABLED or not sha256s:
+        return {}
+    db = SessionLocal()
+    try:
+        blobs = db.query(ImageBlob).filter(ImageBlob.sha256.in_(set(sha256s))).all()
+        now = datetime.utcnow()
+        for blob in blobs:
+            blob.seen_count = (blob.seen_count or 0) + sha256s.count(blob.sha256)
+            blob.last_seen_at = now
+        found = {blob.sha256: _as_dict(blob) for blob in blobs}
+        db.commit()
+        return found
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Blob index read error: {e}")
+        return {}
+    finally:
+        db.close()
+
+
+def register_blob(sha256: str, key: str, url: str, size: int, content_type: str = "image/jpeg",
+                  seen: int = 1) -> None:
+    """
+    Ghi blob vừa upload vào index (`seen`: số ảnh cùng nội dung trong request đã dùng chung lần upload này).
+    Hai request upload cùng nội dung đồng thời: cùng key, chỉ một dòng.
+    """
+    if not BLOB_DEDUP_ENABLED:
+        return
+    db = SessionLocal()
+    try:
+        db.add(ImageBlob(sha256=sha256, s3_key=key, s3_url=url, size_bytes=size, content_type=content_type,
+                         ref_count=0, seen_count=seen))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        db.query(ImageBlob).filter(ImageBlob.sha256 == sha256).update(
+            {ImageBlob.seen_count: ImageBlob.seen_count + seen, ImageBlob.last_seen_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Blob index write error: {e}")
+    finally:
+        db.close()
+
+
+def grant_blobs(user_id: int, keys: List[str]) -> None:
+    """Ghi nhận các blob key vừa cấp cho user (chỉ các key này được dùng khi user tạo report)"""
+    if not BLOB_DEDUP_ENABLED or not keys:
+        return
+    db = SessionLocal()
+    try:
+        granted = granted_blob_keys(db, user_id, keys)
+        for key in set(keys) - granted:
+            db.add(UserBlob(user_id=user_id, s3_key=key))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # Request khác của cùng user vừa ghi key này
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Blob grant write error: {e}")
+    finally:
+        db.close()
+
+
+def granted_blob_keys(db, user_id: int, keys: List[str]) -> set:
+    """Các key trong `keys` đã được cấp cho user"""
+    rows = db.query(UserBlob.s3_key).filter(UserBlob.user_id == user_id, UserBlob.s3_key.in_(set(keys))).all()
+    return {key for (key,) in rows}
+
+
+def set_renditions(sha256: str, key: str, renditions: Dict[str, Dict[str, Any]]) -> None:
+    """Lưu renditions của blob để lần upload trùng sau không phải decode / encode / upload lại"""
+    if not BLOB_DEDUP_ENABLED or not renditions:
+        return
+    db = SessionLocal()
+    try:
+        blob = db.query(ImageBlob).filter(ImageBlob.sha256 == sha256, ImageBlob.s3_key == key).first()
+        if blob is not None:
+            blob.renditions = {**(blob.renditions or {}), **renditions}
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Blob index write error: {e}")
+    finally:
+        db.close()
+
+
+def cleanup_orphans(grace_hours: int = BLOB_ORPHAN_GRACE_HOURS, dry_run: bool = False) -> Dict[str, Any]:
+    """Xoá (S3 + index) các blob không còn PropertyImage nào tham chiếu và không được upload lại trong grace_hours"""
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    db = SessionLocal()
+    deleted, freed_bytes, errors = 0, 0, 0
+    try:
+        orphans = db.query(ImageBlob).filter(ImageBlob.ref_count <= 0, ImageBlob.last_seen_at < cutoff).all()
+        candidates = [
+            (blob.sha256, blob.s3_key, blob.size_bytes or 0, [r["key"] for r in (blob.renditions or {}).values()])
+            for blob in orphans
+        ]
+        for sha256, key, size, rendition_keys in candidates:
+            if dry_run:
+                deleted += 1
+                freed_bytes += size
+                continue
+            # Xoá dòng index trước: upload trùng đến sau đó sẽ upload lại thay vì trỏ vào object sắp bị xoá
+            removed = db.query(ImageBlob).filter(
+                ImageBlob.sha256 == sha256, ImageBlob.ref_count <= 0, ImageBlob.last_seen_at < cutoff
+            ).delete(synchronize_session=False)
+            if removed:
+                # Cùng transaction: key đã thu hồi không còn là ảnh hợp lệ của user nào (kể cả khi sau này bị tái sử dụng)
+                db.query(UserBlob).filter(UserBlob.s3_key == key).delete(synchronize_session=False)
+            db.commit()
+            if not removed:
+                continue
+            try:
+                for object_key in [key] + rendition_keys:
+                    delete_s3_object(object_key)
+            except Exception as e:
+                errors += 1
+                logger.warning(f"Orphan blob delete failed ({key}): {e}")
+                continue
+            deleted += 1
+            freed_bytes += size
+    finally:
+        db.close()
+    logger.info(f"Orphan blob cleanup: {deleted} blobs, {freed_bytes / (1024 * 1024):.1f} MB freed, {errors} errors")
+    return {"deleted": deleted, "freed_bytes": freed_bytes, "errors": errors, "dry_run": dry_run,
+            "grace_hours": grace_hours}
+
+
+def get_stats() -> Dict[str, Any]:
+    """Tỉ lệ dedup và dung lượng tiết kiệm được (tích luỹ trong bảng image_blobs)"""
+    db = SessionLocal()
+    try:
+        blobs, uploads, stored_bytes, saved_bytes = db.query(
+            func.count(ImageBlob.sha256),
+            func.coalesce(func.sum(ImageBlob.seen_count), 0),
+            func.coalesce(func.sum(ImageBlob.size_bytes), 0),
+            func.coalesce(func.sum((ImageBlob.seen_count - 1) * ImageBlob.size_bytes), 0)
+        ).one()
+        orphans = db.query(func.count(ImageBlob.sha256)).filter(ImageBlob.ref_count <= 0).scalar()
+    finally:
+        db.close()
+
+    uploads = int(uploads)
+    return {
+        "unique_blobs": blobs,
+        "uploads": uploads,
+        "deduplicated_uploads": uploads - blobs,
+        "dedup_ratio": round((uploads - blobs) / uploads, 4) if uploads else 0.0,
+        "stored_bytes": int(stored_bytes),
+        "bytes_saved": int(saved_bytes),
+        "orphan_blobs": int(orphans),
+        "config": {"enabled": BLOB_DEDUP_ENABLED, "orphan_grace_hours": BLOB_ORPHAN_GRACE_HOURS}
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Content-addressed image blob maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cleanup = commands.add_parser("cleanup", help="Delete unreferenced blobs older than the grace period")
+    cleanup.add_argument("--grace-hours", type=int, default=BLOB_ORPHAN_GRACE_HOURS)
+    cleanup.add_argument("--dry-run", action="store_true")
+    commands.add_parser("stats", help="Print dedup ratio and bytes saved")
+    args = parser.parse_args()
+
+    if args.command == "cleanup":
+        print(json.dumps(cleanup_orphans(args.grace_hours, args.dry_run), indent=2))
+    else:
+        print(json.dumps(get_stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,8 @@ SMTP_USERNAME = os.getenv("SMTP_USERNAME", "")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
 SMTP_FROM_EMAIL = os.getenv("SMTP_FROM_EMAIL", SMTP_USERNAME)
 SMTP_FROM_NAME = os.getenv("SMTP_FROM_NAME", "Property Valuation AI")
+# false: SMTP không mã hoá (SMTP sink local, benchmarks/fake_smtp_server.py)
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
 
 
 def create_email_html(subject: str, heading: str, content: str, button_text: str, button_url: str) -> str:
@@ -133,8 +135,9 @@ async def send_email(
         # Send email
         with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as server:
             server.ehlo()
-            server.starttls()
-            server.ehlo()
+            if SMTP_USE_TLS:
+                server.starttls()
+                server.ehlo()
             server.login(SMTP_USERNAME, SMTP_PASSWORD)
             server.send_message(msg)
         
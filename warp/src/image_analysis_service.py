@@ -1,65 +1,473 @@
 # image_analysis_service.py - Enhanced Multi-Pass OCR Strategy
+import asyncio
 import base64
 import json
 import os
 import logging
+import random
+import re
+import time
 from io import BytesIO
 from typing import List, Dict, Any
-from PIL import Image, ImageEnhance, ImageFilter
-from openai import OpenAI
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps, ExifTags
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError
 from dotenv import load_dotenv
 import cv2
 import numpy as np
 
+import model_router
+import llm_ledger
+from image_encoder import encode_to_budget
+
 load_dotenv()
 
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 logger = logging.getLogger(__name__)
 
+# LLM client: timeout mỗi lần gọi, retry có backoff + jitter cho 429/5xx, giới hạn số request đồng thời mỗi process
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1.0"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20.0"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+
+# OPENAI_BASE_URL trỏ sang server giả lập (benchmarks/fake_llm_server.py) khi test không có mạng
+openai_client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    base_url=os.getenv("OPENAI_BASE_URL") or None,
+    timeout=LLM_TIMEOUT_SECONDS,
+    max_retries=0  # retry do _chat_completion quản lý
+)
+_llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (APITimeoutError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+def _backoff_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff; Retry-After của server (nếu có) là mức chờ tối thiểu"""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        delay = max(delay, min(float(retry_after), LLM_BACKOFF_MAX_SECONDS))
+    except (TypeError, ValueError):
+        pass
+    return delay
+
+
+async def _create_with_retry(**kwargs):
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            return await openai_client.chat.completions.create(timeout=LLM_TIMEOUT_SECONDS, **kwargs)
+        except Exception as e:
+            if attempt >= LLM_MAX_RETRIES or not _is_retryable(e):
+                raise
+            delay = _backoff_delay(attempt, e)
+            logger.warning(f"LLM call failed ({type(e).__name__}), retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+async def _chat_completion(**kwargs):
+    """chat.completions.create qua semaphore toàn process, retry lỗi tạm thời (429/5xx/timeout/mất kết nối)"""
+    async with _llm_semaphore:
+        return await _create_with_retry(**kwargs)
 
-def preprocess_image_for_ocr(image_bytes: bytes) -> bytes:
+
+async def _stream_chat_completion(usage: Dict[str, int], **kwargs):
+    """
+    Streaming variant: yield từng đoạn text của response. Giữ semaphore đến khi stream kết thúc;
+    chỉ retry trước khi nhận token đầu tiên. `usage` được điền nếu server trả usage ở chunk cuối.
     """
-    Pre-process ảnh để tăng độ chính xác OCR:
+    async with _llm_semaphore:
+        stream = await _create_with_retry(
+            stream=True, extra_body={"stream_options": {"include_usage": True}}, **kwargs
+        )
+        async for chunk in stream:
+            chunk_usage = getattr(chunk, "usage", None)
+            if chunk_usage:
+                usage["input_tokens"] = chunk_usage["prompt_tokens"] if isinstance(chunk_usage, dict) else chunk_usage.prompt_tokens
+                usage["output_tokens"] = chunk_usage["completion_tokens"] if isinstance(chunk_usage, dict) else chunk_usage.completion_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class IncrementalFieldParser:
+    """
+    Rút các cặp "field": scalar đã hoàn chỉnh từ JSON đang stream về (chưa parse được cả object).
+    Chỉ trả các field trong `fields`, mỗi field một lần.
+    """
+    _PAIR = re.compile(
+        r'(?<!\\)"([A-Za-z_0-9]+)"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?|true|false|null)\s*(?=[,}\n])'
+    )
+
+    def __init__(self, fields):
+        self.fields = set(fields)
+        self.buffer = ""
+        self.emitted = set()
+        self._pos = 0
+
+    def feed(self, text: str) -> List[tuple]:
+        self.buffer += text
+        found = []
+        for match in self._PAIR.finditer(self.buffer, self._pos):
+            self._pos = match.end()
+            key = match.group(1)
+            if key in self.fields and key not in self.emitted:
+                self.emitted.add(key)
+                found.append((key, json.loads(match.group(2))))
+        return found
+
+
+# Preprocess mode: "adaptive" (đo nhiễu/độ mờ rồi mới xử lý) hoặc "legacy" (luôn xử lý đầy đủ)
+OCR_PREPROCESS_MODE = os.getenv("OCR_PREPROCESS_MODE", "adaptive")
+
+# gpt-4o (detail: high) thu ảnh về khung 2048x2048 rồi cạnh ngắn 768 px -> gửi lớn hơn là lãng phí
+VISION_MAX_LONG_SIDE = 2048
+VISION_MAX_SHORT_SIDE = 768
+# Ảnh quá nhỏ (cạnh ngắn < ngưỡng) vẫn được phóng to để chữ nhỏ dễ đọc hơn
+OCR_MIN_SHORT_SIDE = 512
+# Ngưỡng đo trên ảnh đã resize: nhiễu (sigma ước lượng) và độ nét (phương sai Laplacian)
+NOISE_SIGMA_THRESHOLD = float(os.getenv("OCR_NOISE_SIGMA_THRESHOLD", "2.0"))
+BLUR_VARIANCE_THRESHOLD = float(os.getenv("OCR_BLUR_VARIANCE_THRESHOLD", "60.0"))
+OCR_JPEG_QUALITY = 88
+
+_NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+
+def measure_image_quality(img: Image.Image) -> Dict[str, float]:
+    """
+    Đo nhanh độ nhiễu và độ nét trên bản grayscale (ảnh đã thu về độ phân giải của model):
+    - noise_sigma: ước lượng độ lệch chuẩn nhiễu (phương pháp Immerkær)
+    - blur_variance: phương sai Laplacian (thấp = mờ)
+    """
+    gray = img.convert('L')
+    gray_array = np.asarray(gray, dtype=np.float32)
+    height, width = gray_array.shape
+    if height < 3 or width < 3:
+        return {"noise_sigma": 0.0, "blur_variance": float("inf")}
+
+    residual = np.abs(cv2.filter2D(gray_array, -1, _NOISE_KERNEL))[1:-1, 1:-1]
+    noise_sigma = float(residual.sum() * np.sqrt(0.5 * np.pi) / (6 * (width - 2) * (height - 2)))
+    blur_variance = float(cv2.Laplacian(gray_array, cv2.CV_32F).var())
+    return {"noise_sigma": round(noise_sigma, 2), "blur_variance": round(blur_variance, 1)}
+
+
+def _target_size(width: int, height: int) -> tuple:
+    """Kích thước mà vision model thực sự dùng (không phóng to trừ khi ảnh quá nhỏ)"""
+    short_side, long_side = min(width, height), max(width, height)
+    scale = min(1.0, VISION_MAX_LONG_SIDE / long_side, VISION_MAX_SHORT_SIDE / short_side)
+    if short_side < OCR_MIN_SHORT_SIDE:
+        scale = OCR_MIN_SHORT_SIDE / short_side
+    return snap_to_tile_grid(max(1, round(width * scale)), max(1, round(height * scale)))
+
+
+def adaptive_preprocess(img: Image.Image, stats: Dict[str, Any] = None) -> Image.Image:
+    """
+    Adaptive preprocessing trên ảnh PIL đã decode, theo thứ tự rẻ nhất:
+    1. Resize về độ phân giải vision model dùng (trước mọi bước tốn kém)
+    2. Denoise chỉ khi ảnh nhiễu
+    3. Tăng contrast
+    4. Sharpen chỉ khi ảnh mờ (sau denoise để không khuếch đại nhiễu)
+    """
+    stats = stats if stats is not None else {}
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    target = _target_size(*img.size)
+    stats["resized"] = target != img.size
+    if stats["resized"]:
+        img = img.resize(target, Image.Resampling.LANCZOS)
+
+    # Đo trên ảnh đã resize: chỉ nhiễu/độ mờ còn thấy ở độ phân giải model dùng mới cần xử lý
+    quality = measure_image_quality(img)
+    stats.update(quality)
+
+    stats["denoised"] = quality["noise_sigma"] > NOISE_SIGMA_THRESHOLD
+    if stats["denoised"]:
+        img = Image.fromarray(cv2.fastNlMeansDenoisingColored(np.asarray(img), None, 7, 7, 5, 15))
+
+    img = ImageEnhance.Contrast(img).enhance(1.5)
+
+    stats["sharpened"] = quality["blur_variance"] < BLUR_VARIANCE_THRESHOLD
+    if stats["sharpened"]:
+        img = ImageEnhance.Sharpness(img).enhance(2.0)
+    return img
+
+
+def legacy_preprocess(img: Image.Image) -> Image.Image:
+    """
+    Pre-process ảnh để tăng độ chính xác OCR (legacy, luôn xử lý đầy đủ):
     1. Tăng contrast
     2. Sharpen
     3. Denoise
     4. Tăng kích thước nếu quá nhỏ
     """
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    # Resize nếu quá nhỏ
+    width, height = img.size
+    if width < 1200:
+        scale = 1200 / width
+        new_size = (int(width * scale), int(height * scale))
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+    
+    # Tăng contrast
+    img = ImageEnhance.Contrast(img).enhance(1.5)
+    
+    # Tăng sharpness
+    img = ImageEnhance.Sharpness(img).enhance(2.0)
+    
+    # Denoise (OpenCV, trên buffer numpy)
+    img_array = cv2.fastNlMeansDenoisingColored(np.asarray(img), None, 10, 10, 7, 21)
+    return Image.fromarray(img_array)
+
+
+def decode_image(content: bytes) -> Image.Image:
+    """Decode ảnh đúng MỘT lần thành buffer pixel; các bước sau chỉ làm việc trên buffer này"""
+    img = Image.open(BytesIO(content))
+    img.load()
+    return img
+
+
+def decode_image_for_ocr(source) -> Image.Image:
+    """
+    Decode (bytes hoặc file object) cho pipeline OCR. Với JPEG ở chế độ adaptive, dùng draft() để
+    libjpeg giải mã thẳng ở tỉ lệ 1/2, 1/4, 1/8 (vẫn >= kích thước model dùng) -> ảnh rất lớn không bao giờ
+    được decode đầy đủ độ phân giải.
+    """
+    img = Image.open(BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    if img.format == "JPEG" and OCR_PREPROCESS_MODE != "legacy":
+        img.draft(img.mode, _target_size(*img.size))
+    img.load()
+    return apply_exif_orientation(img)
+
+
+def apply_exif_orientation(img: Image.Image) -> Image.Image:
+    """Xoay / lật buffer đã decode theo EXIF Orientation (ảnh gốc trên S3 giữ nguyên bytes + tag)"""
+    if img.getexif().get(ExifTags.Base.Orientation, 1) in (2, 3, 4, 5, 6, 7, 8):
+        return ImageOps.exif_transpose(img)
+    return img
+
+
+def transform_for_ocr(img: Image.Image, stats: Dict[str, Any] = None) -> Image.Image:
+    """Áp dụng preprocessing theo OCR_PREPROCESS_MODE trên ảnh đã decode"""
+    if OCR_PREPROCESS_MODE == "legacy":
+        return legacy_preprocess(img)
+    return adaptive_preprocess(img, stats)
+
+
+def encode_jpeg(img: Image.Image, quality: int = OCR_JPEG_QUALITY) -> bytes:
+    """Encode buffer pixel thành JPEG (bước encode duy nhất cho mỗi output)"""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    buffered = BytesIO()
+    img.save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+# --- Image planning: token/latency-aware selection of what is sent to the vision model ---
+# gpt-4o detail "high": 85 token cơ bản + 170 token cho mỗi ô 512x512; detail "low": 85 token cố định
+VISION_TILE_SIZE = 512
+VISION_BASE_TOKENS = 85
+VISION_TILE_TOKENS = 170
+# Thu nhỏ thêm tối đa 15% nếu việc đó giảm được số ô bị tính tiền
+TILE_SNAP_MAX_SHRINK = float(os.getenv("VISION_TILE_SNAP_MAX_SHRINK", "0.15"))
+# Ảnh gốc (trước khi phóng to) có cạnh dài <= 512 px: detail "low" nhìn thấy đủ pixel như "high" nhưng rẻ hơn
+LOW_DETAIL_MAX_SIDE = VISION_TILE_SIZE
+# Ảnh chụp (không phải tài liệu / screenshot) ở PASS 1 gửi detail "low": đủ để nhận loại phòng / tình trạng nhà;
+# chữ nằm trong screenshot, còn PASS 2 (truy trường còn thiếu) luôn gửi "high"
+LOW_DETAIL_PHOTOS_ENABLED = os.getenv("LOW_DETAIL_PHOTOS_ENABLED", "true").lower() == "true"
+# dHash 64 bit: khoảng cách Hamming <= ngưỡng thì coi là cùng một khung hình
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "4"))
+
+
+def _vision_billed_size(width: int, height: int) -> tuple:
+    """Kích thước sau khi API tự resize (fit 2048x2048, rồi cạnh ngắn tối đa 768)"""
+    scale = min(1.0, VISION_MAX_LONG_SIDE / max(width, height))
+    scale = min(scale, VISION_MAX_SHORT_SIDE / min(width, height))
+    return width * scale, height * scale
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Số input token vision model tính cho một ảnh"""
+    if detail == "low":
+        return VISION_BASE_TOKENS
+    billed_width, billed_height = _vision_billed_size(width, height)
+    tiles = int(np.ceil(billed_width / VISION_TILE_SIZE) * np.ceil(billed_height / VISION_TILE_SIZE))
+    return VISION_BASE_TOKENS + VISION_TILE_TOKENS * tiles
+
+
+def snap_to_tile_grid(width: int, height: int) -> tuple:
+    """Thu nhỏ nhẹ (<= TILE_SNAP_MAX_SHRINK) để cạnh rơi đúng bội số 512 nếu nhờ vậy giảm số ô"""
+    best = (width, height)
+    best_tokens = estimate_image_tokens(width, height)
+    for side in (width, height):
+        if side % VISION_TILE_SIZE == 0 or side < VISION_TILE_SIZE:
+            continue
+        scale = (side // VISION_TILE_SIZE) * VISION_TILE_SIZE / side
+        if scale < 1 - TILE_SNAP_MAX_SHRINK:
+            continue
+        candidate = (int(width * scale), int(height * scale))
+        tokens = estimate_image_tokens(*candidate)
+        if tokens < best_tokens or (tokens == best_tokens and candidate[0] > best[0]):
+            best, best_tokens = candidate, tokens
+    return best
+
+
+def compute_dhash(img: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash 64 bit trên thumbnail grayscale (hash_size+1 x hash_size)"""
+    small = np.asarray(img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# Ảnh dạng tài liệu / screenshot: phần lớn pixel trùng màu nền. Các screenshot khác nội dung chữ có dHash
+# gần như giống hệt nhau nên không được coi là "gần trùng" (chỉ bỏ khi trùng hẳn nội dung)
+DOCUMENT_FLAT_FRACTION = 0.5
+DOCUMENT_FLAT_TOLERANCE = 3
+
+
+def is_document_like(gray: Image.Image) -> bool:
+    histogram = np.asarray(gray.histogram(), dtype=np.int64)
+    mode = int(histogram.argmax())
+    flat = histogram[max(0, mode - DOCUMENT_FLAT_TOLERANCE):mode + DOCUMENT_FLAT_TOLERANCE + 1].sum()
+    return bool(flat >= DOCUMENT_FLAT_FRACTION * histogram.sum())
+
+
+def _is_near_duplicate(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    if a.get("document") or b.get("document"):
+        return a.get("sha256") is not None and a.get("sha256") == b.get("sha256")
+    return hamming_distance(a["dhash"], b["dhash"]) <= NEAR_DUPLICATE_MAX_DISTANCE
+
+
+def edge_density(gray: Image.Image) -> float:
+    """Tỉ lệ pixel cạnh (Canny) trên thumbnail grayscale - ước lượng rẻ lượng chữ / chi tiết"""
+    edges = cv2.Canny(np.asarray(gray, dtype=np.uint8), 50, 150)
+    return round(float(np.count_nonzero(edges)) / edges.size, 4)
+
+
+def describe_image(img: Image.Image, source_size: tuple = None) -> Dict[str, Any]:
+    """
+    Metadata của ảnh (đã transform) dùng cho planning / routing: kích thước, dạng tài liệu, mật độ cạnh.
+    `source_size` là kích thước đã decode trước transform (adaptive_preprocess có thể phóng to ảnh nhỏ).
+    """
+    thumb = img.convert('L')
+    thumb.thumbnail((256, 256))
+    source_width, source_height = source_size or img.size
+    return {"width": img.width, "height": img.height, "source_width": source_width, "source_height": source_height,
+            "document": is_document_like(thumb), "edge_density": edge_density(thumb)}
+
+
+def plan_images(image_info: List[Dict[str, Any]]) -> tuple:
+    """
+    Chọn detail level theo kích thước gốc và nội dung từng ảnh (xem choose_detail). Trả về (detail của từng ảnh, số token nếu gửi mọi ảnh ở "high").
+    Không bỏ ảnh nào: ảnh gần trùng / mờ đã được gate_images loại (và báo trong "skipped") trước bước này.
+    """
+    details = [choose_detail(info) for info in image_info]
+    unplanned_tokens = sum(estimate_image_tokens(info["width"], info["height"]) for info in image_info)
+    return details, unplanned_tokens
+
+
+def choose_detail(info: Dict[str, Any], retry: bool = False) -> str:
+    """
+    "low" nếu ảnh gốc đủ nhỏ (phóng to không thêm chi tiết), hoặc là ảnh chụp ở PASS 1 (LOW_DETAIL_PHOTOS_ENABLED);
+    tài liệu / screenshot (hoặc không rõ) và ảnh PASS 2 (`retry`) gửi "high".
+    """
+    source_side = max(info.get("source_width", info["width"]), info.get("source_height", info["height"]))
+    if source_side <= LOW_DETAIL_MAX_SIDE:
+        return "low"
+    if LOW_DETAIL_PHOTOS_ENABLED and not retry and info.get("document") is False:
+        return "low"
+    return "high"
+
+
+# Gating trước preprocessing: đo trên thumbnail nhỏ (JPEG decode bằng draft), bỏ ảnh gần trùng / quá mờ
+IMAGE_GATING_ENABLED = os.getenv("IMAGE_GATING_ENABLED", "true").lower() == "true"
+GATE_THUMBNAIL_SIZE = 512
+# Phương sai Laplacian trên thumbnail GATE_THUMBNAIL_SIZE; thấp hơn ngưỡng coi như khung hình mờ không dùng được
+GATE_MIN_SHARPNESS = float(os.getenv("GATE_MIN_SHARPNESS", "20.0"))
+
+
+def assess_image(source) -> Dict[str, Any]:
+    """dHash + độ nét (phương sai Laplacian) trên thumbnail; chỉ decode ở tỉ lệ nhỏ"""
+    img = Image.open(BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    width, height = img.size
+    img.draft("L", (GATE_THUMBNAIL_SIZE, GATE_THUMBNAIL_SIZE))
+    thumb = img.convert("L")
+    thumb.thumbnail((GATE_THUMBNAIL_SIZE, GATE_THUMBNAIL_SIZE), Image.Resampling.BILINEAR)
+    sharpness = float(cv2.Laplacian(np.asarray(thumb, dtype=np.float32), cv2.CV_32F).var())
+    return {"width": width, "height": height, "dhash": compute_dhash(thumb),
+            "sharpness": round(sharpness, 1), "document": is_document_like(thumb)}
+
+
+def gate_images(assessments: List[Dict[str, Any]]) -> tuple:
+    """
+    Chọn ảnh đáng gửi đi phân tích. Trả về (chỉ số ảnh giữ lại theo thứ tự upload, danh sách ảnh bị bỏ + lý do):
+    - near_duplicate: nhóm ảnh có dHash cách nhau <= NEAR_DUPLICATE_MAX_DISTANCE, giữ ảnh nét nhất của nhóm
+      (screenshot / tài liệu chỉ khi trùng sha256 - assessments có thể kèm "sha256")
+    - blurry: sharpness < GATE_MIN_SHARPNESS
+    """
+    # Duyệt từ ảnh nét nhất để ảnh đại diện mỗi nhóm trùng là ảnh nét nhất
+    order = sorted(range(len(assessments)), key=lambda i: -assessments[i]["sharpness"])
+    # Khung hình mờ bị loại trước khi gom nhóm (ảnh rung vẫn giữ dHash của ảnh gốc); nếu mọi ảnh đều mờ thì giữ ảnh nét nhất
+    sharp = [i for i in order if assessments[i]["sharpness"] >= GATE_MIN_SHARPNESS] or order[:1]
+    skipped = [
+        {"index": i, "reason": "blurry", "sharpness": assessments[i]["sharpness"], "min_sharpness": GATE_MIN_SHARPNESS}
+        for i in order if i not in sharp
+    ]
+    kept = []
+    for index in sharp:
+        info = assessments[index]
+        duplicate_of = next((k for k in kept if _is_near_duplicate(info, assessments[k])), None)
+        if duplicate_of is None:
+            kept.append(index)
+        else:
+            skipped.append({
+                "index": index,
+                "reason": "near_duplicate",
+                "duplicate_of": duplicate_of,
+                "distance": hamming_distance(info["dhash"], assessments[duplicate_of]["dhash"]),
+                "sharpness": info["sharpness"]
+            })
+    return sorted(kept), sorted(skipped, key=lambda s: s["index"])
+
+
+def prepare_llm_image(content: bytes, stats: Dict[str, Any] = None) -> str:
+    """
+    Single-decode pipeline cho LLM input: decode một lần -> transform trên buffer -> encode theo byte budget
+    của profile "llm" -> base64. Trả về base64 của ảnh; `stats` (nếu có) nhận thông tin decode/transform/encode.
+    """
+    img = decode_image(content)
+    if stats is not None:
+        stats["decoded_mb"] = round(img.width * img.height * len(img.getbands()) / (1024 * 1024), 2)
+    img = transform_for_ocr(img, stats)
+    llm_bytes, encode_stats = encode_to_budget(img, "llm")
+    if stats is not None:
+        stats["encode"] = encode_stats
+    return base64.b64encode(llm_bytes).decode()
+
+
+def preprocess_image_for_ocr_legacy(image_bytes: bytes) -> bytes:
+    """Legacy preprocessing trên bytes (giữ cho benchmark / tương thích)"""
     try:
-        img = Image.open(BytesIO(image_bytes))
-        
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Resize nếu quá nhỏ
-        width, height = img.size
-        if width < 1200:
-            scale = 1200 / width
-            new_size = (int(width * scale), int(height * scale))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # Tăng contrast
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.5)
-        
-        # Tăng sharpness
-        enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(2.0)
-        
-        # Convert to numpy for OpenCV
-        img_array = np.array(img)
-        
-        # Denoise
-        img_array = cv2.fastNlMeansDenoisingColored(img_array, None, 10, 10, 7, 21)
-        
-        # Convert back to PIL
-        img = Image.fromarray(img_array)
-        
-        # Save to bytes
-        buffered = BytesIO()
-        img.save(buffered, format="JPEG", quality=95)
-        return buffered.getvalue()
-        
+        return encode_jpeg(legacy_preprocess(decode_image(image_bytes)), quality=95)
+    except Exception as e:
+        logger.warning(f"Preprocess error: {e}, using original")
+        return image_bytes
+
+
+def preprocess_image_for_ocr(image_bytes: bytes, stats: Dict[str, Any] = None) -> bytes:
+    """Pre-process ảnh cho OCR theo OCR_PREPROCESS_MODE (adaptive mặc định)"""
+    try:
+        return encode_to_budget(transform_for_ocr(decode_image(image_bytes), stats), "llm")[0]
     except Exception as e:
         logger.warning(f"Preprocess error: {e}, using original")
         return image_bytes
@@ -72,30 +480,35 @@ def encode_image_to_base64(image_file) -> str:
 
 
 def compress_image_if_needed(content: bytes, max_size_mb: float = 20) -> bytes:
-    """Compress image nếu vượt quá giới hạn"""
+    """Compress image nếu vượt quá giới hạn (về profile "original": cạnh dài 4096, byte budget riêng)"""
     if len(content) / (1024 * 1024) > max_size_mb:
-        img = Image.open(BytesIO(content))
-        img.thumbnail((1920, 1440))
-        buffered = BytesIO()
-        img.save(buffered, format="JPEG", quality=85, optimize=True)
-        return buffered.getvalue()
+        img = apply_exif_orientation(decode_image(content))
+        return encode_to_budget(img, "original")[0]
     return content
 
 
 def convert_bytes_to_base64_for_analysis(content: bytes, preprocess: bool = True) -> str:
-    """Convert bytes thành base64 cho AI analysis"""
+    """Convert bytes thành base64 cho AI analysis (không re-encode khi preprocess=False)"""
     if preprocess:
-        content = preprocess_image_for_ocr(content)
-    
-    img = Image.open(BytesIO(content))
-    buffered = BytesIO()
-    img.save(buffered, format="JPEG", quality=95)
-    return base64.b64encode(buffered.getvalue()).decode()
+        return prepare_llm_image(content)
+    return base64.b64encode(content).decode()
+
+
+# PASS 1 song song: upload từ PARALLEL_MIN_IMAGES ảnh được chia thành các nhóm ~PARALLEL_GROUP_SIZE ảnh liên tiếp,
+# mỗi nhóm một request chạy đồng thời (wall-clock giảm, token prompt tăng theo số nhóm)
+PARALLEL_EXTRACTION_ENABLED = os.getenv("PARALLEL_EXTRACTION_ENABLED", "true").lower() == "true"
+PARALLEL_MIN_IMAGES = int(os.getenv("PARALLEL_MIN_IMAGES", "6"))
+PARALLEL_GROUP_SIZE = int(os.getenv("PARALLEL_GROUP_SIZE", "4"))
 
 
 class ImageToFormAnalyzer:
     """Xử lý chuyển đổi ảnh bất động sản thành form/dữ liệu với multi-pass strategy"""
     
+    # Tăng version khi đổi prompt/model để cache không trả kết quả cũ
+    PROMPT_VERSION = "multipass-v3"
+    # Model lớn; PASS 1 của screenshot nhiều chữ có thể đi tier nhanh (model_router)
+    MODEL = model_router.MODEL_TIERS["large"]["model"]
+    
     # Critical fields that must not be missed
     CRITICAL_FIELDS = [
         "usable_area_m2", "bedrooms", "bathrooms", "floors", 
@@ -103,40 +516,170 @@ class ImageToFormAnalyzer:
         "width_m", "length_m"
     ]
     
+    # Field dạng scalar được phát ngay khi stream PASS 1 (field -> section)
+    STREAM_FIELDS = {
+        **{f: "property_info" for f in (
+            "address", "property_type", "usable_area_m2", "bedrooms", "bathrooms", "floors",
+            "direction", "balcony_direction", "width_m", "length_m", "legal_status",
+            "furniture_status", "land_area_m2", "price_per_m2_vnd", "latitude", "longitude"
+        )},
+        **{f: "condition_assessment" for f in (
+            "overall_condition", "cleanliness", "maintenance_status", "overall_description"
+        )}
+    }
+    
+    # Từ khoá trong text của từng ảnh (pass 1) cho thấy ảnh có thể chứa trường bị thiếu
+    FIELD_KEYWORDS = {
+        "usable_area_m2": ["diện tích", "dt", "m²", "m2"],
+        "bedrooms": ["phòng ngủ", "pn", "ngủ"],
+        "bathrooms": ["phòng tắm", "vệ sinh", "wc", "toilet"],
+        "floors": ["tầng", "lầu"],
+        "direction": ["hướng"],
+        "legal_status": ["pháp lý", "sổ", "giấy tờ"],
+        "furniture_status": ["nội thất", "cơ bản", "đầy đủ", "coban"],
+        "width_m": ["mặt tiền", "chiều rộng", "ngang"],
+        "length_m": ["đường vào", "chiều dài", "sâu", "dài"]
+    }
+    
     @staticmethod
-    def analyze_images_to_form(images_base64: List[str]) -> Dict[str, Any]:
+    def _without_known_fields(prompt: str, known_fields: Dict[str, Any]) -> str:
+        """Bỏ dòng gợi ý ("+ field:") và dòng schema output ("field":) của các trường đã biết"""
+        if not known_fields:
+            return prompt
+        prefixes = tuple(p for f in known_fields for p in (f"+ {f}:", f'"{f}":'))
+        return "\n".join(line for line in prompt.split("\n") if not line.strip().startswith(prefixes))
+    
+    @staticmethod
+    async def analyze_images_to_form(
+        images_base64: List[str],
+        image_info: List[Dict[str, Any]] = None,
+        on_event=None,
+        known_fields: Dict[str, Any] = None,
+        degraded: bool = False
+    ) -> Dict[str, Any]:
         """
         Multi-pass OCR strategy:
-        PASS 1: Comprehensive extraction with focused prompt
-        PASS 2: Targeted retry for any missed critical fields
+        PLAN: Pick detail level per image (near-duplicates are gated out before this), route to a model tier
+        PASS 1: Comprehensive extraction with focused prompt (re-run on the escalation tier if the fast tier fails)
+        PASS 2: Targeted retry for any missed critical fields on the escalation tier, only on images likely to hold them
+        
+        `image_info` (width/height/document per image, see describe_image) avoids re-decoding the images.
+        `on_event(name, data)` (async) streams pass 1 and receives fields as they are parsed.
+        `known_fields` (property_info đã biết, vd. toạ độ GPS từ EXIF) không được hỏi LLM và được ghi vào kết quả.
+        `degraded` (user đã hết budget LLM trong ngày): PASS 1 trên tier nhanh, không chạy PASS 2.
         """
+        known_fields = known_fields or {}
         try:
-            # PASS 1: First comprehensive extraction
-            logger.info("🔍 Starting PASS 1: Comprehensive extraction")
-            first_result = ImageToFormAnalyzer._first_pass_extraction(images_base64)
+            if image_info is None:
+                image_info = await asyncio.to_thread(
+                    lambda: [describe_image(decode_image(base64.b64decode(b))) for b in images_base64]
+                )
+            details, unplanned_tokens = plan_images(image_info)
+            plan = {
+                "images_received": len(images_base64),
+                "images_sent_pass1": len(images_base64),
+                "known_fields": sorted(known_fields),
+                "passes": []
+            }
+            
+            if on_event is not None:
+                for field, value in known_fields.items():
+                    await on_event("field", {
+                        "pass": 0, "section": "property_info", "field": field, "value": value, "source": "exif"
+                    })
             
+            route = model_router.route_first_pass(image_info)
+            if degraded:
+                route = {"tier": "fast", "model": model_router.MODEL_TIERS["fast"]["model"], "reason": "budget"}
+                plan["degraded"] = True
+            plan["routing"] = {**route, "escalated": False}
+            
+            # PASS 1: First comprehensive extraction (upload nhiều ảnh: các nhóm ảnh chạy song song rồi gộp)
+            groups = ImageToFormAnalyzer._split_groups(len(images_base64))
+            logger.info(
+                f"🔍 Starting PASS 1: Comprehensive extraction ({route['model']}, {route['reason']}, {len(groups)} group(s))"
+            )
+            if len(groups) == 1:
+                first_result, tier, attempts = await ImageToFormAnalyzer._extract_with_escalation(
+                    images_base64, details, on_event, known_fields, route["tier"]
+                )
+                for attempt in attempts:
+                    plan["passes"].append(ImageToFormAnalyzer._pass_report(
+                        1, image_info, details, attempt, unplanned_tokens
+                    ))
+            else:
+                first_result, tier = await ImageToFormAnalyzer._parallel_first_pass(
+                    images_base64, details, groups, on_event, known_fields, route["tier"], plan
+                )
+                plan["passes"].append(ImageToFormAnalyzer._pass_report(
+                    1, image_info, details, first_result, unplanned_tokens
+                ))
+            if tier != route["tier"]:
+                plan["routing"].update(escalated=True, escalation_reason="pass1_failed")
+            first_result["plan"] = plan
             if not first_result['success']:
                 return first_result
+            first_result['data'].setdefault("property_info", {}).update(known_fields)
             
             # Validate critical fields
             missing_fields = ImageToFormAnalyzer._validate_critical_fields(
                 first_result['data']
             )
+            model_router.record_first_pass(
+                tier, missing_fields, len([f for f in ImageToFormAnalyzer.CRITICAL_FIELDS if f not in known_fields])
+            )
+            
+            if on_event is not None:
+                await on_event("pass_complete", {
+                    "pass": 1, "latency_ms": first_result.get("latency_ms"), "missing_fields": missing_fields,
+                    "groups": len(groups)
+                })
             
             # If all fields present, return immediately
             if not missing_fields:
                 logger.info("✅ All critical fields extracted successfully")
                 return first_result
+            if degraded:
+                logger.info(f"💸 Budget exceeded, skipping PASS 2 (missing: {', '.join(missing_fields)})")
+                return first_result
             
-            # PASS 2: Targeted retry for missed fields
+            # PASS 2: Targeted retry for missed fields (tier lớn; từ tier nhanh thì tính là escalate)
             logger.warning(f"⚠️ Missing fields: {', '.join(missing_fields)}")
             logger.info("🔄 Starting PASS 2: Targeted retry")
+            if tier != model_router.ESCALATION_TIER:
+                model_router.record_escalation(tier)
+                plan["routing"].update(escalated=True, escalation_reason="missing_critical_fields")
             
-            second_result = ImageToFormAnalyzer._targeted_retry(
-                images_base64, 
+            selected = ImageToFormAnalyzer._select_retry_images(
+                first_result['data'], missing_fields, len(images_base64)
+            )
+            retry_details = [choose_detail(image_info[i], retry=True) for i in selected]
+            second_result = await ImageToFormAnalyzer._targeted_retry(
+                [images_base64[i] for i in selected],
                 missing_fields,
-                first_result['data']
+                first_result['data'],
+                retry_details,
+                model_router.ESCALATION_TIER
             )
+            ImageToFormAnalyzer._record_call(2, model_router.ESCALATION_TIER, len(selected), second_result)
+            plan["passes"].append(ImageToFormAnalyzer._pass_report(
+                2, [image_info[i] for i in selected], retry_details, second_result, unplanned_tokens
+            ))
+            plan["pass2_image_indices"] = selected
+            second_result["plan"] = plan
+            if on_event is not None:
+                for field in second_result.get("retry_info", {}).get("recovered_fields", []):
+                    await on_event("field", {
+                        "pass": 2,
+                        "section": "property_info",
+                        "field": field,
+                        "value": second_result["data"]["property_info"][field]
+                    })
+            # Usage tổng của cả 2 pass
+            second_result["usage"] = {
+                key: sum(p.get("usage", {}).get(key, 0) for p in (first_result, second_result))
+                for key in ("input_tokens", "output_tokens")
+            }
             
             return second_result
             
@@ -149,8 +692,247 @@ class ImageToFormAnalyzer:
             }
     
     @staticmethod
-    def _first_pass_extraction(images_base64: List[str]) -> Dict[str, Any]:
-        """PASS 1: Focused extraction with emphasis on critical fields"""
+    def _split_groups(image_count: int) -> List[List[int]]:
+        """
+        Chia ảnh thành các nhóm liên tiếp (giữ thứ tự upload, kích thước chênh nhau tối đa 1) cho PASS 1 song song.
+        Ít hơn PARALLEL_MIN_IMAGES ảnh (hoặc tắt) thì một nhóm duy nhất.
+        """
+        if not PARALLEL_EXTRACTION_ENABLED or image_count < PARALLEL_MIN_IMAGES:
+            return [list(range(image_count))]
+        group_count = -(-image_count // PARALLEL_GROUP_SIZE)
+        size, extra = divmod(image_count, group_count)
+        groups, start = [], 0
+        for g in range(group_count):
+            end = start + size + (1 if g < extra else 0)
+            groups.append(list(range(start, end)))
+            start = end
+        return groups
+    
+    @staticmethod
+    def _record_call(pass_number: int, tier: str, image_count: int, result: Dict[str, Any]) -> None:
+        """Một lần gọi LLM: thống kê theo tier (model_router) + ledger theo user / request (llm_ledger)"""
+        model_router.record_call(tier, result)
+        llm_ledger.record_llm_call(
+            pass_number, result.get("model") or model_router.MODEL_TIERS[tier]["model"], image_count, result
+        )
+    
+    @staticmethod
+    async def _extract_with_escalation(
+        images_base64: List[str],
+        details: List[str],
+        on_event,
+        known_fields: Dict[str, Any],
+        tier: str
+    ) -> tuple:
+        """PASS 1 trên `tier`; tier nhanh lỗi (JSON hỏng, model lỗi) thì chạy lại trên tier escalate.
+        Trả về (kết quả, tier cho kết quả đó, các lần gọi)."""
+        result = await ImageToFormAnalyzer._first_pass_extraction(images_base64, details, on_event, known_fields, tier)
+        ImageToFormAnalyzer._record_call(1, tier, len(images_base64), result)
+        attempts = [result]
+        if not result["success"] and tier != model_router.ESCALATION_TIER:
+            logger.warning(f"⚠️ PASS 1 failed on {result.get('model')}, escalating")
+            model_router.record_escalation(tier)
+            tier = model_router.ESCALATION_TIER
+            result = await ImageToFormAnalyzer._first_pass_extraction(
+                images_base64, details, on_event, known_fields, tier
+            )
+            ImageToFormAnalyzer._record_call(1, tier, len(images_base64), result)
+            attempts.append(result)
+        return result, tier, attempts
+    
+    @staticmethod
+    async def _parallel_first_pass(
+        images_base64: List[str],
+        details: List[str],
+        groups: List[List[int]],
+        on_event,
+        known_fields: Dict[str, Any],
+        tier: str,
+        plan: Dict[str, Any]
+    ) -> tuple:
+        """
+        PASS 1 song song: mỗi nhóm ảnh một request, các request chạy đồng thời (giới hạn bởi semaphore LLM),
+        kết quả gộp bằng _merge_partial_results. Event "field" chỉ phát lần đầu mỗi field; nếu giá trị sau khi
+        gộp khác giá trị đã phát thì phát lại kèm "merged": True. Trả về (kết quả gộp, tier cho kết quả).
+        """
+        emitted = {}
+        group_event = None
+        if on_event is not None:
+            async def group_event(event, data):
+                if event == "field":
+                    if data["field"] in emitted:
+                        return
+                    emitted[data["field"]] = data["value"]
+                await on_event(event, data)
+        
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(
+            ImageToFormAnalyzer._extract_with_escalation(
+                [images_base64[i] for i in group], [details[i] for i in group], group_event, known_fields, tier
+            )
+            for group in groups
+        ))
+        wall_ms = round((time.perf_counter() - start) * 1000, 1)
+        
+        attempts = [attempt for _, _, group_attempts in outcomes for attempt in group_attempts]
+        usage = {
+            key: sum((attempt.get("usage") or {}).get(key, 0) for attempt in attempts)
+            for key in ("input_tokens", "output_tokens")
+        }
+        result_tier = model_router.ESCALATION_TIER if any(t != tier for _, t, _ in outcomes) else tier
+        succeeded = [(group, result) for group, (result, _, _) in zip(groups, outcomes) if result["success"]]
+        plan["parallel"] = {
+            "groups": [len(group) for group in groups],
+            "failed_groups": [g for g, (result, _, _) in enumerate(outcomes) if not result["success"]],
+            "wall_ms": wall_ms,
+            # Tổng latency các request = thời gian nếu chạy tuần tự từng nhóm
+            "sum_latency_ms": round(sum(attempt.get("latency_ms") or 0 for attempt in attempts), 1),
+            "input_tokens": usage["input_tokens"],
+            "output_tokens": usage["output_tokens"]
+        }
+        if not succeeded:
+            failed = outcomes[0][0]
+            return {**failed, "usage": usage, "latency_ms": wall_ms}, result_tier
+        
+        data, conflicts = ImageToFormAnalyzer._merge_partial_results(
+            [result["data"] for _, result in succeeded], [len(group) for group, _ in succeeded]
+        )
+        if len(succeeded) < len(groups):
+            # image_texts không phủ hết ảnh -> PASS 2 xét mọi ảnh
+            data.pop("image_texts", None)
+        plan["parallel"]["conflicts"] = conflicts
+        if conflicts:
+            logger.info(f"🔀 PASS 1 merge conflicts: {', '.join(conflicts)}")
+        
+        if on_event is not None:
+            for field, section in ImageToFormAnalyzer.STREAM_FIELDS.items():
+                value = data.get(section, {}).get(field)
+                if field in emitted and value is not None and value != emitted[field]:
+                    await on_event("field", {"pass": 1, "section": section, "field": field, "value": value, "merged": True})
+        
+        logger.info(f"✅ PASS 1 ({len(groups)} groups) completed in {wall_ms} ms. "
+                    f"Tokens: {usage['input_tokens']}/{usage['output_tokens']}")
+        return {
+            "success": True,
+            "data": data,
+            "usage": usage,
+            "latency_ms": wall_ms,
+            "model": model_router.MODEL_TIERS[result_tier]["model"]
+        }, result_tier
+    
+    @staticmethod
+    def _merge_partial_results(partials: List[Dict[str, Any]], group_sizes: List[int]) -> tuple:
+        """
+        Gộp kết quả PASS 1 của các nhóm ảnh (theo thứ tự nhóm). Mỗi field của property_info / condition_assessment:
+        bỏ giá trị rỗng (None, "", 0); còn lại chọn giá trị nhiều nhóm trả về nhất (so sánh không phân biệt hoa
+        thường / khoảng trắng), hoà thì lấy nhóm đứng trước. List (major_issues) được hợp lại, bỏ trùng.
+        Trả về (data, conflicts: field -> các giá trị khác nhau).
+        """
+        def vote_key(value):
+            if isinstance(value, str):
+                return value.strip().lower()
+            return json.dumps(value, sort_keys=True, ensure_ascii=False)
+        
+        merged: Dict[str, Any] = {}
+        conflicts: Dict[str, List[Any]] = {}
+        for section in ("property_info", "condition_assessment"):
+            sections = [p.get(section) if isinstance(p.get(section), dict) else {} for p in partials]
+            fields = list(dict.fromkeys(field for part in sections for field in part))
+            merged[section] = {}
+            for field in fields:
+                values = [part.get(field) for part in sections if field in part]
+                if any(isinstance(v, list) for v in values):
+                    unique: Dict[str, Any] = {}
+                    for item in (item for v in values if isinstance(v, list) for item in v):
+                        unique.setdefault(vote_key(item), item)
+                    merged[section][field] = list(unique.values())
+                    continue
+                candidates = [v for v in values if not (v is None or v == "" or v == 0)]
+                if not candidates:
+                    merged[section][field] = values[0]
+                    continue
+                votes: Dict[str, List[Any]] = {}
+                for value in candidates:
+                    votes.setdefault(vote_key(value), []).append(value)
+                # dict giữ thứ tự xuất hiện -> max() trả về giá trị xuất hiện trước khi số phiếu bằng nhau
+                merged[section][field] = max(votes.values(), key=len)[0]
+                if len(votes) > 1:
+                    conflicts[f"{section}.{field}"] = [group[0] for group in votes.values()]
+        
+        texts = [p.get("all_visible_text") for p in partials]
+        merged["all_visible_text"] = "\n".join(str(t) for t in texts if t)
+        # image_texts chỉ giữ khi mọi nhóm trả đủ một text mỗi ảnh (PASS 2 dựa vào chỉ số ảnh)
+        image_texts = [p.get("image_texts") for p in partials]
+        if all(isinstance(t, list) and len(t) == size for t, size in zip(image_texts, group_sizes)):
+            merged["image_texts"] = [text for group in image_texts for text in group]
+        for part in partials:
+            for key, value in part.items():
+                if key != "image_texts":
+                    merged.setdefault(key, value)
+        return merged, conflicts
+    
+    @staticmethod
+    def _image_content(images_base64: List[str], details: List[str] = None) -> List[Dict[str, Any]]:
+        details = details or ["high"] * len(images_base64)
+        return [
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{img_b64}",
+                    "detail": detail
+                }
+            }
+            for img_b64, detail in zip(images_base64, details)
+        ]
+    
+    @staticmethod
+    def _pass_report(
+        pass_number: int,
+        image_info: List[Dict[str, Any]],
+        details: List[str],
+        result: Dict[str, Any],
+        unplanned_tokens: int
+    ) -> Dict[str, Any]:
+        """Estimated image tokens before (all received images at high detail) vs after planning"""
+        return {
+            "pass": pass_number,
+            "model": result.get("model"),
+            "images_sent": len(image_info),
+            "details": details,
+            "estimated_image_tokens_unplanned": unplanned_tokens,
+            "estimated_image_tokens": sum(
+                estimate_image_tokens(i["width"], i["height"], d) for i, d in zip(image_info, details)
+            ),
+            "input_tokens": result.get("usage", {}).get("input_tokens"),
+            "latency_ms": result.get("latency_ms")
+        }
+    
+    @staticmethod
+    def _select_retry_images(data: Dict[str, Any], missing_fields: List[str], image_count: int) -> List[int]:
+        """
+        Chỉ gửi lại các ảnh mà text pass 1 (image_texts) cho thấy có thể chứa trường bị thiếu.
+        Không xác định được (thiếu image_texts hoặc không ảnh nào khớp) thì gửi tất cả.
+        """
+        image_texts = data.get("image_texts")
+        if not isinstance(image_texts, list) or len(image_texts) != image_count:
+            return list(range(image_count))
+        
+        keywords = [k for f in missing_fields for k in ImageToFormAnalyzer.FIELD_KEYWORDS.get(f, [])]
+        selected = [
+            i for i, text in enumerate(image_texts)
+            if any(k in str(text).lower() for k in keywords)
+        ]
+        return selected or list(range(image_count))
+    
+    @staticmethod
+    async def _first_pass_extraction(
+        images_base64: List[str],
+        details: List[str] = None,
+        on_event=None,
+        known_fields: Dict[str, Any] = None,
+        tier: str = "large"
+    ) -> Dict[str, Any]:
+        """PASS 1: Focused extraction with emphasis on critical fields (không hỏi các trường trong known_fields)"""
         
         system_prompt = """Bạn là chuyên gia OCR bất động sản Việt Nam, chuyên đọc chính xác mọi thông tin từ ảnh.
 
@@ -164,6 +946,7 @@ KỸ NĂNG QUAN TRỌNG:
 - Trả về JSON thuần, không markdown."""
 
         user_prompt = """BƯỚC 1: Quét và liệt kê TẤT CẢ text/icon visible trong toàn bộ ảnh (không bỏ sót bất kỳ dòng nào, kể cả tiêu đề, mô tả, hoặc nhãn nhỏ). Ví dụ output phần này: {"all_visible_text": "Danh sách tất cả text: Nhà mặt tiền... Diện tích: 95,25 m²... Nội thất: Cơ bản..."}
+Đồng thời ghi text của TỪNG ảnh theo ĐÚNG thứ tự ảnh gửi lên (mỗi ảnh một phần tử): {"image_texts": ["text ảnh 1", "text ảnh 2"]}
 
 BƯỚC 2: Từ text quét được, trích xuất CHÍNH XÁC và ĐẦY ĐỦ các trường sau. Ưu tiên TUYỆT ĐỐI các trường quan trọng (tìm kỹ ở mọi vị trí, icon, hoặc gần nhãn).
 
@@ -197,10 +980,13 @@ CÁC TRƯỜNG KHÁC (tìm tương tự, ở bất kỳ vị trí):
 + legal_status: Pháp lý/Sổ đỏ/Sổ hồng/Giấy tờ.
 + land_area_m2: Diện tích đất (nếu khác usable_area).
 + price_per_m2_vnd: Giá/m² (nếu có).
++ latitude: Vĩ độ (số thập phân) nếu ảnh hiển thị toạ độ (bản đồ, link Google Maps). Không suy từ địa chỉ.
++ longitude: Kinh độ (số thập phân), tương tự latitude.
 
 ĐỊNH DẠNG OUTPUT (JSON):
 {
   "all_visible_text": "Tóm tắt tất cả text quét được",
+  "image_texts": ["Text của ảnh 1", "Text của ảnh 2"],
   "property_info": {
     "address": "string hoặc null",
     "property_type": "house/apartment/land hoặc null",
@@ -215,6 +1001,8 @@ CÁC TRƯỜNG KHÁC (tìm tương tự, ở bất kỳ vị trí):
     "legal_status": "string hoặc null",
     "furniture_status": "string hoặc null",
     "land_area_m2": số hoặc null,
+    "latitude": số hoặc null,
+    "longitude": số hoặc null,
     "price_per_m2_vnd": số hoặc null
   },
   "condition_assessment": {
@@ -228,37 +1016,54 @@ CÁC TRƯỜNG KHÁC (tìm tương tự, ở bất kỳ vị trí):
 
 ⚠️ QUÉT KỸ TOÀN BỘ! Không bỏ sót diện tích và nội thất dù ở vị trí nào."""
 
+        known_fields = known_fields or {}
+        user_prompt = ImageToFormAnalyzer._without_known_fields(user_prompt, known_fields)
+        
         try:
             # Build content with all images
             content = [{"type": "text", "text": user_prompt}]
-            for img_b64 in images_base64:
-                content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{img_b64}",
-                        "detail": "high"
-                    }
-                })
+            content.extend(ImageToFormAnalyzer._image_content(images_base64, details))
             
-            # Call GPT-4V
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",
+            # Call vision model của tier được chọn
+            model = model_router.MODEL_TIERS[tier]
+            call_start = time.perf_counter()
+            request = dict(
+                model=model["model"],
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": content}
                 ],
-                max_tokens=3000,
+                max_tokens=model["max_tokens"],
                 temperature=0
             )
+            if on_event is None:
+                response = await _chat_completion(**request)
+                response_text = response.choices[0].message.content
+                usage = {
+                    "input_tokens": response.usage.prompt_tokens,
+                    "output_tokens": response.usage.completion_tokens
+                }
+            else:
+                # Stream response, phát từng field ngay khi parse được
+                usage = {}
+                parser = IncrementalFieldParser(
+                    f for f in ImageToFormAnalyzer.STREAM_FIELDS if f not in known_fields
+                )
+                async for delta in _stream_chat_completion(usage, **request):
+                    for field, value in parser.feed(delta):
+                        await on_event("field", {
+                            "pass": 1,
+                            "section": ImageToFormAnalyzer.STREAM_FIELDS[field],
+                            "field": field,
+                            "value": value,
+                            "elapsed_ms": round((time.perf_counter() - call_start) * 1000, 1)
+                        })
+                response_text = parser.buffer
+            latency_ms = round((time.perf_counter() - call_start) * 1000, 1)
             
             # Parse response
-            response_text = response.choices[0].message.content.strip()
-            raw_text = response.choices[0].message.content.strip()
-            print("\n" + "="*60)
-            print("RAW RESPONSE TỪ GPT (PASS 1)")
-            print("="*60)
-            print(raw_text)
-            print("="*60 + "\n")
+            response_text = response_text.strip()
+            logger.debug(f"Raw PASS 1 response: {response_text}")
             # Clean markdown
             if response_text.startswith("```json"):
                 response_text = response_text.replace("```json", "").replace("```", "").strip()
@@ -276,16 +1081,15 @@ CÁC TRƯỜNG KHÁC (tìm tương tự, ở bất kỳ vị trí):
                 else:
                     raise ValueError(f"Invalid JSON: {response_text[:300]}")
             
-            logger.info(f"✅ PASS 1 completed. Tokens: {response.usage.prompt_tokens}/{response.usage.completion_tokens}")
+            logger.info(f"✅ PASS 1 completed. Tokens: {usage.get('input_tokens')}/{usage.get('output_tokens')}")
             
             return {
                 "success": True,
                 "data": result,
                 "raw_response": response_text,
-                "usage": {
-                    "input_tokens": response.usage.prompt_tokens,
-                    "output_tokens": response.usage.completion_tokens
-                }
+                "usage": usage,
+                "latency_ms": latency_ms,
+                "model": model["model"]
             }
             
         except Exception as e:
@@ -293,7 +1097,8 @@ CÁC TRƯỜNG KHÁC (tìm tương tự, ở bất kỳ vị trí):
             return {
                 "success": False,
                 "error": str(e),
-                "error_type": type(e).__name__
+                "error_type": type(e).__name__,
+                "model": model_router.MODEL_TIERS[tier]["model"]
             }
 
     @staticmethod
@@ -323,13 +1128,15 @@ CÁC TRƯỜNG KHÁC (tìm tương tự, ở bất kỳ vị trí):
         return missing
     
     @staticmethod
-    def _targeted_retry(
+    async def _targeted_retry(
         images_base64: List[str], 
         missing_fields: List[str],
-        previous_data: Dict[str, Any]
+        previous_data: Dict[str, Any],
+        details: List[str] = None,
+        tier: str = "large"
     ) -> Dict[str, Any]:
         """PASS 2: Laser-focused retry for critical missed fields"""
-        print(f"\nPASS 2: Đang tìm lại {missing_fields} vì GPT bỏ sót!")
+        model = model_router.MODEL_TIERS[tier]["model"]
         # Enhanced field labels with more search hints
         field_labels = {
             "usable_area_m2": "Diện tích / Diện tích sử dụng / DT / bất kỳ số + m² / m2 ở mọi vị trí",
@@ -372,18 +1179,12 @@ OUTPUT (chỉ các trường tìm được):
 
         try:
             content = [{"type": "text", "text": retry_prompt}]
-            for img_b64 in images_base64:
-                content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{img_b64}",
-                        "detail": "high"
-                    }
-                })
+            content.extend(ImageToFormAnalyzer._image_content(images_base64, details))
             
-            logger.info(f"🎯 PASS 2: Laser-targeting {len(missing_fields)} fields")
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",
+            logger.info(f"🎯 PASS 2: Laser-targeting {len(missing_fields)} fields on {len(images_base64)} images")
+            call_start = time.perf_counter()
+            response = await _chat_completion(
+                model=model,
                 messages=[
                     {
                         "role": "system", 
@@ -394,6 +1195,7 @@ OUTPUT (chỉ các trường tìm được):
                 max_tokens=1000,
                 temperature=0
             )
+            latency_ms = round((time.perf_counter() - call_start) * 1000, 1)
             
             retry_text = response.choices[0].message.content.strip()
             
@@ -424,6 +1226,8 @@ OUTPUT (chỉ các trường tìm được):
                     "input_tokens": response.usage.prompt_tokens,
                     "output_tokens": response.usage.completion_tokens
                 },
+                "latency_ms": latency_ms,
+                "model": model,
                 "retry_info": {
                     "attempted_fields": missing_fields,
                     "recovered_fields": recovered_fields,
@@ -437,6 +1241,7 @@ OUTPUT (chỉ các trường tìm được):
             return {
                 "success": True,
                 "data": previous_data,
+                "model": model,
                 "warning": f"Retry failed: {str(e)}"
             }
     
@@ -456,8 +1261,28 @@ OUTPUT (chỉ các trường tìm được):
 
 
 # Export functions
-def analyze_images_to_property_form(images_base64: List[str]) -> Dict[str, Any]:
-    return ImageToFormAnalyzer.analyze_images_to_form(images_base64)
+def analysis_cache_version() -> str:
+    gating = f"gate{NEAR_DUPLICATE_MAX_DISTANCE}-{GATE_MIN_SHARPNESS:g}" if IMAGE_GATING_ENABLED else "nogate"
+    parallel = f"par{PARALLEL_MIN_IMAGES}-{PARALLEL_GROUP_SIZE}" if PARALLEL_EXTRACTION_ENABLED else "serial"
+    detail = "lowphoto" if LOW_DETAIL_PHOTOS_ENABLED else "highphoto"
+    return f"{ImageToFormAnalyzer.PROMPT_VERSION}:{model_router.routing_signature()}:{gating}:{parallel}:{detail}"
+
+
+async def analyze_images_to_property_form(
+    images_base64: List[str],
+    image_info: List[Dict[str, Any]] = None,
+    on_event=None,
+    known_fields: Dict[str, Any] = None,
+    degraded: bool = False
+) -> Dict[str, Any]:
+    """
+    Analyze images (the content-hash cache is handled by image_pipeline). `image_info` (describe_image
+    per image) lets the planner skip re-decoding; `known_fields` (từ EXIF) are not asked of the LLM.
+    `degraded` (hết budget LLM) runs the cheap path.
+    """
+    return await ImageToFormAnalyzer.analyze_images_to_form(
+        images_base64, image_info, on_event, known_fields, degraded
+    )
 
 def get_property_info_from_analysis(ai_result: Dict[str, Any]) -> Dict[str, Any]:
     return ImageToFormAnalyzer.extract_property_info(ai_result)
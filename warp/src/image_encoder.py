@@ -0,0 +1,114 @@
+# image_encoder.py - Byte-budget encoder: mỗi đích (LLM input, preview, thumbnail, original) có kích thước + budget riêng
+import math
+import os
+import time
+from io import BytesIO
+from typing import Dict, Any, Tuple
+
+from PIL import Image
+
+# max_side: cạnh dài tối đa (None = giữ nguyên, ảnh đã được resize trước đó); max_bytes: budget của output;
+# quality_step (mặc định 1): bước giữa các mức quality được thử
+ENCODE_PROFILES: Dict[str, Dict[str, Any]] = {
+    # Ảnh gửi vision model (đã resize về độ phân giải model dùng); chất lượng tối thiểu cao để giữ chữ nhỏ đọc được
+    "llm": {"format": "JPEG", "max_side": None, "min_quality": 70, "max_quality": 90, "progressive": False,
+            "max_bytes": int(os.getenv("LLM_IMAGE_MAX_BYTES", str(250 * 1024)))},
+    "preview": {"format": "JPEG", "max_side": 1024, "min_quality": 55, "max_quality": 85, "progressive": True,
+                "max_bytes": 120 * 1024},
+    # Encode WebP chậm hơn JPEG nhiều lần -> tìm quality theo bước 5
+    "preview_webp": {"format": "WEBP", "max_side": 1024, "min_quality": 50, "max_quality": 85, "progressive": False,
+                     "quality_step": 5, "max_bytes": 80 * 1024},
+    "thumbnail": {"format": "JPEG", "max_side": 256, "min_quality": 50, "max_quality": 85, "progressive": False,
+                  "max_bytes": 16 * 1024},
+    # Bản gốc quá lớn (compress_image_if_needed); bản gốc bình thường được lưu nguyên bytes
+    "original": {"format": "JPEG", "max_side": 4096, "min_quality": 70, "max_quality": 92, "progressive": True,
+                 "max_bytes": 4 * 1024 * 1024},
+}
+
+# Ảnh thử (thu nhỏ) cho binary search quality: ~256k pixel
+TRIAL_MAX_PIXELS = 256 * 1024
+
+
+def _encode(img: Image.Image, profile: Dict[str, Any], quality: int) -> bytes:
+    buffered = BytesIO()
+    if profile["format"] == "WEBP":
+        img.save(buffered, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(buffered, format="JPEG", quality=quality, optimize=True, progressive=profile["progressive"])
+    return buffered.getvalue()
+
+
+def _search_quality(trial: Image.Image, profile: Dict[str, Any], trial_budget: float) -> Tuple[int, int]:
+    """Binary search quality cao nhất mà ảnh thử nằm trong trial_budget. Trả về (quality, số lần encode)."""
+    step = profile.get("quality_step", 1)
+    levels = list(range(profile["min_quality"], profile["max_quality"] + 1, step))
+    # Ảnh ít chi tiết thường vừa budget ngay ở max_quality -> một lần encode
+    if len(_encode(trial, profile, levels[-1])) <= trial_budget:
+        return levels[-1], 1
+    best, encodes = levels[0], 1
+    low, high = 0, len(levels) - 2
+    while low <= high:
+        middle = (low + high) // 2
+        encodes += 1
+        if len(_encode(trial, profile, levels[middle])) <= trial_budget:
+            best, low = levels[middle], middle + 1
+        else:
+            high = middle - 1
+    return best, encodes
+
+
+def encode_to_budget(img: Image.Image, destination: str) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Encode `img` cho một đích trong ENCODE_PROFILES: thu về max_side, rồi chọn quality cao nhất vừa budget.
+    Quality được binary search trên ảnh thử thu nhỏ (budget quy đổi theo số pixel), hiệu chỉnh bằng một lần
+    encode đầy đủ; vẫn vượt budget ở min_quality thì thu nhỏ ảnh theo tỉ lệ. Trả về (bytes, stats).
+    """
+    profile = ENCODE_PROFILES[destination]
+    start = time.perf_counter()
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    if profile["max_side"] and max(img.size) > profile["max_side"]:
+        img = img.copy()
+        img.thumbnail((profile["max_side"], profile["max_side"]), Image.Resampling.LANCZOS)
+
+    pixels = img.width * img.height
+    factor = max(1, math.ceil(math.sqrt(pixels / TRIAL_MAX_PIXELS)))
+    trial = img.reduce(factor) if factor > 1 else img
+    pixel_ratio = trial.width * trial.height / pixels
+
+    quality, trial_encodes = _search_quality(trial, profile, profile["max_bytes"] * pixel_ratio)
+    content = _encode(img, profile, quality)
+    full_encodes = 1
+    over = len(content) > profile["max_bytes"] and quality > profile["min_quality"]
+    under = len(content) < 0.8 * profile["max_bytes"] and quality < profile["max_quality"]
+    if factor > 1 and (over or under):
+        # Ảnh thử thu nhỏ có mật độ chi tiết khác ảnh thật -> hiệu chỉnh budget theo tỉ lệ thực đo rồi tìm lại
+        trial_bytes = len(_encode(trial, profile, quality))
+        calibrated = profile["max_bytes"] * trial_bytes / len(content)
+        calibrated_quality, extra = _search_quality(trial, profile, calibrated)
+        trial_encodes += extra + 1
+        if calibrated_quality != quality:
+            candidate = _encode(img, profile, calibrated_quality)
+            full_encodes += 1
+            # Tăng quality chỉ khi vẫn vừa budget
+            if over or len(candidate) <= profile["max_bytes"]:
+                content, quality = candidate, calibrated_quality
+    if len(content) > profile["max_bytes"]:
+        scale = math.sqrt(profile["max_bytes"] / len(content)) * 0.95
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.Resampling.LANCZOS)
+        content = _encode(img, profile, quality)
+        full_encodes += 1
+
+    return content, {
+        "destination": destination,
+        "format": profile["format"],
+        "quality": quality,
+        "bytes": len(content),
+        "max_bytes": profile["max_bytes"],
+        "within_budget": len(content) <= profile["max_bytes"],
+        "width": img.width,
+        "height": img.height,
+        "trial_encodes": trial_encodes,
+        "full_encodes": full_encodes,
+        "encode_ms": round((time.perf_counter() - start) * 1000, 1)
+    }
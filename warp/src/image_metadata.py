@@ -0,0 +1,82 @@
+# image_metadata.py - EXIF fast path: GPS, orientation, thời điểm chụp (chỉ đọc segment metadata, không decode pixel)
+import logging
+from datetime import datetime
+from io import BytesIO
+from typing import List, Dict, Any, Optional
+
+from PIL import Image, ExifTags
+
+logger = logging.getLogger(__name__)
+
+_EXIF_DATETIME_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+
+def _to_degrees(value) -> Optional[float]:
+    """EXIF GPS (độ, phút, giây) dạng rational -> độ thập phân"""
+    try:
+        degrees, minutes, seconds = (float(v) for v in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return degrees + minutes / 60 + seconds / 3600
+
+
+def _read_gps(exif: Image.Exif) -> Dict[str, float]:
+    gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    latitude = _to_degrees(gps.get(ExifTags.GPS.GPSLatitude))
+    longitude = _to_degrees(gps.get(ExifTags.GPS.GPSLongitude))
+    if latitude is None or longitude is None:
+        return {}
+    if str(gps.get(ExifTags.GPS.GPSLatitudeRef, "N")).upper().startswith("S"):
+        latitude = -latitude
+    if str(gps.get(ExifTags.GPS.GPSLongitudeRef, "E")).upper().startswith("W"):
+        longitude = -longitude
+    # (0, 0) thường là máy chưa bắt được GPS
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or (latitude == 0 and longitude == 0):
+        return {}
+    return {"latitude": round(latitude, 6), "longitude": round(longitude, 6)}
+
+
+def _read_taken_at(exif: Image.Exif) -> Optional[str]:
+    details = exif.get_ifd(ExifTags.IFD.Exif)
+    raw = details.get(ExifTags.Base.DateTimeOriginal) or exif.get(ExifTags.Base.DateTime)
+    try:
+        taken_at = datetime.strptime(str(raw).strip("\x00 "), _EXIF_DATETIME_FORMAT)
+    except ValueError:
+        return None
+    offset = details.get(ExifTags.Base.OffsetTimeOriginal)
+    return taken_at.isoformat() + (str(offset).strip("\x00 ") if offset else "")
+
+
+def read_image_metadata(source) -> Dict[str, Any]:
+    """
+    GPS lat/lon, orientation và thời điểm chụp từ EXIF. Image.open chỉ đọc header (APP1 với JPEG),
+    không decode pixel. Ảnh không có / lỗi EXIF trả về {"orientation": 1}.
+    """
+    try:
+        img = Image.open(BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+        exif = img.getexif()
+    except Exception as e:
+        logger.debug(f"EXIF read failed: {e}")
+        return {"orientation": 1}
+
+    metadata: Dict[str, Any] = {"orientation": int(exif.get(ExifTags.Base.Orientation, 1) or 1)}
+    try:
+        metadata.update(_read_gps(exif))
+        taken_at = _read_taken_at(exif)
+    except Exception as e:
+        logger.debug(f"EXIF parse failed: {e}")
+        taken_at = None
+    if taken_at:
+        metadata["taken_at"] = taken_at
+    return metadata
+
+
+def known_fields_from_metadata(metadata: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Trường property_info đã biết từ EXIF (LLM không cần hỏi lại): toạ độ của ảnh đầu tiên có GPS.
+    Các ảnh trong một tin đăng chụp cùng một nơi nên không cần gộp nhiều toạ độ.
+    """
+    for item in metadata:
+        if "latitude" in item:
+            return {"latitude": item["latitude"], "longitude": item["longitude"]}
+    return {}
@@ -0,0 +1,509 @@
+# image_pipeline.py - Concurrent per-file upload & analysis pipeline
+import asyncio
+import base64
+import logging
+import os
+import time
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Any, Tuple
+
+from fastapi import UploadFile
+from PIL import Image
+
+import analysis_cache
+import llm_ledger
+from image_analysis_service import (
+    analyze_images_to_property_form,
+    analysis_cache_version,
+    apply_exif_orientation,
+    assess_image,
+    gate_images,
+    IMAGE_GATING_ENABLED,
+    decode_image_for_ocr,
+    describe_image,
+    transform_for_ocr
+)
+from image_encoder import ENCODE_PROFILES, encode_to_budget
+from image_metadata import read_image_metadata, known_fields_from_metadata
+from image_workers import image_pool
+from blob_store import BLOB_DEDUP_ENABLED, find_blobs, register_blob, set_renditions, grant_blobs
+from storage import upload_to_s3, open_s3_object, s3_object_url, build_asset_key, content_key, rendition_key
+from upload_ingest import (
+    SpooledUpload, RequestBudget, UploadTooLargeError, MAX_UPLOAD_FILES, ingest_uploads, ingest_stream
+)
+
+logger = logging.getLogger(__name__)
+
+# Bounded pool cho các tác vụ ảnh nhẹ (đọc header EXIF, gating trên thumbnail); biến đổi ảnh nặng CPU
+# (decode đầy đủ, renditions, preprocessing OCR) chạy trong image_workers.image_pool
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-worker")
+
+# Renditions cho giao diện (danh sách report: thumbnail, trang chi tiết: preview), tạo một lần lúc ingest
+RENDITION_KINDS = ("thumbnail", "preview", "preview_webp")
+RENDITION_WEBP_ENABLED = os.getenv("RENDITION_WEBP_ENABLED", "true").lower() == "true"
+# (kind, cạnh dài tối đa, format): kích thước + byte budget lấy từ ENCODE_PROFILES cùng tên
+RENDITIONS = tuple(
+    (kind, ENCODE_PROFILES[kind]["max_side"], ENCODE_PROFILES[kind]["format"])
+    for kind in RENDITION_KINDS if kind != "preview_webp" or RENDITION_WEBP_ENABLED
+)
+RENDITION_MAX_SIDE = max(size for _, size, _ in RENDITIONS)
+_RENDITION_TYPES = {"JPEG": ("jpg", "image/jpeg"), "WEBP": ("webp", "image/webp")}
+# Rendition không bao giờ đổi nội dung dưới cùng key
+RENDITION_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class StageTimings:
+    """Collect wall-clock duration (ms) of each pipeline stage"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(self.stages)
+
+
+async def run_in_image_pool(func, *args):
+    """Run a light image function in the bounded image thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(image_executor, func, *args)
+
+
+def _open_source(source):
+    if isinstance(source, SpooledUpload):
+        return source.open()
+    if isinstance(source, str):
+        return open(source, "rb")  # File spool trên đĩa, mở trong process con
+    return source
+
+
+async def _transform_source(p: Dict[str, Any]):
+    """
+    Nguồn ảnh gửi image_pool. Process con không nhận được reader của SpooledUpload: upload đã spool ra đĩa
+    được gửi bằng đường dẫn file (process con tự đọc, parent không giữ cả file trong RAM); upload nhỏ
+    (dưới UPLOAD_SPOOL_THRESHOLD_BYTES, đang nằm trong RAM) gửi bytes.
+    """
+    source = p["source"]
+    if image_pool.mode != "process" or not isinstance(source, SpooledUpload):
+        return source
+    if source.on_disk:
+        return source.path
+    return await asyncio.to_thread(source.read_bytes)
+
+
+def make_renditions(img: Image.Image) -> Dict[str, Dict[str, Any]]:
+    """
+    Encode RENDITIONS from an already decoded (EXIF-oriented) buffer. Mỗi cỡ chỉ resize một lần,
+    cỡ nhỏ hơn resize tiếp từ cỡ lớn hơn; không phóng to ảnh nhỏ. Quality chọn theo byte budget của từng kind.
+    """
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    scaled = {}
+    current = img
+    for size in sorted({size for _, size, _ in RENDITIONS}, reverse=True):
+        current = current.copy()
+        current.thumbnail((size, size), Image.Resampling.LANCZOS)
+        scaled[size] = current
+
+    renditions = {}
+    for kind, size, image_format in RENDITIONS:
+        content, stats = encode_to_budget(scaled[size], kind)
+        extension, content_type = _RENDITION_TYPES[image_format]
+        renditions[kind] = {
+            "content": content, "extension": extension, "content_type": content_type,
+            "width": stats["width"], "height": stats["height"], "quality": stats["quality"],
+            "encode_ms": stats["encode_ms"]
+        }
+    return renditions
+
+
+def render_renditions(source) -> Dict[str, Dict[str, Any]]:
+    """Renditions cho ảnh không đi qua prepare_image_for_analysis (bị gating / cache hit): decode riêng bằng draft()"""
+    source = _open_source(source)
+    img = Image.open(BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    if img.format == "JPEG":
+        img.draft("RGB", (RENDITION_MAX_SIDE, RENDITION_MAX_SIDE))
+    img.load()
+    return make_renditions(apply_exif_orientation(img))
+
+
+def prepare_image_for_analysis(source, with_renditions: bool = True
+                               ) -> Tuple[str, Dict[str, Any], Dict[str, Any], Dict[str, float]]:
+    """
+    Single-decode LLM input (runs inside image_pool, possibly in a worker process): decode once -> transform
+    the pixel buffer -> encode once -> base64. Returns stage timings, thread CPU time and decoded size as a dict.
+    Also returns describe_image() of the LLM buffer (size, pre-upscale size, document) for the analyzer's
+    image planning, and the display renditions encoded from the same decoded buffer (before OCR preprocessing;
+    None when `with_renditions` is False, i.e. the stored blob already has them).
+    `source` is bytes, a SpooledUpload (read through its own reader) or the path of a spooled upload
+    (worker process); JPEGs are decoded via draft().
+    """
+    timings = StageTimings()
+    cpu_start = time.thread_time()
+    with timings.measure("decode"):
+        img = decode_image_for_ocr(_open_source(source))
+    source_size = img.size
+    timings.stages["decoded_mb"] = round(img.width * img.height * len(img.getbands()) / (1024 * 1024), 2)
+    renditions = None
+    if with_renditions:
+        with timings.measure("renditions"):
+            renditions = make_renditions(img)
+    with timings.measure("preprocess"):
+        img = transform_for_ocr(img)
+    with timings.measure("encode"):
+        llm_bytes, encode_stats = encode_to_budget(img, "llm")
+    info = describe_image(img, source_size)
+    timings.stages["cpu_ms"] = round((time.thread_time() - cpu_start) * 1000, 1)
+    timings.stages["llm_input_kb"] = round(len(llm_bytes) / 1024, 1)
+    timings.stages["llm_quality"] = encode_stats["quality"]
+    return base64.b64encode(llm_bytes).decode(), info, renditions, timings.as_dict()
+
+
+async def _prepare_in_pool(p: Dict[str, Any]) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+    (image_base64, info, renditions, stages), wait_ms = await image_pool.run(
+        prepare_image_for_analysis, await _transform_source(p), not _has_renditions(p)
+    )
+    p["timings"].stages.update(stages, pool_wait=wait_ms)
+    return image_base64, info, renditions
+
+
+async def _upload_original(source, user_id: int, filename: str, key: str, sha256: str, size: int, seen: int,
+                           timings: StageTimings, emit=None) -> dict:
+    with timings.measure("s3_upload"):
+        result = await asyncio.to_thread(upload_to_s3, _open_source(source), user_id, filename, key)
+    if result["success"] and BLOB_DEDUP_ENABLED:
+        await asyncio.to_thread(register_blob, sha256, result["key"], result["url"], size, seen=seen)
+    if emit is not None and result["success"]:
+        await emit("image_uploaded", {"filename": filename, "url": result["url"], "key": result["key"]})
+    return result
+
+
+async def _reuse_blob(filename: str, blob: Dict[str, Any], emit=None) -> dict:
+    if emit is not None:
+        await emit("image_uploaded", {"filename": filename, "url": blob["url"], "key": blob["key"], "deduplicated": True})
+    return {"success": True, "url": blob["url"], "key": blob["key"], "deduplicated": True}
+
+
+async def _already_stored(result: dict) -> dict:
+    return result
+
+
+async def _start_images(items: List[Tuple[str, Any, str, int]], user_id: int, emit=None,
+                        stored: List[dict] = None) -> List[Dict[str, Any]]:
+    """
+    Start storing the ORIGINAL bytes (không decode / re-encode) of each (filename, source, sha256, size) in S3.
+    Content-addressed (blobs/{sha}): nội dung đã có trong index local không upload lại, ảnh trùng nhau trong
+    cùng request dùng chung một lần upload. `stored` (url/key per image) is given when the objects are
+    already in S3 (presigned upload) - nothing to upload.
+    """
+    hashes = [sha256 for _, _, sha256, _ in items]
+    blobs = {}
+    if stored is None and BLOB_DEDUP_ENABLED:
+        blobs = await asyncio.to_thread(find_blobs, hashes)
+
+    prepared, started = [], {}
+    for index, (filename, source, sha256, size) in enumerate(items):
+        timings = StageTimings()
+        blob = blobs.get(sha256)
+        if stored is not None:
+            key = stored[index]["key"]
+            upload_task = asyncio.create_task(_already_stored({"success": True, **stored[index]}))
+        elif blob is not None:
+            key = blob["key"]
+            upload_task = asyncio.create_task(_reuse_blob(filename, blob, emit))
+        elif sha256 in started:
+            key, upload_task = started[sha256]
+        else:
+            # S3 upload chạy song song với preprocessing và bước phân tích
+            key = content_key(sha256) if BLOB_DEDUP_ENABLED else build_asset_key(user_id, filename)
+            upload_task = asyncio.create_task(_upload_original(
+                source, user_id, filename, key, sha256, size, hashes.count(sha256), timings, emit
+            ))
+            started[sha256] = (key, upload_task)
+        prepared.append({
+            "filename": filename, "source": source, "sha256": sha256, "bytes": size, "user_id": user_id,
+            "key": key, "upload_task": upload_task, "timings": timings,
+            "blob_renditions": blob["renditions"] if blob is not None else {}
+        })
+    if stored is None:
+        # Blob dùng chung giữa các user: ghi nhận key đã cấp cho user này (create_report chỉ nhận các key này)
+        await asyncio.to_thread(grant_blobs, user_id, [p["key"] for p in prepared])
+    return prepared
+
+
+async def _emit_received(prepared: List[Dict[str, Any]], emit=None):
+    if emit is not None:
+        await emit("images_received", {
+            "count": len(prepared),
+            "images": [{"filename": p["filename"], "sha256": p["sha256"], "bytes": p["bytes"]} for p in prepared]
+        })
+
+
+async def read_uploads(files: List[UploadFile], user_id: int, emit=None) -> Dict[str, Any]:
+    """
+    Ingest uploads in chunks (size caps, hash while streaming, spool to disk above a threshold) and
+    start their S3 uploads. Returns the pipeline state for process_uploads; the streaming endpoint
+    calls this before the request body is released. Raises UploadTooLargeError.
+    """
+    request_timings = StageTimings()
+    start = time.perf_counter()
+    with request_timings.measure("read_images"):
+        uploads = await ingest_uploads(files)
+    prepared = await _start_images([(u.filename, u, u.sha256, u.size) for u in uploads], user_id, emit)
+    request_timings.stages["upload_mb"] = round(sum(u.size for u in uploads) / (1024 * 1024), 2)
+    request_timings.stages["spooled_to_disk"] = sum(1 for u in uploads if u.on_disk)
+    await _emit_received(prepared, emit)
+    return {"prepared": prepared, "timings": request_timings, "start": start, "user_id": user_id}
+
+
+async def start_stored_images(images: List[Tuple[str, bytes]], user_id: int, emit=None) -> Dict[str, Any]:
+    """Same as read_uploads for images already in memory as (filename, bytes) — used by background jobs"""
+    request_timings = StageTimings()
+    start = time.perf_counter()
+    prepared = await _start_images([
+        (filename, content, analysis_cache.hash_image_bytes(content), len(content)) for filename, content in images
+    ], user_id, emit)
+    await _emit_received(prepared, emit)
+    return {"prepared": prepared, "timings": request_timings, "start": start, "user_id": user_id}
+
+
+def _fetch_object(key: str, budget: RequestBudget) -> SpooledUpload:
+    body, size, content_type = open_s3_object(key)
+    try:
+        return ingest_stream(body, key.rsplit("/", 1)[-1], content_type, budget, size)
+    finally:
+        body.close()
+
+
+async def fetch_stored_objects(keys: List[str], user_id: int, emit=None) -> Dict[str, Any]:
+    """
+    Pipeline state for images uploaded straight to S3 (presigned): stream each object into a spool
+    (size caps + hash while reading, JPEG decoded later via draft()), no re-upload.
+    Raises UploadTooLargeError / FileNotFoundError.
+    """
+    if len(keys) > MAX_UPLOAD_FILES:
+        raise UploadTooLargeError(f"Too many files ({len(keys)} > {MAX_UPLOAD_FILES})")
+    request_timings = StageTimings()
+    start = time.perf_counter()
+    budget = RequestBudget()
+    with request_timings.measure("fetch_objects"):
+        fetched = await asyncio.gather(*(asyncio.to_thread(_fetch_object, k, budget) for k in keys),
+                                       return_exceptions=True)
+    errors = [f for f in fetched if isinstance(f, BaseException)]
+    if errors:
+        for f in fetched:
+            if isinstance(f, SpooledUpload):
+                f.close()
+        raise errors[0]
+
+    prepared = await _start_images(
+        [(u.filename, u, u.sha256, u.size) for u in fetched], user_id, emit,
+        stored=[{"url": s3_object_url(key), "key": key} for key in keys]
+    )
+    request_timings.stages["upload_mb"] = round(sum(u.size for u in fetched) / (1024 * 1024), 2)
+    await _emit_received(prepared, emit)
+    return {"prepared": prepared, "timings": request_timings, "start": start, "user_id": user_id}
+
+
+async def gate_prepared(prepared: List[Dict[str, Any]], emit=None) -> Tuple[List[int], List[Dict[str, Any]]]:
+    """
+    Quality gating trước preprocessing: dHash + độ nét trên thumbnail (draft decode) của từng ảnh,
+    bỏ ảnh gần trùng (giữ ảnh nét nhất nhóm) và ảnh mờ. Trả về (chỉ số ảnh giữ lại, ảnh bị bỏ theo filename).
+    """
+    if not IMAGE_GATING_ENABLED or len(prepared) < 2:
+        return list(range(len(prepared))), []
+    assessments = await asyncio.gather(*(
+        run_in_image_pool(assess_image, _open_source(p["source"])) for p in prepared
+    ))
+    for p, assessment in zip(prepared, assessments):
+        assessment["sha256"] = p["sha256"]
+    kept, skipped = gate_images(assessments)
+
+    skipped_images = []
+    for s in skipped:
+        entry = {"filename": prepared[s["index"]]["filename"], **{k: v for k, v in s.items() if k != "index"}}
+        if "duplicate_of" in s:
+            entry["duplicate_of"] = prepared[s["duplicate_of"]]["filename"]
+        skipped_images.append(entry)
+    if skipped_images:
+        logger.info(f"Gating: {len(prepared)} -> {len(kept)} images ({len(skipped_images)} skipped)")
+        if emit is not None:
+            await emit("images_skipped", {"count": len(skipped_images), "images": skipped_images})
+    return kept, skipped_images
+
+
+async def _store_renditions(p: Dict[str, Any], renditions: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Upload renditions of one image concurrently, next to the original under renditions/"""
+    async def store(kind: str, rendition: Dict[str, Any]):
+        key = rendition_key(p["key"], kind, rendition["extension"])
+        result = await asyncio.to_thread(
+            upload_to_s3, rendition["content"], p["user_id"], key, key,
+            rendition["content_type"], RENDITION_CACHE_CONTROL
+        )
+        return kind, rendition, result
+
+    stored = {}
+    for kind, rendition, result in await asyncio.gather(*(store(k, r) for k, r in renditions.items())):
+        if result["success"]:
+            stored[kind] = {"url": result["url"], "key": result["key"], "width": rendition["width"],
+                            "height": rendition["height"], "bytes": len(rendition["content"]),
+                            "quality": rendition["quality"], "encode_ms": rendition["encode_ms"]}
+    if BLOB_DEDUP_ENABLED and (await p["upload_task"])["success"]:
+        # Blob được ghi vào index sau khi upload bản gốc xong -> lần upload trùng sau dùng lại renditions
+        await asyncio.to_thread(set_renditions, p["sha256"], p["key"], stored)
+    return stored
+
+
+def _has_renditions(p: Dict[str, Any]) -> bool:
+    return all(kind in p["blob_renditions"] for kind, _, _ in RENDITIONS)
+
+
+def _start_renditions(p: Dict[str, Any], renditions: Dict[str, Dict[str, Any]] = None) -> asyncio.Task:
+    """Renditions đã lưu cùng blob thì dùng lại; nếu không thì upload bản vừa encode / decode riêng để tạo"""
+    if _has_renditions(p):
+        return asyncio.create_task(_already_stored({kind: p["blob_renditions"][kind] for kind, _, _ in RENDITIONS}))
+    if renditions is not None:
+        return asyncio.create_task(_store_renditions(p, renditions))
+    return asyncio.create_task(_render_and_store(p))
+
+
+async def _render_and_store(p: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    try:
+        with p["timings"].measure("renditions"):
+            renditions, _ = await image_pool.run(render_renditions, await _transform_source(p))
+    except Exception as e:
+        logger.warning(f"Renditions failed for {p['filename']}: {e}")
+        return {}
+    return await _store_renditions(p, renditions)
+
+
+def cancel_uploads(state: Dict[str, Any]):
+    for p in state["prepared"]:
+        p["upload_task"].cancel()
+    for task in state.get("rendition_tasks", {}).values():
+        task.cancel()
+    release_sources(state)
+
+
+def release_sources(state: Dict[str, Any]):
+    """Close spooled uploads (xoá file tạm trên đĩa)"""
+    for p in state["prepared"]:
+        if isinstance(p["source"], SpooledUpload):
+            p["source"].close()
+
+
+async def process_uploads(state: Dict[str, Any], emit=None) -> Dict[str, Any]:
+    """
+    Read EXIF (GPS / orientation / capture time, header only) and gate out near-duplicate / blurry photos,
+    then serve the LLM analysis from cache when the same image set was analyzed before; otherwise
+    decode/preprocess the kept photos in the image pool and run the LLM analysis while S3 uploads finish
+    (skipped photos are still stored in S3). Fields known from EXIF are not asked of the LLM.
+    `emit(event, data)` (async, optional) receives progress events as each stage finishes.
+    LLM calls are logged to the ledger under the state's user; `state["degraded"]` (user over the daily
+    LLM budget) runs the cheap analysis path and leaves the cache untouched.
+    """
+    with llm_ledger.analysis_context(state.get("user_id"), state.get("degraded", False)):
+        return await _process_uploads(state, emit)
+
+
+async def _process_uploads(state: Dict[str, Any], emit=None) -> Dict[str, Any]:
+    prepared, request_timings = state["prepared"], state["timings"]
+    degraded = state.get("degraded", False)
+    # Renditions (thumbnail / preview) của mọi ảnh được upload trong lúc phân tích chạy
+    rendition_tasks = state.setdefault("rendition_tasks", {})
+    try:
+        image_hashes = [p["sha256"] for p in prepared]
+
+        # Metadata và danh sách ảnh bị loại luôn tính cho request hiện tại (tên file / thứ tự của chính nó),
+        # cache chỉ giữ kết quả LLM
+        with request_timings.measure("metadata"):
+            metadata = await asyncio.gather(*(
+                run_in_image_pool(read_image_metadata, _open_source(p["source"])) for p in prepared
+            ))
+        known_fields = known_fields_from_metadata(metadata)
+        with request_timings.measure("gating"):
+            kept, skipped_images = await gate_prepared(prepared, emit)
+
+        with request_timings.measure("cache_lookup"):
+            analysis_result = await asyncio.to_thread(
+                analysis_cache.get, image_hashes, analysis_cache_version()
+            )
+
+        if analysis_result is None:
+            for i in set(range(len(prepared))) - set(kept):
+                rendition_tasks[i] = _start_renditions(prepared[i])
+            with request_timings.measure("prepare_images"):
+                prepared_images = await asyncio.gather(*(_prepare_in_pool(prepared[i]) for i in kept))
+            for i, (_, _, renditions) in zip(kept, prepared_images):
+                rendition_tasks[i] = _start_renditions(prepared[i], renditions)
+            images_base64 = [b64 for b64, _, _ in prepared_images]
+            image_info = [info for _, info, _ in prepared_images]
+
+            logger.info(f"Analyzing {len(images_base64)} preprocessed images")
+            with request_timings.measure("analysis"):
+                analysis_result = await analyze_images_to_property_form(
+                    images_base64, image_info=image_info, on_event=emit, known_fields=known_fields,
+                    degraded=degraded
+                )
+            if not degraded:
+                await asyncio.to_thread(
+                    analysis_cache.put, image_hashes, analysis_cache_version(),
+                    analysis_result, request_timings.stages["analysis"] / 1000
+                )
+        else:
+            llm_ledger.record_cache_hit(len(prepared))
+            for i, p in enumerate(prepared):
+                rendition_tasks[i] = _start_renditions(p)
+
+        with request_timings.measure("await_uploads"):
+            s3_results = await asyncio.gather(*(p["upload_task"] for p in prepared))
+            rendition_results = await asyncio.gather(*(rendition_tasks[i] for i in range(len(prepared))))
+    except BaseException:
+        cancel_uploads(state)
+        raise
+    release_sources(state)
+    request_timings.stages["deduplicated"] = sum(1 for r in s3_results if r.get("deduplicated"))
+    for p, renditions in zip(prepared, rendition_results):
+        # Payload từng rendition (kể cả rendition dùng lại từ blob đã lưu)
+        p["timings"].stages.update({
+            f"{kind}_kb": round(rendition["bytes"] / 1024, 1) for kind, rendition in renditions.items() if "bytes" in rendition
+        })
+    request_timings.stages["total"] = round((time.perf_counter() - state["start"]) * 1000, 1)
+
+    # Rendition phẳng dạng {kind}_url / {kind}_key để client gửi lại nguyên vẹn khi tạo report
+    uploaded_urls = [
+        {
+            "filename": p["filename"], "url": r["url"], "key": r["key"],
+            **{f"{kind}_{field}": rendition[field] for kind, rendition in renditions.items() for field in ("url", "key")}
+        }
+        for p, r, renditions in zip(prepared, s3_results, rendition_results) if r["success"]
+    ]
+    return {
+        "analysis": analysis_result,
+        "images": uploaded_urls,
+        "cached": bool(analysis_result.get("cached")),
+        "degraded": degraded,
+        "skipped": skipped_images,
+        "metadata": [{"filename": p["filename"], **m} for p, m in zip(prepared, metadata)],
+        "timings": {
+            **request_timings.as_dict(),
+            "images": [{"filename": p["filename"], **p["timings"].as_dict()} for p in prepared]
+        }
+    }
+
+
+async def run_upload_pipeline(files: List[UploadFile], user_id: int, emit=None, degraded: bool = False) -> Dict[str, Any]:
+    """Read, analyze and upload a batch of images. Returns analysis result, uploaded image infos and per-stage timings."""
+    state = await read_uploads(files, user_id, emit)
+    state["degraded"] = degraded
+    return await process_uploads(state, emit)
@@ -0,0 +1,216 @@
+# image_workers.py - Pool riêng cho các biến đổi ảnh nặng CPU (decode, resize / enhance PIL, denoise OpenCV, encode)
+#
+# Mặc định là process pool: biến đổi ảnh không còn tranh GIL với event loop, nên upload lớn không làm chậm
+# các endpoint khác (login, reports). Trên môi trường không hỗ trợ multiprocessing (AWS Lambda) đặt
+# IMAGE_POOL_MODE=thread. Back-pressure theo request: mỗi request giữ trước số ảnh của nó
+# (tối đa IMAGE_QUEUE_MAX_IMAGES ảnh đang chờ / đang xử lý, mặc định 8 ảnh / worker); hết chỗ thì
+# ImagePoolBusyError -> HTTP 503 + Retry-After.
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any
+
+from percentiles import percentile_stats
+
+logger = logging.getLogger(__name__)
+
+IMAGE_POOL_MODE = os.getenv("IMAGE_POOL_MODE", "process")
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Tổng số ảnh của các request đang được xử lý; request làm vượt ngưỡng bị từ chối (trừ khi pool đang trống).
+# Mặc định theo số worker: mỗi ảnh ~0.5-0.7 s CPU (decode + renditions + preprocess), 8 ảnh / worker giữ thời gian
+# chờ hàng đợi dưới ~5 s (ngưỡng cố định lớn trên máy ít CPU: request cuối phải chờ rất lâu thay vì nhận 503).
+IMAGE_QUEUE_IMAGES_PER_WORKER = int(os.getenv("IMAGE_QUEUE_IMAGES_PER_WORKER", "8"))
+IMAGE_QUEUE_MAX_IMAGES = int(os.getenv("IMAGE_QUEUE_MAX_IMAGES", str(IMAGE_QUEUE_IMAGES_PER_WORKER * IMAGE_PROCESS_WORKERS)))
+# spawn: process con không kế thừa thread / lock của server (uvicorn, ledger writer, boto3)
+IMAGE_POOL_START_METHOD = os.getenv("IMAGE_POOL_START_METHOD", "spawn")
+IMAGE_POOL_MAX_RETRY_AFTER_SECONDS = int(os.getenv("IMAGE_POOL_MAX_RETRY_AFTER_SECONDS", "60"))
+
+_SAMPLES = 500
+
+
+class ImagePoolBusyError(Exception):
+    """Hàng đợi xử lý ảnh đã đầy; thử lại sau `retry_after` giây"""
+
+    def __init__(self, images: int, admitted: int, retry_after: int):
+        super().__init__(f"Image processing queue is full ({admitted} images queued), retry in {retry_after}s")
+        self.images = images
+        self.admitted = admitted
+        self.retry_after = retry_after
+
+
+def _timed_call(func, *args):
+    """Chạy trong worker: trả về (thời điểm bắt đầu, kết quả) để tính thời gian chờ trong hàng đợi"""
+    return time.time(), func(*args)
+
+
+def _warm_up() -> int:
+    # Import sẵn các module xử lý ảnh (cv2, PIL, image_pipeline) trong process con
+    import image_pipeline  # noqa: F401
+    return os.getpid()
+
+
+class ImageTicket:
+    """Chỗ giữ trước cho các ảnh của một request; release() khi request xử lý xong"""
+
+    def __init__(self, pool: "ImageWorkerPool", images: int):
+        self.pool = pool
+        self.images = images
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.pool._release(self.images)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ImageWorkerPool:
+    def __init__(self, mode: str = IMAGE_POOL_MODE, workers: int = IMAGE_PROCESS_WORKERS,
+                 max_images: int = IMAGE_QUEUE_MAX_IMAGES):
+        self.mode = mode
+        self.workers = workers
+        self.max_images = max_images
+        self._executor = None
+        self._lock = threading.Lock()
+        self.admitted_images = 0
+        self.in_flight = 0
+        self.stats = {"tasks": 0, "failures": 0, "pool_restarts": 0, "admitted_requests": 0, "rejected_requests": 0,
+                      "max_in_flight": 0, "max_admitted_images": 0}
+        self._wait_ms = deque(maxlen=_SAMPLES)
+        self._run_ms = deque(maxlen=_SAMPLES)
+
+    # ---------- executor ----------
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.mode == "process":
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context(IMAGE_POOL_START_METHOD)
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-transform")
+            return self._executor
+
+    async def start(self) -> None:
+        """Khởi động trước các worker (process con import cv2 / PIL mất ~1s) để request đầu không phải chờ"""
+        if self.mode != "process":
+            return
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        start = time.perf_counter()
+        pids = await asyncio.gather(*(loop.run_in_executor(executor, _warm_up) for _ in range(self.workers)))
+        logger.info(f"Image process pool ready: {len(set(pids))} workers in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    async def run(self, func, *args):
+        """
+        Chạy `func(*args)` trong pool. Ở chế độ process, func phải là hàm cấp module và args / kết quả
+        pickle được (truyền bytes, không truyền file object). Trả về (kết quả, thời gian chờ hàng đợi ms).
+        """
+        loop = asyncio.get_running_loop()
+        submitted = time.time()
+        with self._lock:
+            self.in_flight += 1
+            self.stats["tasks"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+        try:
+            started, result = await loop.run_in_executor(self._get_executor(), _timed_call, func, *args)
+        except BrokenProcessPool:
+            # Process con chết (OOM, segfault trong native code): tạo pool mới cho các task sau
+            with self._lock:
+                self.stats["failures"] += 1
+                self.stats["pool_restarts"] += 1
+                self._executor = None
+            raise
+        except Exception:
+            with self._lock:
+                self.stats["failures"] += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        wait_ms = max(0.0, (started - submitted) * 1000)
+        with self._lock:
+            self._wait_ms.append(wait_ms)
+            self._run_ms.append((time.time() - started) * 1000)
+        return result, round(wait_ms, 1)
+
+    # ---------- admission (back-pressure) ----------
+    def _retry_after(self) -> int:
+        with self._lock:
+            run_ms = list(self._run_ms)
+            admitted = self.admitted_images
+        avg_seconds = sum(run_ms) / len(run_ms) / 1000 if run_ms else 1.0
+        seconds = math.ceil(admitted * avg_seconds / max(1, self.workers))
+        return max(1, min(IMAGE_POOL_MAX_RETRY_AFTER_SECONDS, seconds))
+
+    def _try_reserve(self, images: int) -> bool:
+        with self._lock:
+            if self.admitted_images and self.admitted_images + images > self.max_images:
+                return False
+            self.admitted_images += images
+            self.stats["admitted_requests"] += 1
+            self.stats["max_admitted_images"] = max(self.stats["max_admitted_images"], self.admitted_images)
+            return True
+
+    def try_admit(self, images: int) -> ImageTicket:
+        """Giữ chỗ cho `images` ảnh của một request; raise ImagePoolBusyError nếu hàng đợi đầy"""
+        if not self._try_reserve(images):
+            with self._lock:
+                self.stats["rejected_requests"] += 1
+                admitted = self.admitted_images
+            raise ImagePoolBusyError(images, admitted, self._retry_after())
+        return ImageTicket(self, images)
+
+    async def admit(self, images: int, poll_seconds: float = 0.1) -> ImageTicket:
+        """Như try_admit nhưng chờ tới khi có chỗ (job chạy nền đã nằm trong hàng đợi job, không cần từ chối)"""
+        while not self._try_reserve(images):
+            await asyncio.sleep(poll_seconds)
+        return ImageTicket(self, images)
+
+    def _release(self, images: int) -> None:
+        with self._lock:
+            self.admitted_images -= images
+
+    # ---------- metrics ----------
+    def get_stats(self) -> Dict[str, Any]:
+        """Độ sâu hàng đợi, thời gian chờ / xử lý (p50 / p95) của các task gần nhất"""
+        with self._lock:
+            wait_ms, run_ms = list(self._wait_ms), list(self._run_ms)
+            snapshot = {
+                **self.stats,
+                "in_flight": self.in_flight,
+                "queue_depth": max(0, self.in_flight - self.workers),
+                "admitted_images": self.admitted_images
+            }
+        return {
+            **snapshot,
+            **percentile_stats(wait_ms, "wait_ms"),
+            **percentile_stats(run_ms, "run_ms"),
+            "config": {
+                "mode": self.mode,
+                "workers": self.workers,
+                "max_queued_images": self.max_images,
+                "start_method": IMAGE_POOL_START_METHOD if self.mode == "process" else None
+            }
+        }
+
+
+image_pool = ImageWorkerPool()
@@ -0,0 +1,377 @@
+# job_queue.py - Background image analysis jobs: pluggable queue backend + worker pool
+#
+# Backends (JOB_QUEUE_BACKEND):
+#   memory   - asyncio.Queue trong process API (mặc định, dùng local / test); job vẫn lưu ở bảng analysis_jobs
+#   database - worker poll bảng analysis_jobs, claim bằng UPDATE có điều kiện; chạy worker riêng:
+#              JOB_QUEUE_BACKEND=database python job_queue.py  (API đặt JOB_WORKERS=0 để chỉ enqueue)
+# Ảnh upload được lưu tạm ở JOB_SPOOL_DIR cho tới khi job chạy xong (worker riêng phải dùng chung thư mục này).
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional
+
+from fastapi import UploadFile
+
+import llm_ledger
+from models import AnalysisJob, SessionLocal
+from image_pipeline import start_stored_images, process_uploads
+from image_workers import image_pool
+from upload_ingest import SpooledUpload, ingest_uploads
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "memory")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "warp-jobs"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+# Job "running" quá lâu (worker chết giữa chừng) được đưa lại vào hàng đợi, tối đa JOB_MAX_ATTEMPTS lần
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+
+# =====================================================
+# JOB STORE (bảng analysis_jobs)
+# =====================================================
+
+def _update_job(job_id: str, **fields) -> None:
+    db = SessionLocal()
+    try:
+        db.query(AnalysisJob).filter(AnalysisJob.id == job_id).update(fields, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _claim_job(job_id: str) -> bool:
+    """queued -> running; False nếu worker khác đã claim trước"""
+    db = SessionLocal()
+    try:
+        claimed = db.query(AnalysisJob).filter(
+            AnalysisJob.id == job_id, AnalysisJob.status == "queued"
+        ).update({
+            "status": "running",
+            "stage": "starting",
+            "started_at": datetime.utcnow(),
+            "attempts": AnalysisJob.attempts + 1
+        }, synchronize_session=False)
+        db.commit()
+        return claimed == 1
+    finally:
+        db.close()
+
+
+def _next_queued_job_id() -> Optional[str]:
+    db = SessionLocal()
+    try:
+        row = db.query(AnalysisJob.id).filter(AnalysisJob.status == "queued").order_by(
+            AnalysisJob.created_at.asc()
+        ).first()
+        return row[0] if row else None
+    finally:
+        db.close()
+
+
+def _requeue_unfinished(stale_before: Optional[datetime]) -> List[str]:
+    """
+    Đưa job bị bỏ dở về lại queued (quá JOB_MAX_ATTEMPTS thì đánh dấu failed).
+    stale_before=None: mọi job running (chỉ an toàn khi một process sở hữu toàn bộ queue).
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(AnalysisJob).filter(AnalysisJob.status == "running")
+        if stale_before is not None:
+            query = query.filter(AnalysisJob.started_at < stale_before)
+        abandoned = []
+        for job in query.all():
+            if (job.attempts or 0) >= JOB_MAX_ATTEMPTS:
+                job.status, job.error, job.finished_at = "failed", "Worker stopped before finishing", datetime.utcnow()
+                abandoned.append(job.id)
+            else:
+                job.status, job.stage = "queued", None
+        db.commit()
+        for job_id in abandoned:
+            _remove_spool(job_id)
+        return [row[0] for row in db.query(AnalysisJob.id).filter(AnalysisJob.status == "queued").order_by(
+            AnalysisJob.created_at.asc()
+        ).all()]
+    finally:
+        db.close()
+
+
+def get_job(job_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+    """Pollable job status; None nếu không tồn tại hoặc không thuộc user"""
+    db = SessionLocal()
+    try:
+        job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id, AnalysisJob.user_id == user_id).first()
+        if job is None:
+            return None
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "stage": job.stage,
+            "image_count": len(job.inputs or []),
+            "progress": job.progress,
+            "result": job.result,
+            "error": job.error,
+            "timings": job.timings,
+            "attempts": job.attempts,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None
+        }
+    finally:
+        db.close()
+
+
+# =====================================================
+# QUEUE BACKENDS
+# =====================================================
+
+class QueueBackend:
+    """Queue backend interface: enqueue job ids, dequeue returns a job id already claimed (running)"""
+
+    async def enqueue(self, job_id: str) -> None:
+        raise NotImplementedError
+
+    async def dequeue(self) -> str:
+        raise NotImplementedError
+
+    async def recover(self) -> None:
+        """Called once when workers start"""
+
+
+class MemoryQueueBackend(QueueBackend):
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def enqueue(self, job_id: str) -> None:
+        await self.queue.put(job_id)
+
+    async def dequeue(self) -> str:
+        while True:
+            job_id = await self.queue.get()
+            if await asyncio.to_thread(_claim_job, job_id):
+                return job_id
+
+    async def recover(self) -> None:
+        # Hàng đợi trong RAM mất khi restart: nạp lại các job còn dang dở từ bảng
+        for job_id in await asyncio.to_thread(_requeue_unfinished, None):
+            await self.queue.put(job_id)
+
+
+class DatabaseQueueBackend(QueueBackend):
+    def __init__(self, poll_interval: float = JOB_POLL_INTERVAL_SECONDS):
+        self.poll_interval = poll_interval
+        self._last_reclaim = 0.0
+
+    async def enqueue(self, job_id: str) -> None:
+        pass  # Row status=queued chính là hàng đợi
+
+    async def dequeue(self) -> str:
+        while True:
+            if time.monotonic() - self._last_reclaim > JOB_STALE_SECONDS / 2:
+                self._last_reclaim = time.monotonic()
+                await asyncio.to_thread(
+                    _requeue_unfinished, datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+                )
+            job_id = await asyncio.to_thread(_next_queued_job_id)
+            if job_id and await asyncio.to_thread(_claim_job, job_id):
+                return job_id
+            if not job_id:
+                await asyncio.sleep(self.poll_interval)
+
+
+QUEUE_BACKENDS = {
+    "memory": MemoryQueueBackend,
+    "database": DatabaseQueueBackend
+}
+
+
+def register_backend(name: str, backend_cls) -> None:
+    QUEUE_BACKENDS[name] = backend_cls
+
+
+# =====================================================
+# JOB EXECUTION
+# =====================================================
+
+def _spool_images(job_id: str, uploads: List[SpooledUpload]) -> List[Dict[str, Any]]:
+    job_dir = os.path.join(JOB_SPOOL_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    inputs = []
+    for index, upload in enumerate(uploads):
+        path = os.path.join(job_dir, f"{index:03d}_{os.path.basename(upload.filename or 'image')}")
+        with upload.open() as reader, open(path, "wb") as f:
+            shutil.copyfileobj(reader, f)
+        inputs.append({"filename": upload.filename, "path": path, "bytes": upload.size, "sha256": upload.sha256})
+    return inputs
+
+
+def _remove_spool(job_id: str) -> None:
+    """Xoá ảnh đã spool của job khi job kết thúc (thành công hay thất bại hẳn)"""
+    shutil.rmtree(os.path.join(JOB_SPOOL_DIR, job_id), ignore_errors=True)
+
+
+def _load_spooled(inputs: List[Dict[str, Any]]) -> List[tuple]:
+    images = []
+    for item in inputs:
+        with open(item["path"], "rb") as f:
+            images.append((item["filename"], f.read()))
+    return images
+
+
+def _create_job_row(job_id: str, user_id: int, inputs: List[Dict[str, Any]]) -> None:
+    db = SessionLocal()
+    try:
+        db.add(AnalysisJob(id=job_id, user_id=user_id, status="queued", inputs=inputs,
+                           progress={"images_uploaded": 0, "fields_found": 0}))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def run_job(job_id: str) -> None:
+    """Preprocessing, S3 upload và các pass LLM của một job đã claim; ghi status/stage/timings vào bảng"""
+    db = SessionLocal()
+    try:
+        job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+        if job is None:
+            # Job đã bị xoá sau khi được đưa vào hàng đợi: không có gì để chạy
+            logger.warning(f"Job {job_id} not found, skipping")
+            return
+        user_id, inputs, created_at = job.user_id, job.inputs, job.created_at
+    finally:
+        db.close()
+
+    run_start = time.perf_counter()
+    queue_wait_ms = round((datetime.utcnow() - created_at).total_seconds() * 1000, 1)
+    progress = {"images_uploaded": 0, "fields_found": 0}
+
+    async def emit(event: str, data: dict):
+        if event == "field":
+            progress["fields_found"] += 1
+            return
+        if event == "image_uploaded":
+            progress["images_uploaded"] += 1
+            await asyncio.to_thread(_update_job, job_id, progress=dict(progress))
+        elif event == "images_received":
+            await asyncio.to_thread(_update_job, job_id, stage="analyzing")
+        elif event == "images_skipped":
+            progress["images_skipped"] = data["count"]
+            await asyncio.to_thread(_update_job, job_id, progress=dict(progress))
+        elif event == "pass_complete":
+            progress["missing_fields"] = data.get("missing_fields", [])
+            stage = "retrying_missing_fields" if progress["missing_fields"] else "finishing_uploads"
+            await asyncio.to_thread(_update_job, job_id, stage=stage, progress=dict(progress))
+
+    try:
+        # Budget kiểm tra lại lúc chạy (job có thể nằm trong hàng đợi qua nhiều lần phân tích khác của user)
+        degraded = await asyncio.to_thread(llm_ledger.enforce_budget, user_id)
+        images = await asyncio.to_thread(_load_spooled, inputs)
+        # Job đã nằm trong hàng đợi job: chờ tới khi pool xử lý ảnh có chỗ thay vì từ chối
+        with await image_pool.admit(len(images)):
+            state = await start_stored_images(images, user_id, emit)
+            state["degraded"] = degraded
+            pipeline_result = await process_uploads(state, emit)
+        analysis_result = pipeline_result["analysis"]
+        timings = {"queue_wait_ms": queue_wait_ms, **pipeline_result["timings"],
+                   "run_ms": round((time.perf_counter() - run_start) * 1000, 1)}
+        if analysis_result["success"]:
+            fields = dict(
+                status="succeeded",
+                result={
+                    "data": analysis_result["data"],
+                    "images": pipeline_result["images"],
+                    "usage": analysis_result.get("usage"),
+                    "cached": pipeline_result["cached"],
+                    "degraded": pipeline_result["degraded"],
+                    "skipped": pipeline_result["skipped"],
+                    "metadata": pipeline_result["metadata"]
+                }
+            )
+        else:
+            fields = dict(status="failed", error=analysis_result.get("error"))
+        await asyncio.to_thread(
+            _update_job, job_id, stage="done", progress=dict(progress), timings=timings,
+            finished_at=datetime.utcnow(), **fields
+        )
+        logger.info(f"Job {job_id} {fields['status']} in {timings['run_ms']} ms (queued {queue_wait_ms} ms)")
+    except asyncio.CancelledError:
+        raise  # Worker dừng: job giữ status running (và ảnh đã spool), được requeue khi khởi động lại / quá hạn
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {str(e)}", exc_info=True)
+        await asyncio.to_thread(
+            _update_job, job_id, status="failed", error=str(e), finished_at=datetime.utcnow(),
+            timings={"queue_wait_ms": queue_wait_ms, "run_ms": round((time.perf_counter() - run_start) * 1000, 1)}
+        )
+    await asyncio.to_thread(_remove_spool, job_id)
+
+
+class JobWorkerPool:
+    """N worker coroutines pulling claimed jobs from the queue backend"""
+
+    def __init__(self, backend: QueueBackend, workers: int = JOB_WORKERS):
+        self.backend = backend
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+
+    async def submit(self, files: List[UploadFile], user_id: int) -> str:
+        """Lưu ảnh upload, tạo job (queued) và enqueue; trả job id ngay. Raises UploadTooLargeError."""
+        uploads = await ingest_uploads(files)
+        job_id = str(uuid.uuid4())
+        try:
+            inputs = await asyncio.to_thread(_spool_images, job_id, uploads)
+        finally:
+            for upload in uploads:
+                upload.close()
+        await asyncio.to_thread(_create_job_row, job_id, user_id, inputs)
+        await self.backend.enqueue(job_id)
+        return job_id
+
+    async def _worker_loop(self, index: int):
+        while True:
+            try:
+                job_id = await self.backend.dequeue()
+                logger.info(f"Worker {index} running job {job_id}")
+                await run_job(job_id)
+            except Exception:
+                # Lỗi ngoài luồng xử lý của run_job (DB, ghi status thất bại...): worker phải sống tiếp,
+                # job dở dang (status running) được requeue khi quá hạn
+                logger.exception(f"Worker {index} error")
+                await asyncio.sleep(JOB_POLL_INTERVAL_SECONDS)
+
+    async def start(self):
+        if self._tasks or self.workers <= 0:
+            return
+        await self.backend.recover()
+        self._tasks = [asyncio.create_task(self._worker_loop(i)) for i in range(self.workers)]
+        logger.info(f"Started {self.workers} analysis job workers ({type(self.backend).__name__})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+job_pool = JobWorkerPool(QUEUE_BACKENDS[JOB_QUEUE_BACKEND]())
+
+
+async def _run_standalone_worker():
+    await image_pool.start()
+    await job_pool.start()
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_run_standalone_worker())
+    finally:
+        llm_ledger.writer.stop()
+        image_pool.shutdown()
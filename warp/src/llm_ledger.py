@@ -0,0 +1,291 @@
+# llm_ledger.py - Ledger các lần gọi LLM (latency, token, model, cache hit theo user / pass) + budget token theo user
+#
+# Các dòng được đưa vào hàng đợi trong bộ nhớ và một thread nền ghi xuống bảng llm_call_logs theo batch,
+# nên request không chờ DB. Ngữ cảnh (user, request) được gắn bằng analysis_context() quanh mỗi lần phân tích.
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional
+
+from sqlalchemy import func
+
+from models import LLMCallLog, SessionLocal
+from percentiles import percentile, percentile_stats
+
+logger = logging.getLogger(__name__)
+
+LLM_LEDGER_ENABLED = os.getenv("LLM_LEDGER_ENABLED", "true").lower() == "true"
+LLM_LEDGER_BATCH_SIZE = int(os.getenv("LLM_LEDGER_BATCH_SIZE", "50"))
+LLM_LEDGER_FLUSH_SECONDS = float(os.getenv("LLM_LEDGER_FLUSH_SECONDS", "2.0"))
+# Hàng đợi đầy (DB chậm / lỗi kéo dài) thì bỏ dòng mới thay vì giữ request
+LLM_LEDGER_QUEUE_MAX = int(os.getenv("LLM_LEDGER_QUEUE_MAX", "10000"))
+
+# Budget theo ngày (UTC) cho mỗi user; 0 = không giới hạn. Hết budget: "degrade" (tier nhanh, không PASS 2,
+# không ghi cache) hoặc "reject" (HTTP 429)
+USER_DAILY_TOKEN_BUDGET = int(os.getenv("USER_DAILY_TOKEN_BUDGET", "0"))
+USER_DAILY_ANALYSIS_BUDGET = int(os.getenv("USER_DAILY_ANALYSIS_BUDGET", "0"))
+LLM_BUDGET_MODE = os.getenv("LLM_BUDGET_MODE", "degrade")
+
+# USD / 1M token (prompt, completion) để ước lượng chi phí trong các báo cáo; ghi đè bằng LLM_PRICES_JSON
+LLM_PRICES = {"gpt-4o": [2.5, 10.0], "gpt-4o-mini": [0.15, 0.6], **json.loads(os.getenv("LLM_PRICES_JSON", "{}"))}
+
+_context: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("llm_ledger_context", default=None)
+
+
+class BudgetExceededError(Exception):
+    """User đã dùng hết budget LLM trong ngày (LLM_BUDGET_MODE=reject)"""
+
+    def __init__(self, status: Dict[str, Any]):
+        super().__init__(f"Daily LLM budget exceeded ({status['tokens_used']} tokens, {status['analyses_used']} analyses)")
+        self.status = status
+
+
+class _LedgerWriter:
+    """Thread nền: gom các dòng trong hàng đợi, ghi một batch mỗi LLM_LEDGER_BATCH_SIZE dòng / LLM_LEDGER_FLUSH_SECONDS"""
+
+    def __init__(self):
+        self.queue: queue.Queue = queue.Queue(maxsize=LLM_LEDGER_QUEUE_MAX)
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.stats = {"written": 0, "dropped": 0, "batches": 0, "errors": 0}
+
+    def put(self, row: Dict[str, Any]) -> None:
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _ensure_started(self) -> None:
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="llm-ledger", daemon=True)
+                self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch, stop = [], False
+            deadline = time.monotonic() + LLM_LEDGER_FLUSH_SECONDS
+            while len(batch) < LLM_LEDGER_BATCH_SIZE:
+                try:
+                    row = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if row is None:
+                    stop = True
+                    break
+                batch.append(row)
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        db = SessionLocal()
+        try:
+            db.bulk_insert_mappings(LLMCallLog, batch)
+            db.commit()
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception as e:
+            db.rollback()
+            self.stats["errors"] += 1
+            logger.warning(f"LLM ledger write failed ({len(batch)} rows dropped): {e}")
+        finally:
+            db.close()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Ghi nốt các dòng còn trong hàng đợi rồi dừng thread (gọi lúc shutdown)"""
+        with self.lock:
+            thread = self.thread
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join(timeout)
+
+
+writer = _LedgerWriter()
+
+
+@contextmanager
+def analysis_context(user_id: Optional[int], degraded: bool = False):
+    """Gắn user / request id cho mọi lần gọi LLM trong khối (kể cả các task con tạo bằng asyncio)"""
+    token = _context.set({"user_id": user_id, "request_id": uuid.uuid4().hex, "degraded": degraded})
+    try:
+        yield _context.get()
+    finally:
+        _context.reset(token)
+
+
+def _record(**row) -> None:
+    if not LLM_LEDGER_ENABLED:
+        return
+    context = _context.get() or {}
+    writer.put({
+        "created_at": datetime.utcnow(),
+        "user_id": context.get("user_id"),
+        "request_id": context.get("request_id"),
+        "degraded": bool(context.get("degraded")),
+        **row
+    })
+
+
+def record_llm_call(pass_number: int, model: Optional[str], image_count: int, result: Dict[str, Any]) -> None:
+    """Một lần gọi LLM (`result` của _first_pass_extraction / _targeted_retry: usage, latency_ms, success)"""
+    usage = result.get("usage") or {}
+    _record(
+        pass_number=pass_number, model=model, image_count=image_count,
+        prompt_tokens=usage.get("input_tokens") or 0, completion_tokens=usage.get("output_tokens") or 0,
+        latency_ms=result.get("latency_ms"), cache_hit=False,
+        success=bool(result.get("success")) and not result.get("warning")
+    )
+
+
+def record_cache_hit(image_count: int) -> None:
+    _record(pass_number=0, model=None, image_count=image_count, prompt_tokens=0, completion_tokens=0,
+            latency_ms=None, cache_hit=True, success=True)
+
+
+def _day_start() -> datetime:
+    now = datetime.utcnow()
+    return datetime(now.year, now.month, now.day)
+
+
+def check_budget(user_id: int) -> Dict[str, Any]:
+    """
+    Token / số lần phân tích user đã dùng hôm nay (UTC) và hành động áp dụng: allow, degrade, reject.
+    Kết quả trả từ cache không tính vào budget.
+    Tính trên các dòng đã ghi xuống DB (trễ tối đa ~LLM_LEDGER_FLUSH_SECONDS).
+    """
+    status = {
+        "tokens_used": 0, "token_budget": USER_DAILY_TOKEN_BUDGET,
+        "analyses_used": 0, "analysis_budget": USER_DAILY_ANALYSIS_BUDGET,
+        "resets_at": (_day_start() + timedelta(days=1)).isoformat(), "action": "allow"
+    }
+    if not (USER_DAILY_TOKEN_BUDGET or USER_DAILY_ANALYSIS_BUDGET):
+        return status
+    db = SessionLocal()
+    try:
+        tokens, analyses = db.query(
+            func.coalesce(func.sum(LLMCallLog.prompt_tokens + LLMCallLog.completion_tokens), 0),
+            func.count(func.distinct(LLMCallLog.request_id))
+        ).filter(
+            LLMCallLog.user_id == user_id, LLMCallLog.created_at >= _day_start(), LLMCallLog.cache_hit.is_(False)
+        ).one()
+    finally:
+        db.close()
+    status.update(tokens_used=int(tokens), analyses_used=int(analyses))
+    exceeded = (USER_DAILY_TOKEN_BUDGET and tokens >= USER_DAILY_TOKEN_BUDGET) or \
+        (USER_DAILY_ANALYSIS_BUDGET and analyses >= USER_DAILY_ANALYSIS_BUDGET)
+    if exceeded:
+        status["action"] = "reject" if LLM_BUDGET_MODE == "reject" else "degrade"
+    return status
+
+
+def enforce_budget(user_id: int) -> bool:
+    """True nếu phải chạy ở chế độ giảm cấp; raise BudgetExceededError nếu LLM_BUDGET_MODE=reject và đã hết budget"""
+    status = check_budget(user_id)
+    if status["action"] == "reject":
+        raise BudgetExceededError(status)
+    return status["action"] == "degrade"
+
+
+def _cost_usd(model: Optional[str], prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = LLM_PRICES.get(model or "", [0.0, 0.0])
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def _rows_since(hours: float, user_id: Optional[int] = None) -> List[LLMCallLog]:
+    db = SessionLocal()
+    try:
+        query = db.query(LLMCallLog).filter(LLMCallLog.created_at >= datetime.utcnow() - timedelta(hours=hours))
+        if user_id is not None:
+            query = query.filter(LLMCallLog.user_id == user_id)
+        return query.all()
+    finally:
+        db.close()
+
+
+def get_summary(hours: float = 24) -> Dict[str, Any]:
+    """
+    Tổng hợp trong `hours` giờ gần nhất: theo (pass, model) - số lần gọi, lỗi, p50/p95 latency, token, chi phí;
+    theo lần phân tích (request) - token / chi phí mỗi report, tỉ lệ cache hit.
+    """
+    rows = _rows_since(hours)
+    by_call: Dict[tuple, Dict[str, Any]] = {}
+    by_request: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        request = by_request.setdefault(row.request_id, {"tokens": 0, "cost_usd": 0.0, "cache_hit": False})
+        if row.cache_hit:
+            request["cache_hit"] = True
+            continue
+        cost = _cost_usd(row.model, row.prompt_tokens or 0, row.completion_tokens or 0)
+        request["tokens"] += (row.prompt_tokens or 0) + (row.completion_tokens or 0)
+        request["cost_usd"] += cost
+        group = by_call.setdefault((row.pass_number, row.model), {
+            "calls": 0, "failures": 0, "prompt_tokens": 0, "completion_tokens": 0, "images": 0,
+            "cost_usd": 0.0, "latencies": []
+        })
+        group["calls"] += 1
+        group["failures"] += 0 if row.success else 1
+        group["prompt_tokens"] += row.prompt_tokens or 0
+        group["completion_tokens"] += row.completion_tokens or 0
+        group["images"] += row.image_count or 0
+        group["cost_usd"] += cost
+        if row.latency_ms is not None:
+            group["latencies"].append(row.latency_ms)
+
+    calls = []
+    for (pass_number, model), group in sorted(by_call.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+        latencies = group.pop("latencies")
+        calls.append({
+            "pass": pass_number, "model": model, **group, "cost_usd": round(group["cost_usd"], 4),
+            **percentile_stats(latencies, "latency_ms", default=None)
+        })
+    analyzed = [r for r in by_request.values() if not r["cache_hit"]]
+    return {
+        "hours": hours,
+        "calls": calls,
+        "reports": {
+            "analyses": len(by_request),
+            "cache_hits": len(by_request) - len(analyzed),
+            "cache_hit_rate": round((len(by_request) - len(analyzed)) / len(by_request), 4) if by_request else 0.0,
+            "tokens_per_report_avg": round(sum(r["tokens"] for r in analyzed) / len(analyzed), 1) if analyzed else 0.0,
+            "tokens_per_report_p95": percentile([r["tokens"] for r in analyzed], 0.95, default=None),
+            "cost_usd_per_report_avg": round(sum(r["cost_usd"] for r in analyzed) / len(analyzed), 5) if analyzed else 0.0
+        },
+        "writer": dict(writer.stats)
+    }
+
+
+def get_user_usage(hours: float = 24, limit: int = 50) -> List[Dict[str, Any]]:
+    """Token, chi phí, số lần phân tích và p95 latency của từng user trong `hours` giờ gần nhất (nhiều token nhất trước)"""
+    users: Dict[Optional[int], Dict[str, Any]] = {}
+    for row in _rows_since(hours):
+        user = users.setdefault(row.user_id, {
+            "user_id": row.user_id, "requests": set(), "calls": 0, "tokens": 0, "cost_usd": 0.0,
+            "cache_hits": 0, "degraded_calls": 0, "latencies": []
+        })
+        user["requests"].add(row.request_id)
+        if row.cache_hit:
+            user["cache_hits"] += 1
+            continue
+        user["calls"] += 1
+        user["tokens"] += (row.prompt_tokens or 0) + (row.completion_tokens or 0)
+        user["cost_usd"] += _cost_usd(row.model, row.prompt_tokens or 0, row.completion_tokens or 0)
+        user["degraded_calls"] += 1 if row.degraded else 0
+        if row.latency_ms is not None:
+            user["latencies"].append(row.latency_ms)
+
+    result = []
+    for user in users.values():
+        latencies, requests = user.pop("latencies"), user.pop("requests")
+        result.append({**user, "analyses": len(requests), "cost_usd": round(user["cost_usd"], 4),
+                       "latency_ms_p95": percentile(latencies, 0.95, default=None)})
+    return sorted(result, key=lambda u: -u["tokens"])[:limit]
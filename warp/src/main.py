@@ -1,26 +1,30 @@
 # main.py - Updated with preprocessing
+import asyncio
+import json
 import os
+from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()
 
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse, JSONResponse
+from sqlalchemy.orm import Session, selectinload
 from typing import List
-import boto3
-from datetime import datetime
-from io import BytesIO
 
-from models import PropertyReport, PropertyImage, get_db
-from schemas import PropertyReportCreate
-from auth import get_current_user
+from models import PropertyReport, PropertyImage, PropertyImageRendition, get_db
+from schemas import PropertyReportCreate, PresignRequest, AnalyzeKeysRequest
+from auth import get_current_user, get_admin_user
 from auth_routes import router as auth_router
-from image_analysis_service import (
-    analyze_images_to_property_form,
-    convert_bytes_to_base64_for_analysis,
-    compress_image_if_needed,
-    preprocess_image_for_ocr
-)
+from image_pipeline import run_upload_pipeline, read_uploads, process_uploads, fetch_stored_objects, RENDITION_KINDS
+from storage import create_presigned_upload, is_user_asset_key, rendition_key
+from job_queue import job_pool, get_job
+from image_workers import image_pool, ImagePoolBusyError
+from upload_ingest import UploadTooLargeError, MAX_UPLOAD_REQUEST_BYTES, MAX_UPLOAD_FILE_BYTES, MAX_UPLOAD_FILES
+import analysis_cache
+import blob_store
+import model_router
+import llm_ledger
 import logging
 logging.basicConfig(level=logging.INFO)
 
@@ -49,38 +53,56 @@ app.add_middleware(
 
 app.include_router(auth_router)
 
-# AWS S3
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv("BUCKET_ACCOUNT_ID"),
-    aws_secret_access_key=os.getenv("BUCKET_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("BUCKET_REGION", "ap-southeast-1")
-)
+# Cho phép phần overhead của multipart (boundary, header từng part) ngoài tổng dung lượng file
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
 
-S3_BUCKET = os.getenv("BUCKET_NAME", "ai-asset-valuation")
-AWS_REGION = os.getenv("BUCKET_REGION", "ap-southeast-1")
-logger = logging.getLogger(__name__)
+
+@app.middleware("http")
+async def reject_oversized_uploads(request, call_next):
+    """Từ chối upload quá lớn theo Content-Length trước khi body được đọc / parse"""
+    if request.method == "POST" and request.url.path.startswith("/api/analysis/"):
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > MAX_UPLOAD_REQUEST_BYTES + MULTIPART_OVERHEAD_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Request exceeds {MAX_UPLOAD_REQUEST_BYTES // (1024 * 1024)} MB upload limit"}
+            )
+    return await call_next(request)
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    await image_pool.start()
+    await job_pool.start()
 
 
-def upload_to_s3(file_content: bytes, user_id: int, filename: str) -> dict:
-    """Upload file to S3"""
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_pool.stop()
+    # Ghi nốt các dòng ledger LLM còn trong hàng đợi
+    await asyncio.to_thread(llm_ledger.writer.stop)
+    await asyncio.to_thread(image_pool.shutdown)
+
+
+def admit_images(count: int):
+    """Giữ chỗ trong hàng đợi xử lý ảnh cho request; hàng đợi đầy -> 503 + Retry-After (client thử lại sau)"""
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        year_month = datetime.now().strftime("%Y/%m")
-        s3_key = f"assets/{year_month}/{user_id}/{timestamp}_{filename}"
-        
-        s3_client.upload_fileobj(
-            BytesIO(file_content),
-            S3_BUCKET,
-            s3_key,
-            ExtraArgs={'ContentType': 'image/jpeg'}
+        return image_pool.try_admit(count)
+    except ImagePoolBusyError as e:
+        logger.warning(f"Image pool busy, rejecting {count} images: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+async def check_llm_budget(user_id: int) -> bool:
+    """True nếu user đã hết budget LLM trong ngày và chạy ở chế độ giảm cấp; LLM_BUDGET_MODE=reject thì trả 429"""
+    try:
+        return await asyncio.to_thread(llm_ledger.enforce_budget, user_id)
+    except llm_ledger.BudgetExceededError as e:
+        retry_after = (datetime.fromisoformat(e.status["resets_at"]) - datetime.utcnow()).total_seconds()
+        raise HTTPException(
+            status_code=429, detail={"message": str(e), "budget": e.status},
+            headers={"Retry-After": str(max(1, int(retry_after)))}
         )
-        
-        s3_url = f"https://{S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
-        return {"success": True, "url": s3_url, "key": s3_key}
-    except Exception as e:
-        logger.error(f"S3 upload error: {str(e)}")
-        return {"success": False, "error": str(e)}
 
 
 @app.post("/api/analysis/upload-and-analyze")
@@ -90,42 +112,15 @@ async def upload_and_analyze(
     db: Session = Depends(get_db)
 ):
     """
-    Upload images và analyze với PREPROCESSING
+    Upload images và analyze với PREPROCESSING.
+    Các file được xử lý song song; S3 upload chạy đồng thời với bước phân tích.
     """
+    user_id = int(current_user["user_id"])
+    degraded = await check_llm_budget(user_id)
+    ticket = admit_images(len(files))
     try:
-        images_base64 = []
-        uploaded_urls = []
-        
-        user_id = int(current_user["user_id"])
-        
-        for file in files:
-            content = await file.read()
-            
-            # Compress nếu cần
-            content = compress_image_if_needed(content)
-            
-            # ✨ NEW: Preprocess trước khi analyze
-            preprocessed_content = preprocess_image_for_ocr(content)
-            
-            # Convert to base64 for analysis (skip preprocess vì đã làm rồi)
-            img_b64 = convert_bytes_to_base64_for_analysis(
-                preprocessed_content, 
-                preprocess=False  # Already preprocessed
-            )
-            images_base64.append(img_b64)
-            
-            # Upload ORIGINAL (không preprocess) lên S3
-            s3_result = upload_to_s3(content, user_id, file.filename)
-            if s3_result['success']:
-                uploaded_urls.append({
-                    "filename": file.filename,
-                    "url": s3_result['url'],
-                    "key": s3_result['key']
-                })
-        
-        # Analyze với ảnh đã preprocess
-        logger.info(f"Analyzing {len(images_base64)} preprocessed images")
-        analysis_result = analyze_images_to_property_form(images_base64)
+        pipeline_result = await run_upload_pipeline(files, user_id, degraded=degraded)
+        analysis_result = pipeline_result["analysis"]
         
         if not analysis_result['success']:
             raise HTTPException(status_code=500, detail=analysis_result['error'])
@@ -135,12 +130,255 @@ async def upload_and_analyze(
         return {
             "success": True,
             "data": analysis_result['data'],
-            "images": uploaded_urls,
-            "usage": analysis_result.get('usage')
+            "images": pipeline_result["images"],
+            "usage": analysis_result.get('usage'),
+            "cached": pipeline_result["cached"],
+            "degraded": pipeline_result["degraded"],
+            "skipped": pipeline_result["skipped"],
+            "metadata": pipeline_result["metadata"],
+            "timings": pipeline_result["timings"]
         }
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Upload error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        ticket.release()
+
+
+@app.post("/api/uploads/presign")
+async def presign_uploads(payload: PresignRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Presigned S3 PUT URL / POST policy cho từng file (assets/{year}/{month}/{user_id}/...): client upload
+    thẳng lên S3, sau đó gọi /api/analysis/analyze-keys với các key nhận được.
+    """
+    user_id = int(current_user["user_id"])
+    if payload.method not in ("put", "post"):
+        raise HTTPException(status_code=400, detail="method must be 'put' or 'post'")
+    if len(payload.files) > MAX_UPLOAD_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many files ({len(payload.files)} > {MAX_UPLOAD_FILES})")
+    for f in payload.files:
+        if not f.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail=f"{f.filename}: only image uploads are allowed")
+        if f.size is not None and f.size > MAX_UPLOAD_FILE_BYTES:
+            raise HTTPException(status_code=413, detail=f"{f.filename} exceeds {MAX_UPLOAD_FILE_BYTES // (1024 * 1024)} MB per-file limit")
+
+    uploads = [
+        create_presigned_upload(user_id, f.filename, f.content_type, f.size, payload.method, MAX_UPLOAD_FILE_BYTES)
+        for f in payload.files
+    ]
+    return {"success": True, "uploads": uploads}
+
+
+@app.post("/api/analysis/analyze-keys")
+async def analyze_keys(payload: AnalyzeKeysRequest, current_user: dict = Depends(get_current_user)):
+    """Analyze ảnh đã upload thẳng lên S3 (presigned); API chỉ nhận JSON, không nhận / upload lại bytes ảnh"""
+    user_id = int(current_user["user_id"])
+    if not payload.keys:
+        raise HTTPException(status_code=400, detail="No keys given")
+    foreign = [k for k in payload.keys if not is_user_asset_key(k, user_id)]
+    if foreign:
+        raise HTTPException(status_code=403, detail=f"Keys not owned by user: {foreign}")
+    degraded = await check_llm_budget(user_id)
+
+    with admit_images(len(payload.keys)):
+        try:
+            state = await fetch_stored_objects(payload.keys, user_id)
+            state["degraded"] = degraded
+            pipeline_result = await process_uploads(state)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=f"Object not found: {e}")
+
+    analysis_result = pipeline_result["analysis"]
+    if not analysis_result['success']:
+        raise HTTPException(status_code=500, detail=analysis_result['error'])
+    logger.info(f"Analysis successful. Tokens used: {analysis_result.get('usage')}")
+    return {
+        "success": True,
+        "data": analysis_result['data'],
+        "images": pipeline_result["images"],
+        "usage": analysis_result.get('usage'),
+        "cached": pipeline_result["cached"],
+        "degraded": pipeline_result["degraded"],
+        "skipped": pipeline_result["skipped"],
+        "metadata": pipeline_result["metadata"],
+        "timings": pipeline_result["timings"]
+    }
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@app.post("/api/analysis/upload-and-analyze/stream")
+async def upload_and_analyze_stream(
+    files: List[UploadFile] = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Streaming variant (Server-Sent Events) của upload-and-analyze. Events theo thứ tự xảy ra:
+    images_received, image_uploaded (mỗi URL S3), field (pass 1 ngay khi parse được / pass 2),
+    images_skipped (ảnh gần trùng / mờ không gửi phân tích), pass_complete,
+    complete (data, images, usage, skipped, metadata, timings) hoặc error. Trường biết trước từ EXIF
+    (toạ độ GPS) được phát ngay là field với "pass": 0, "source": "exif".
+    """
+    user_id = int(current_user["user_id"])
+    degraded = await check_llm_budget(user_id)
+    # Chỗ trong hàng đợi ảnh được giữ tới khi phân tích (chạy sau khi response bắt đầu stream) kết thúc
+    ticket = admit_images(len(files))
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def emit(event: str, data: dict):
+        await queue.put((event, data))
+
+    # Đọc file trước khi trả response (request body được giải phóng khi handler return)
+    try:
+        state = await read_uploads(files, user_id, emit)
+    except UploadTooLargeError as e:
+        ticket.release()
+        raise HTTPException(status_code=413, detail=str(e))
+    except BaseException:
+        ticket.release()
+        raise
+    state["degraded"] = degraded
+
+    async def run():
+        try:
+            pipeline_result = await process_uploads(state, emit)
+            analysis_result = pipeline_result["analysis"]
+            if analysis_result["success"]:
+                logger.info(f"Analysis successful. Tokens used: {analysis_result.get('usage')}")
+                await emit("complete", {
+                    "data": analysis_result["data"],
+                    "images": pipeline_result["images"],
+                    "usage": analysis_result.get("usage"),
+                    "cached": pipeline_result["cached"],
+                    "degraded": pipeline_result["degraded"],
+                    "skipped": pipeline_result["skipped"],
+                    "metadata": pipeline_result["metadata"],
+                    "timings": pipeline_result["timings"]
+                })
+            else:
+                await emit("error", {"detail": analysis_result["error"]})
+        except Exception as e:
+            logger.error(f"Streaming upload error: {str(e)}", exc_info=True)
+            await emit("error", {"detail": str(e)})
+        finally:
+            ticket.release()
+            await queue.put(None)
+
+    async def event_stream():
+        task = asyncio.create_task(run())
+        try:
+            while (item := await queue.get()) is not None:
+                yield _sse(*item)
+        finally:
+            # Client ngắt kết nối giữa chừng -> huỷ phân tích và các S3 upload còn chạy
+            if not task.done():
+                task.cancel()
+                ticket.release()  # task huỷ trước khi kịp chạy thì finally của run() không chạy
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/analysis/jobs", status_code=202)
+async def create_analysis_job(
+    files: List[UploadFile] = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Async mode của upload-and-analyze: lưu ảnh, enqueue job và trả job id ngay.
+    Worker pool chạy preprocessing, S3 upload và các pass LLM; poll GET /api/analysis/jobs/{job_id}.
+    Budget LLM được kiểm tra cả lúc nhận job (reject -> 429) và lúc worker chạy job.
+    """
+    await check_llm_budget(int(current_user["user_id"]))
+    try:
+        job_id = await job_pool.submit(files, int(current_user["user_id"]))
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(f"Create job error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/analysis/jobs/{job_id}"
+    }
+
+
+@app.get("/api/analysis/jobs/{job_id}")
+async def get_analysis_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Job status, stage, progress, stage timings và kết quả khi đã xong"""
+    job = await asyncio.to_thread(get_job, job_id, int(current_user["user_id"]))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"success": True, "job": job}
+
+
+@app.get("/api/analysis/cache/stats")
+async def get_analysis_cache_stats(current_user: dict = Depends(get_admin_user)):
+    """Hit rate và số giây LLM tiết kiệm được nhờ analysis cache"""
+    return {"success": True, "stats": analysis_cache.get_stats()}
+
+
+@app.get("/api/analysis/routing/stats")
+async def get_model_routing_stats(current_user: dict = Depends(get_admin_user)):
+    """Latency, token và độ đầy đủ trường quan trọng theo từng tier model (routing screenshot / ảnh chụp)"""
+    return {"success": True, "stats": model_router.get_stats()}
+
+
+@app.get("/api/analysis/image-pool/stats")
+async def get_image_pool_stats(current_user: dict = Depends(get_admin_user)):
+    """Pool xử lý ảnh: độ sâu hàng đợi, số ảnh đang giữ chỗ, thời gian chờ / xử lý p50 / p95, số request bị từ chối"""
+    return {"success": True, "stats": image_pool.get_stats()}
+
+
+@app.get("/api/usage/budget")
+async def get_llm_budget(current_user: dict = Depends(get_current_user)):
+    """Token / số lần phân tích LLM đã dùng hôm nay (UTC), budget và hành động khi vượt (allow / degrade / reject)"""
+    return {"success": True, "budget": await asyncio.to_thread(llm_ledger.check_budget, int(current_user["user_id"]))}
+
+
+@app.get("/api/admin/llm/summary")
+async def get_llm_summary(hours: float = 24, current_user: dict = Depends(get_admin_user)):
+    """Ledger LLM: p50/p95 latency, token, chi phí theo pass / model; token và chi phí mỗi report, tỉ lệ cache hit"""
+    return {"success": True, "summary": await asyncio.to_thread(llm_ledger.get_summary, hours)}
+
+
+@app.get("/api/admin/llm/users")
+async def get_llm_user_usage(hours: float = 24, limit: int = 50, current_user: dict = Depends(get_admin_user)):
+    """Token, chi phí, số lần phân tích và số lần gọi giảm cấp của từng user (nhiều token nhất trước)"""
+    return {"success": True, "users": await asyncio.to_thread(llm_ledger.get_user_usage, hours, limit)}
+
+
+@app.get("/api/storage/stats")
+async def get_storage_stats(current_user: dict = Depends(get_admin_user)):
+    """Content-addressed image storage: tỉ lệ upload trùng được bỏ qua, dung lượng tiết kiệm, số blob mồ côi"""
+    return {"success": True, "stats": await asyncio.to_thread(blob_store.get_stats)}
+
+
+def _foreign_report_keys(db: Session, user_id: int, images: List[dict]) -> List[str]:
+    """
+    Key ảnh trong report phải do server cấp cho user: asset của user (assets/.../{user_id}/...) hoặc blob
+    user đã upload / được dùng lại. Key rendition phải là rendition của chính ảnh gốc đó.
+    """
+    originals = [img.get("key") for img in images if img.get("key")]
+    granted = blob_store.granted_blob_keys(db, user_id, originals) if originals else set()
+    foreign = [key for key in originals if not is_user_asset_key(key, user_id) and key not in granted]
+    for img in images:
+        for kind in RENDITION_KINDS:
+            key = img.get(f"{kind}_key")
+            if key and (not img.get("key") or key != rendition_key(img["key"], kind, key.rsplit(".", 1)[-1])):
+                foreign.append(key)
+    return foreign
 
 
 @app.post("/api/reports")
@@ -150,9 +388,11 @@ async def create_report(
     db: Session = Depends(get_db)
 ):
     """Create new property report"""
+    user_id = int(current_user["user_id"])
+    foreign = _foreign_report_keys(db, user_id, payload.images or [])
+    if foreign:
+        raise HTTPException(status_code=403, detail=f"Keys not owned by user: {foreign}")
     try:
-        user_id = int(current_user["user_id"])
-        
         report = PropertyReport(
             user_id=user_id,
             address=payload.address,
@@ -193,6 +433,16 @@ async def create_report(
                     s3_key=key,
                     original_filename=filename
                 )
+                # Renditions do upload-and-analyze trả về ({kind}_url / {kind}_key)
+                if isinstance(img_data, dict):
+                    for kind in RENDITION_KINDS:
+                        if img_data.get(f"{kind}_key"):
+                            property_image.renditions.append(PropertyImageRendition(
+                                kind=kind,
+                                s3_url=img_data.get(f"{kind}_url", ""),
+                                s3_key=img_data[f"{kind}_key"],
+                                content_type="image/webp" if img_data[f"{kind}_key"].endswith(".webp") else "image/jpeg"
+                            ))
                 db.add(property_image)
         
         db.add(report)
@@ -210,6 +460,20 @@ async def create_report(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _image_urls(img: PropertyImage) -> dict:
+    """
+    URL theo từng view: thumbnail (danh sách), preview / preview_webp (trang chi tiết), url (bản gốc để tải).
+    Ảnh cũ chưa có rendition dùng bản gốc.
+    """
+    renditions = {r.kind: r.s3_url for r in img.renditions}
+    return {
+        "url": img.s3_url,
+        "thumbnail_url": renditions.get("thumbnail") or renditions.get("preview") or img.s3_url,
+        "preview_url": renditions.get("preview") or img.s3_url,
+        "preview_webp_url": renditions.get("preview_webp")
+    }
+
+
 @app.get("/api/reports")
 async def list_reports(
     current_user: dict = Depends(get_current_user),
@@ -221,7 +485,9 @@ async def list_reports(
     try:
         user_id = int(current_user["user_id"])
         
-        reports = db.query(PropertyReport).filter(
+        reports = db.query(PropertyReport).options(
+            selectinload(PropertyReport.images).selectinload(PropertyImage.renditions)
+        ).filter(
             PropertyReport.user_id == user_id
         ).order_by(PropertyReport.created_at.desc()).offset(offset).limit(limit).all()
         
@@ -234,7 +500,8 @@ async def list_reports(
                     "property_type": r.property_type,
                     "created_at": r.created_at,
                     "overall_condition": r.overall_condition,
-                    "images_count": len(r.images)
+                    "images_count": len(r.images),
+                    "thumbnail_url": _image_urls(r.images[0])["thumbnail_url"] if r.images else None
                 }
                 for r in reports
             ]
@@ -253,7 +520,9 @@ async def get_report(
     """Get detailed report"""
     user_id = int(current_user["user_id"])
     
-    report = db.query(PropertyReport).filter(
+    report = db.query(PropertyReport).options(
+        selectinload(PropertyReport.images).selectinload(PropertyImage.renditions)
+    ).filter(
         PropertyReport.id == report_id,
         PropertyReport.user_id == user_id
     ).first()
@@ -285,7 +554,7 @@ async def get_report(
             "images": [
                 {
                     "id": img.id,
-                    "url": img.s3_url,
+                    **_image_urls(img),
                     "filename": img.original_filename,
                     "uploaded_at": img.uploaded_at
                 }
@@ -0,0 +1,123 @@
+# model_router.py - Chọn tier vision model cho từng lần phân tích: screenshot nhiều chữ -> model nhanh/rẻ,
+# ảnh chụp thật (cần đánh giá tình trạng nhà) -> model lớn; thiếu trường quan trọng thì escalate lên model lớn
+import os
+import threading
+from collections import deque
+from typing import List, Dict, Any
+
+from percentiles import percentile_stats
+
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+
+MODEL_TIERS: Dict[str, Dict[str, Any]] = {
+    "fast": {
+        "model": os.getenv("LLM_FAST_MODEL", "gpt-4o-mini"),
+        "max_tokens": int(os.getenv("LLM_FAST_MAX_TOKENS", "2000"))
+    },
+    "large": {
+        "model": os.getenv("LLM_LARGE_MODEL", "gpt-4o"),
+        "max_tokens": int(os.getenv("LLM_LARGE_MAX_TOKENS", "3000"))
+    }
+}
+# Tier dùng cho PASS 2 (targeted retry) và chạy lại PASS 1 khi tier nhanh lỗi
+ESCALATION_TIER = os.getenv("LLM_ESCALATION_TIER", "large")
+
+# Screenshot "nhiều chữ": ảnh dạng tài liệu (nền phẳng, xem is_document_like) có tỉ lệ pixel cạnh (Canny trên
+# thumbnail 256 px) >= ngưỡng; ảnh nền phẳng gần như trống (ít chữ) vẫn đi model lớn
+ROUTE_MIN_EDGE_DENSITY = float(os.getenv("ROUTE_MIN_EDGE_DENSITY", "0.01"))
+ROUTE_FAST_MAX_IMAGES = int(os.getenv("ROUTE_FAST_MAX_IMAGES", "8"))
+
+# Thống kê trong process (reset khi restart); latency giữ các mẫu gần nhất để tính percentile
+_LATENCY_SAMPLES = 500
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def is_text_dense(info: Dict[str, Any]) -> bool:
+    return bool(info.get("document")) and info.get("edge_density", 0.0) >= ROUTE_MIN_EDGE_DENSITY
+
+
+def route_first_pass(image_info: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Tier cho PASS 1 theo describe_image() của các ảnh sẽ gửi: chỉ toàn screenshot nhiều chữ mới đi tier nhanh"""
+    if not MODEL_ROUTING_ENABLED:
+        tier, reason = "large", "routing_disabled"
+    elif not image_info or len(image_info) > ROUTE_FAST_MAX_IMAGES:
+        tier, reason = "large", "image_count"
+    elif all(is_text_dense(info) for info in image_info):
+        tier, reason = "fast", "text_dense"
+    else:
+        tier, reason = "large", "photos"
+    return {"tier": tier, "model": MODEL_TIERS[tier]["model"], "reason": reason}
+
+
+def routing_signature() -> str:
+    """Phần cấu hình routing trong analysis_cache_version (đổi model / ngưỡng -> không dùng kết quả cache cũ)"""
+    if not MODEL_ROUTING_ENABLED:
+        return f"noroute-{MODEL_TIERS['large']['model']}"
+    return f"route-{MODEL_TIERS['fast']['model']}-{MODEL_TIERS['large']['model']}-{ROUTE_MIN_EDGE_DENSITY:g}"
+
+
+def _tier_stats(tier: str) -> Dict[str, Any]:
+    return _stats.setdefault(tier, {
+        "calls": 0, "failures": 0, "input_tokens": 0, "output_tokens": 0,
+        "first_pass_calls": 0, "critical_fields_expected": 0, "critical_fields_found": 0,
+        "escalations": 0, "latencies": deque(maxlen=_LATENCY_SAMPLES)
+    })
+
+
+def record_call(tier: str, result: Dict[str, Any]) -> None:
+    """Một lần gọi model của tier: latency, token, lỗi"""
+    with _stats_lock:
+        stats = _tier_stats(tier)
+        stats["calls"] += 1
+        if not result.get("success") or result.get("warning"):
+            stats["failures"] += 1
+        usage = result.get("usage") or {}
+        stats["input_tokens"] += usage.get("input_tokens") or 0
+        stats["output_tokens"] += usage.get("output_tokens") or 0
+        if result.get("latency_ms") is not None:
+            stats["latencies"].append(result["latency_ms"])
+
+
+def record_first_pass(tier: str, missing_fields: List[str], expected_fields: int) -> None:
+    """Kết quả PASS 1 (sau khi gộp các nhóm ảnh nếu chạy song song): số trường quan trọng đọc được"""
+    with _stats_lock:
+        stats = _tier_stats(tier)
+        stats["first_pass_calls"] += 1
+        stats["critical_fields_expected"] += expected_fields
+        stats["critical_fields_found"] += expected_fields - len(missing_fields)
+
+
+def record_escalation(tier: str) -> None:
+    with _stats_lock:
+        _tier_stats(tier)["escalations"] += 1
+
+
+def get_stats() -> Dict[str, Any]:
+    """Latency / token / độ đầy đủ trường quan trọng (PASS 1) và tỉ lệ escalate theo từng tier"""
+    with _stats_lock:
+        snapshot = {tier: {**stats, "latencies": list(stats["latencies"])} for tier, stats in _stats.items()}
+
+    tiers = {}
+    for tier, stats in snapshot.items():
+        latencies = stats.pop("latencies")
+        calls, first_pass = stats["calls"], stats["first_pass_calls"]
+        tiers[tier] = {
+            **stats,
+            "model": MODEL_TIERS.get(tier, {}).get("model"),
+            **percentile_stats(latencies, "latency_ms"),
+            "avg_input_tokens": round(stats["input_tokens"] / calls, 1) if calls else 0.0,
+            "critical_field_rate": round(stats["critical_fields_found"] / stats["critical_fields_expected"], 4)
+            if stats["critical_fields_expected"] else None,
+            "escalation_rate": round(stats["escalations"] / first_pass, 4) if first_pass else 0.0
+        }
+    return {
+        "tiers": tiers,
+        "config": {
+            "enabled": MODEL_ROUTING_ENABLED,
+            "models": {tier: config["model"] for tier, config in MODEL_TIERS.items()},
+            "escalation_tier": ESCALATION_TIER,
+            "min_edge_density": ROUTE_MIN_EDGE_DENSITY,
+            "fast_max_images": ROUTE_FAST_MAX_IMAGES
+        }
+    }
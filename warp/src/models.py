@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, JSON, ForeignKey, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, JSON, ForeignKey, Boolean, event, update
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from datetime import datetime
@@ -79,6 +79,117 @@ class PropertyImage(Base):
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     
     report = relationship("PropertyReport", back_populates="images")
+    renditions = relationship("PropertyImageRendition", back_populates="image", cascade="all, delete-orphan")
+    # Ảnh upload qua API trỏ tới blob dùng chung (cùng s3_key); ảnh cũ / presigned có thể không có blob
+    blob = relationship(
+        "ImageBlob", primaryjoin="foreign(PropertyImage.s3_key) == ImageBlob.s3_key", viewonly=True, uselist=False
+    )
+
+
+class PropertyImageRendition(Base):
+    """Derivative of a PropertyImage (thumbnail 256 px, preview 1024 px, WebP preview) tạo lúc ingest"""
+    __tablename__ = "property_image_renditions"
+    
+    id = Column(Integer, primary_key=True)
+    image_id = Column(Integer, ForeignKey("property_images.id"), index=True)
+    kind = Column(String)  # thumbnail, preview, preview_webp
+    s3_url = Column(String)
+    s3_key = Column(String)
+    content_type = Column(String)
+    
+    image = relationship("PropertyImage", back_populates="renditions")
+
+
+class ImageBlob(Base):
+    """Content-addressed image object in S3: một object cho mỗi SHA-256, dùng chung giữa các upload / user"""
+    __tablename__ = "image_blobs"
+    
+    sha256 = Column(String(64), primary_key=True)
+    s3_key = Column(String, unique=True, index=True)
+    s3_url = Column(String)
+    content_type = Column(String)
+    size_bytes = Column(Integer)
+    renditions = Column(JSON, nullable=True)  # {kind: {"url", "key", "width", "height", "bytes"}}
+    ref_count = Column(Integer, default=0)  # Số PropertyImage đang trỏ tới (cập nhật bởi mapper event bên dưới)
+    seen_count = Column(Integer, default=1)  # Số lần được upload: lần đầu + các lần trùng đã bỏ qua
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_seen_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class UserBlob(Base):
+    """Blob key đã cấp cho một user (upload mới hoặc dùng lại blob trùng); report của user chỉ được trỏ tới các key này"""
+    __tablename__ = "user_blobs"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    s3_key = Column(String, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+@event.listens_for(PropertyImage, "after_insert")
+def _reference_blob(mapper, connection, target):
+    if target.s3_key:
+        connection.execute(
+            update(ImageBlob).where(ImageBlob.s3_key == target.s3_key).values(ref_count=ImageBlob.ref_count + 1)
+        )
+
+
+@event.listens_for(PropertyImage, "after_delete")
+def _release_blob(mapper, connection, target):
+    if target.s3_key:
+        connection.execute(
+            update(ImageBlob).where(ImageBlob.s3_key == target.s3_key).values(ref_count=ImageBlob.ref_count - 1)
+        )
+
+
+class AnalysisCache(Base):
+    """LLM analysis result cache, keyed by sorted image SHA-256 hashes + prompt/model version"""
+    __tablename__ = "analysis_cache"
+    
+    cache_key = Column(String(64), primary_key=True)
+    prompt_version = Column(String)
+    result = Column(JSON)
+    llm_seconds = Column(Float, default=0.0)  # Thời gian gọi LLM để tạo kết quả này
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    last_hit_at = Column(DateTime, nullable=True, index=True)
+
+
+class AnalysisJob(Base):
+    """Background image analysis job (async mode of upload-and-analyze)"""
+    __tablename__ = "analysis_jobs"
+
+    id = Column(String(36), primary_key=True)  # uuid4
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    status = Column(String, default="queued", index=True)  # queued, running, succeeded, failed
+    stage = Column(String, nullable=True)  # Bước đang chạy: preprocessing, analysis, uploading...
+    inputs = Column(JSON)  # [{"filename", "path", "bytes"}] - ảnh đã lưu tạm chờ worker xử lý
+    progress = Column(JSON, nullable=True)  # images_uploaded, fields_found, missing_fields
+    result = Column(JSON, nullable=True)  # {"data", "images", "usage", "cached"}
+    error = Column(Text, nullable=True)
+    timings = Column(JSON, nullable=True)  # queue_wait_ms + stage timings (ms) của pipeline
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class LLMCallLog(Base):
+    """Ledger các lần gọi LLM (ghi theo batch, xem llm_ledger.py); phân tích trả từ cache ghi một dòng pass 0"""
+    __tablename__ = "llm_call_logs"
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)  # Thời điểm gọi
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=True)
+    request_id = Column(String(32), index=True)  # Một lần phân tích (một report) gồm nhiều lần gọi
+    pass_number = Column(Integer)  # 1, 2; 0 = cache hit (không gọi LLM)
+    model = Column(String, nullable=True)
+    image_count = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    latency_ms = Column(Float, nullable=True)
+    cache_hit = Column(Boolean, default=False)
+    success = Column(Boolean, default=True)
+    degraded = Column(Boolean, default=False)  # Chạy ở chế độ giảm cấp do user đã hết budget
 
 
 # Create tables
@@ -0,0 +1,16 @@
+# percentiles.py - Percentile (nearest-rank) cho các endpoint thống kê và benchmarks
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+
+def percentile(values: Iterable[float], q: float, default: Optional[float] = 0.0) -> Optional[float]:
+    """Percentile q (0..1) theo nearest-rank, làm tròn 1 chữ số; `default` khi chưa có mẫu nào"""
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1) if ordered else default
+
+
+def percentile_stats(values: Iterable[float], prefix: str = "", quantiles: Sequence[float] = (0.5, 0.95),
+                     default: Optional[float] = 0.0) -> Dict[str, Any]:
+    """{"<prefix>_p50": ..., "<prefix>_p95": ...} (không có prefix: {"p50": ..., "p95": ...})"""
+    ordered = sorted(values)
+    key = f"{prefix}_" if prefix else ""
+    return {f"{key}p{round(q * 100)}": percentile(ordered, q, default) for q in quantiles}
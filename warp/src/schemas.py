@@ -82,4 +82,18 @@ class AnalysisResponse(BaseModel):
 
 
 class AnalysisRequest(BaseModel):
-    images: List[str]  # base64 encoded
\ No newline at end of file
+    images: List[str]  # base64 encoded
+
+class PresignFile(BaseModel):
+    filename: str
+    content_type: str = "image/jpeg"
+    size: Optional[int] = None  # bytes; ký vào URL (PUT) / policy (POST) để S3 từ chối file khác kích thước
+
+
+class PresignRequest(BaseModel):
+    files: List[PresignFile]
+    method: str = "put"  # "put" (presigned URL) hoặc "post" (presigned POST policy)
+
+
+class AnalyzeKeysRequest(BaseModel):
+    keys: List[str]  # S3 keys đã upload qua presigned URL
@@ -0,0 +1,125 @@
+# storage.py - S3 storage helpers
+import os
+import logging
+import uuid
+from datetime import datetime
+from io import BytesIO
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# AWS S3 (S3_ENDPOINT_URL trỏ sang S3-compatible khác: MinIO, benchmarks/fake_s3_server.py)
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+s3_client = boto3.client(
+    's3',
+    aws_access_key_id=os.getenv("BUCKET_ACCOUNT_ID"),
+    aws_secret_access_key=os.getenv("BUCKET_SECRET_ACCESS_KEY"),
+    region_name=os.getenv("BUCKET_REGION", "ap-southeast-1"),
+    endpoint_url=S3_ENDPOINT_URL,
+    config=Config(s3={"addressing_style": "path"}) if S3_ENDPOINT_URL else None
+)
+
+S3_BUCKET = os.getenv("BUCKET_NAME", "ai-asset-valuation")
+AWS_REGION = os.getenv("BUCKET_REGION", "ap-southeast-1")
+PRESIGN_EXPIRES_SECONDS = int(os.getenv("PRESIGN_EXPIRES_SECONDS", "900"))
+
+
+def build_asset_key(user_id: int, filename: str) -> str:
+    """assets/{year}/{month}/{user_id}/{timestamp}_{uuid}_{filename} - uuid để 2 file cùng tên trong cùng giây không ghi đè nhau"""
+    now = datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    year_month = now.strftime("%Y/%m")
+    return f"assets/{year_month}/{user_id}/{timestamp}_{uuid.uuid4().hex[:12]}_{os.path.basename(filename)}"
+
+
+def content_key(sha256: str) -> str:
+    """Content-addressed key: blobs/{sha[:2]}/{sha} - cùng nội dung luôn cùng một object (không theo tên file)"""
+    return f"blobs/{sha256[:2]}/{sha256}"
+
+
+def rendition_key(key: str, kind: str, extension: str) -> str:
+    """assets/.../{user_id}/{name}.jpg -> assets/.../{user_id}/renditions/{name}_{kind}.{extension}"""
+    directory, _, name = key.rpartition("/")
+    return f"{directory}/renditions/{os.path.splitext(name)[0]}_{kind}.{extension}"
+
+
+def is_user_asset_key(key: str, user_id: int) -> bool:
+    parts = key.split("/")
+    return len(parts) == 5 and parts[0] == "assets" and parts[3] == str(user_id) and ".." not in parts
+
+
+def s3_object_url(key: str) -> str:
+    if S3_ENDPOINT_URL:
+        return f"{S3_ENDPOINT_URL.rstrip('/')}/{S3_BUCKET}/{key}"
+    return f"https://{S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{key}"
+
+
+def upload_to_s3(file_content, user_id: int, filename: str, key: str = None,
+                 content_type: str = "image/jpeg", cache_control: str = None) -> dict:
+    """
+    Upload file to S3 (bytes hoặc file object - file object được upload_fileobj đọc theo chunk).
+    `key` mặc định là build_asset_key(user_id, filename).
+    """
+    try:
+        s3_key = key or build_asset_key(user_id, filename)
+        extra_args = {'ContentType': content_type}
+        if cache_control:
+            extra_args['CacheControl'] = cache_control
+        
+        s3_client.upload_fileobj(
+            BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content,
+            S3_BUCKET,
+            s3_key,
+            ExtraArgs=extra_args
+        )
+        
+        return {"success": True, "url": s3_object_url(s3_key), "key": s3_key}
+    except Exception as e:
+        logger.error(f"S3 upload error: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+def create_presigned_upload(user_id: int, filename: str, content_type: str = "image/jpeg",
+                            size: int = None, method: str = "put", max_bytes: int = None) -> dict:
+    """
+    Presigned upload thẳng lên S3 (không đi qua API) dưới assets/{year}/{month}/{user_id}/.
+    PUT: URL đã ký Content-Type (+ Content-Length nếu biết size). POST: policy giới hạn content-length-range.
+    """
+    key = build_asset_key(user_id, filename)
+    if method == "post":
+        conditions = [{"Content-Type": content_type}]
+        if max_bytes:
+            conditions.append(["content-length-range", 1, max_bytes])
+        post = s3_client.generate_presigned_post(
+            S3_BUCKET, key,
+            Fields={"Content-Type": content_type},
+            Conditions=conditions,
+            ExpiresIn=PRESIGN_EXPIRES_SECONDS
+        )
+        return {"key": key, "method": "POST", "url": post["url"], "fields": post["fields"],
+                "public_url": s3_object_url(key), "expires_in": PRESIGN_EXPIRES_SECONDS}
+
+    params = {"Bucket": S3_BUCKET, "Key": key, "ContentType": content_type}
+    if size:
+        params["ContentLength"] = size
+    url = s3_client.generate_presigned_url("put_object", Params=params, ExpiresIn=PRESIGN_EXPIRES_SECONDS)
+    return {"key": key, "method": "PUT", "url": url, "headers": {"Content-Type": content_type},
+            "public_url": s3_object_url(key), "expires_in": PRESIGN_EXPIRES_SECONDS}
+
+
+def delete_s3_object(key: str) -> None:
+    s3_client.delete_object(Bucket=S3_BUCKET, Key=key)
+
+
+def open_s3_object(key: str):
+    """GET object -> (streaming body, size, content type); body được đọc theo chunk bởi người gọi"""
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            raise FileNotFoundError(key) from e
+        raise
+    return response["Body"], response["ContentLength"], response.get("ContentType")
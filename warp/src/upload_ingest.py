@@ -0,0 +1,204 @@
+# upload_ingest.py - Streaming upload ingestion: chunked read, size caps, hash while streaming, disk spooling
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+from typing import List, BinaryIO
+
+from fastapi import UploadFile
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", str(25 * 1024 * 1024)))
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(150 * 1024 * 1024)))
+MAX_UPLOAD_FILES = int(os.getenv("MAX_UPLOAD_FILES", "20"))
+# File nhỏ hơn ngưỡng giữ trong RAM, lớn hơn thì ghi ra đĩa (UPLOAD_SPOOL_DIR, mặc định thư mục temp)
+UPLOAD_SPOOL_THRESHOLD_BYTES = int(os.getenv("UPLOAD_SPOOL_THRESHOLD_BYTES", str(2 * 1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+
+class UploadTooLargeError(ValueError):
+    """Upload vượt giới hạn số file / dung lượng mỗi file / dung lượng cả request (HTTP 413)"""
+
+
+class _PositionalReader(io.RawIOBase):
+    """Reader độc lập (offset riêng, dùng os.pread) trên file spool đã ghi ra đĩa"""
+
+    def __init__(self, fd: int, size: int):
+        self._fd = fd
+        self._size = size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = os.pread(self._fd, min(len(buffer), max(0, self._size - self._pos)), self._pos)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class SpooledUpload:
+    """An ingested upload: SHA-256 and size computed while streaming, content in RAM or spooled to disk"""
+
+    def __init__(self, filename: str, content_type: str, buffer: io.BytesIO, file: BinaryIO, size: int, sha256: str):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.sha256 = sha256
+        self._buffer = buffer  # Nội dung trong RAM (None nếu đã ghi ra đĩa)
+        self._file = file  # File tạm trên đĩa (None nếu nằm trong RAM)
+
+    @property
+    def on_disk(self) -> bool:
+        return self._file is not None
+
+    @property
+    def path(self) -> str:
+        """Đường dẫn file spool trên đĩa (None nếu nằm trong RAM) - process con tự mở file thay vì nhận bytes"""
+        return self._file.name if self._file is not None else None
+
+    def open(self) -> BinaryIO:
+        """
+        New independent reader over the content. Decode và S3 upload chạy song song trên các
+        thread khác nhau nên mỗi bên cần offset riêng (không dùng chung file position của spool).
+        """
+        if self.on_disk:
+            return io.BufferedReader(_PositionalReader(self._file.fileno(), self.size), UPLOAD_CHUNK_BYTES)
+        return io.BytesIO(self._buffer.getbuffer())
+
+    def read_bytes(self) -> bytes:
+        with self.open() as reader:
+            return reader.read()
+
+    def close(self) -> None:
+        (self._file or self._buffer).close()
+
+
+class RequestBudget:
+    """Byte budget shared by all files of one request"""
+
+    def __init__(self, limit: int = MAX_UPLOAD_REQUEST_BYTES):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()  # ingest_stream của nhiều file chạy song song trên các thread
+
+    def consume(self, n: int) -> None:
+        with self._lock:
+            self.used += n
+            used = self.used
+        if used > self.limit:
+            raise UploadTooLargeError(f"Request exceeds {self.limit // (1024 * 1024)} MB upload limit")
+
+
+class _SpoolWriter:
+    """
+    Chunk sink: kiểm tra giới hạn ngay khi vượt, hash SHA-256 và spool song song với việc đọc.
+    Giữ trong RAM tới UPLOAD_SPOOL_THRESHOLD_BYTES, vượt ngưỡng thì chuyển sang file tạm trên đĩa.
+    """
+
+    def __init__(self, filename: str, content_type: str, budget: RequestBudget):
+        self.filename = filename
+        self.content_type = content_type
+        self.budget = budget
+        self.buffer = io.BytesIO()
+        self.file = None
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > MAX_UPLOAD_FILE_BYTES:
+            raise UploadTooLargeError(_file_limit_message(self.filename))
+        self.budget.consume(len(chunk))
+        self.hasher.update(chunk)
+        if self.file is None and self.size > UPLOAD_SPOOL_THRESHOLD_BYTES:
+            # File có tên để worker của image_pool (process khác) đọc trực tiếp; tự xoá khi close()
+            self.file = tempfile.NamedTemporaryFile(dir=UPLOAD_SPOOL_DIR, prefix="warp-upload-")
+            self.file.write(self.buffer.getbuffer())
+            self.buffer.close()
+            self.buffer = None
+        (self.file or self.buffer).write(chunk)
+
+    def finish(self) -> SpooledUpload:
+        if self.file is not None:
+            self.file.flush()
+        return SpooledUpload(
+            self.filename, self.content_type, self.buffer, self.file, self.size, self.hasher.hexdigest()
+        )
+
+    def close(self) -> None:
+        (self.file or self.buffer).close()
+
+
+def _file_limit_message(filename: str) -> str:
+    return f"{filename} exceeds {MAX_UPLOAD_FILE_BYTES // (1024 * 1024)} MB per-file limit"
+
+
+async def ingest_upload(file: UploadFile, budget: RequestBudget) -> SpooledUpload:
+    """Đọc UploadFile theo chunk vào spool (giới hạn + hash trong lúc đọc)"""
+    # Starlette biết trước kích thước file -> từ chối trước khi đọc byte nào
+    if file.size is not None and file.size > MAX_UPLOAD_FILE_BYTES:
+        raise UploadTooLargeError(_file_limit_message(file.filename))
+
+    writer = _SpoolWriter(file.filename, file.content_type, budget)
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            writer.write(chunk)
+    except BaseException:
+        writer.close()
+        raise
+    return writer.finish()
+
+
+def ingest_stream(stream, filename: str, content_type: str, budget: RequestBudget,
+                  size: int = None) -> SpooledUpload:
+    """Sync variant for a readable stream (vd. S3 StreamingBody); chạy trong thread"""
+    if size is not None and size > MAX_UPLOAD_FILE_BYTES:
+        raise UploadTooLargeError(_file_limit_message(filename))
+
+    writer = _SpoolWriter(filename, content_type, budget)
+    try:
+        while chunk := stream.read(UPLOAD_CHUNK_BYTES):
+            writer.write(chunk)
+    except BaseException:
+        writer.close()
+        raise
+    return writer.finish()
+
+
+async def ingest_uploads(files: List[UploadFile]) -> List[SpooledUpload]:
+    """Ingest all files of a request under MAX_UPLOAD_FILES / MAX_UPLOAD_REQUEST_BYTES"""
+    if len(files) > MAX_UPLOAD_FILES:
+        raise UploadTooLargeError(f"Too many files ({len(files)} > {MAX_UPLOAD_FILES})")
+
+    budget = RequestBudget()
+    if sum(f.size or 0 for f in files) > budget.limit:
+        raise UploadTooLargeError(f"Request exceeds {budget.limit // (1024 * 1024)} MB upload limit")
+
+    uploads: List[SpooledUpload] = []
+    try:
+        for file in files:
+            uploads.append(await ingest_upload(file, budget))
+    except BaseException:
+        for upload in uploads:
+            upload.close()
+        raise
+    spooled = sum(1 for u in uploads if u.on_disk)
+    logger.debug(f"Ingested {len(uploads)} files, {budget.used / (1024 * 1024):.1f} MB, {spooled} spooled to disk")
+    return uploads
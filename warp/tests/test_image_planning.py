@@ -0,0 +1,83 @@
+# test_image_planning.py - detail level chọn cho ảnh gửi vision model (chạy: python -m pytest warp/tests)
+import os
+import sys
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("DATABASE_URL", "sqlite://")  # llm_ledger import models: không tạo file .db
+
+from image_analysis_service import (  # noqa: E402
+    choose_detail, decode_image_for_ocr, describe_image, plan_images, transform_for_ocr
+)
+
+
+def _jpeg(img: Image.Image, quality: int = 90) -> bytes:
+    buffered = BytesIO()
+    img.convert("RGB").save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+def _room_photo(width: int, height: int) -> bytes:
+    """Ảnh chụp phòng: tường / sàn có gradient ánh sáng, cửa sổ, đồ nội thất, nhiễu cảm biến"""
+    rng = np.random.default_rng(7)
+    y = np.linspace(0, 1, height)[:, None, None]
+    x = np.linspace(0, 1, width)[None, :, None]
+    wall = np.array([214, 200, 178]) * (0.75 + 0.25 * x) * np.ones((height, width, 1))
+    floor = np.array([120, 84, 52]) * (0.6 + 0.4 * y)
+    pixels = np.where(y > 0.62, floor, wall)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(img)
+    def box(x0, y0, x1, y1):
+        return [int(width * x0), int(height * y0), int(width * x1), int(height * y1)]
+    draw.rectangle(box(0.55, 0.12, 0.85, 0.48), fill=(176, 208, 236))  # cửa sổ
+    draw.rectangle(box(0.08, 0.45, 0.42, 0.75), fill=(72, 78, 96))  # sofa
+    draw.ellipse(box(0.6, 0.6, 0.8, 0.8), fill=(150, 40, 36))
+    img = img.filter(ImageFilter.GaussianBlur(2))
+    noisy = np.asarray(img, dtype=np.float32) + rng.normal(0, 6, (height, width, 3))
+    return _jpeg(Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8)))
+
+
+def _screenshot(width: int, height: int) -> bytes:
+    img = Image.new("RGB", (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for row in range(12):
+        draw.text((24, 24 + row * 36), f"Diện tích: {60 + row} m² - Phòng ngủ: {row % 4 + 1}", fill=(20, 20, 20))
+    return _jpeg(img)
+
+
+def _describe(content: bytes) -> dict:
+    """Như prepare_image_for_analysis: decode -> transform -> describe_image (kèm kích thước trước khi phóng to)"""
+    img = decode_image_for_ocr(content)
+    source_size = img.size
+    return describe_image(transform_for_ocr(img), source_size)
+
+
+def test_photo_uses_low_detail_in_first_pass():
+    info = _describe(_room_photo(2016, 1512))
+    assert info["document"] is False
+    details, _ = plan_images([info])
+    assert details == ["low"]
+    # PASS 2 truy trường còn thiếu: gửi đủ chi tiết
+    assert choose_detail(info, retry=True) == "high"
+
+
+def test_small_image_stays_low_after_upscale():
+    info = _describe(_screenshot(480, 360))
+    # adaptive_preprocess phóng cạnh ngắn lên >= 512, nhưng ảnh gốc vẫn vừa một ô "low"
+    assert min(info["width"], info["height"]) >= 512
+    assert choose_detail(info) == "low"
+    assert choose_detail(info, retry=True) == "low"
+
+
+def test_screenshot_uses_high_detail():
+    info = _describe(_screenshot(1170, 2532))
+    assert info["document"] is True
+    assert choose_detail(info) == "high"
+
+
+def test_unknown_content_uses_high_detail():
+    assert choose_detail({"width": 1024, "height": 768}) == "high"